@@ -1,3 +1,6 @@
+from ..optim.utils import get_directionality_profile
+
+
 def apply_reaction_variability(tmodel, va, inplace = True):
     """
     Applies the VA results as bounds for the reactions of a cobra_model
@@ -64,13 +67,57 @@ def apply_directionality(tmodel,solution, inplace = True):
 
     for this_reaction in _tmodel.reactions:
 
-        backward_use = _tmodel.backward_use_variable.get_by_id(this_reaction.id)
-        forward_use = _tmodel.forward_use_variable.get_by_id(this_reaction.id)
+        for use_variables in [_tmodel.backward_use_variable,
+                              _tmodel.forward_use_variable]:
+
+            # Use variables removed by the presolve are already fixed
+            if this_reaction.id not in use_variables:
+                continue
 
-        backward_use.variable.lb = round(solution.x_dict[backward_use.name])
-        backward_use.variable.ub = round(solution.x_dict[backward_use.name])
+            the_use = use_variables.get_by_id(this_reaction.id)
+            the_value = round(solution.raw[the_use.name])
+
+            the_use.variable.lb = the_value
+            the_use.variable.ub = the_value
+
+    return _tmodel
 
-        forward_use.variable.lb  = round(solution.x_dict[forward_use.name])
-        forward_use.variable.ub  = round(solution.x_dict[forward_use.name])
 
-    return _tmodel
\ No newline at end of file
+def apply_directionality_lp(tmodel, solution, inplace = False):
+    """
+    Takes a directionality profile and turns the cobra_model into a pure LP:
+    the use variables are fixed at the values of the profile and removed,
+    together with their coupling constraints. The direction of each reaction
+    becomes bounds on its fluxes and on the sign of its DeltaG (see
+    :func:`~.pytfa.ThermoModel.eliminate_use_variables`).
+
+    Unlike :func:`apply_directionality`, further solves (e.g. variability
+    analysis or sampling) are LPs. The continuous variables keep their names,
+    and the profile is kept in the fixed variables of the LP, so that its
+    solutions report the same variables as the ones of the original MILP.
+
+    :param inplace: if False (default), works on a copy and leaves the MILP
+        untouched
+    :param tmodel:
+    :param solution: a solution of the cobra_model (as returned by optimize()),
+        or a directionality profile {use variable name: 0 or 1}
+    :return:
+    """
+
+    if inplace:
+        _tmodel = tmodel
+    else:
+        _tmodel = tmodel.copy()
+
+    if isinstance(solution, dict):
+        profile = solution
+    else:
+        profile = get_directionality_profile(_tmodel, solution)
+
+    _tmodel.eliminate_use_variables(profile)
+
+    if _tmodel.solver.is_integer:
+        _tmodel.logger.warning('The cobra_model still has integer variables '
+                               'that are not use variables')
+
+    return _tmodel
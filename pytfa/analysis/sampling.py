@@ -10,28 +10,86 @@ Sampling wrappers for pytfa models
 
 """
 
+import ctypes
+import hashlib
+import json
+import os
+import pickle
+from collections import OrderedDict
+
 import numpy as np
+import pandas as pd
+from cobra.core import Model, Reaction
+from numpy.lib.format import open_memmap
 from sympy.core.singleton import S
 from time import  time
 from  cobra.flux_analysis.sampling import OptGPSampler, ACHRSampler, HRSampler,\
-                                            shared_np_array
+                                            shared_np_array, bounds_tol, _step,\
+                                            feasibility_tol, Problem
+from cobra.util import constraint_matrices, nullspace
+from multiprocessing import Array, Pool
 from optlang.interface import OPTIMAL
+from scipy.sparse import csr_matrix
+
+from ..optim.utils import continuous_use_variables, get_directionality_profile, \
+    copy_solver_configuration
+from ..optim.constraints import NegativeDeltaG
+from ..optim.variables import DeltaG, LogConcentration
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Warmups already computed, by fingerprint of the sampled problem (see
+# GeneralizedHRSampler.fingerprint). The least recently used entries are
+# dropped after WARMUP_CACHE_SIZE.
+WARMUP_CACHE_SIZE = 8
+_warmup_cache = OrderedDict()
+
+
+def clear_warmup_cache():
+    """
+    Empties the in-memory warmup cache. The files of the disk caches are not
+    removed.
+    """
+    _warmup_cache.clear()
+
 
 class GeneralizedHRSampler(HRSampler):
 
-    def __init__(self, model, thinning,  nproj=None, seed=None):
+    def __init__(self, model, thinning,  nproj=None, seed=None, copy=True,
+                 max_warmup=None, warmup_dtype=np.float64, cache=True,
+                 cache_dir=None):
         """
         Adapted from cobra.flux_analysis.sampling.py
         _________________________________________
 
         Initialize a new sampler object.
+
+        :param copy: if False, the sampler works on the model itself instead
+            of a copy. The objective is restored after the warmup.
+        :param max_warmup: maximum number of warmup points kept, see
+            :meth:`generate_fva_warmup`. By default all are kept.
+        :param warmup_dtype: numpy dtype of the stored warmup points,
+            np.float32 halves their memory. The points are kept within their
+            bounds, but the rounding makes the samples violate the equalities
+            by about 1e-7 times the magnitude of the fluxes.
+        :param cache: if True, the warmup is reused if the same problem was
+            already sampled, see :meth:`generate_fva_warmup`
+        :param cache_dir: optional directory where the warmups are also saved,
+            to be reused across sessions
         """
         # This currently has to be done to reset the solver basis which is
         # required to get deterministic warmup point generation
         # (in turn required for a working `seed` arg)
         if model.solver.is_integer:
             raise TypeError("sampling does not work with integer problems :(")
-        self.model = model.copy()
+        if copy:
+            self.model = model.copy()
+        else:
+            self.model = model
 
         self.thinning = thinning
 
@@ -42,14 +100,18 @@ class GeneralizedHRSampler(HRSampler):
         self.n_samples = 0
         self.retries = 0
         
-        # Careful, double underscore names are mangled to the class name
-        self.problem = self._HRSampler__build_problem()
+        self.problem = self._build_problem()
 
         # Set up a map from reaction -> forward/reverse variable
         var_idx = {v: idx for idx, v in enumerate(self.model.variables)}
         self.var_idx = np.array(
             [var_idx[v] for v in self.model.variables])
         self.warmup = None
+        self.warmup_center = None
+        self.max_warmup = max_warmup
+        self.warmup_dtype = np.dtype(warmup_dtype)
+        self.cache = cache
+        self.cache_dir = cache_dir
         if seed is None:
             self._seed = int(time())
         else:
@@ -57,45 +119,375 @@ class GeneralizedHRSampler(HRSampler):
         # Avoid overflow
         self._seed = self._seed % np.iinfo(np.int32).max
 
-    def generate_fva_warmup(self):
+    def _build_problem(self):
+        """
+        Adapted from cobra.flux_analysis.sampling.py
+        __________________________________________
+
+        Build the matrix representation of the sampling problem. Unlike the
+        original, it also works for problems without equality constraints.
+        """
+        n_vars = len(self.model.variables)
+        prob = constraint_matrices(self.model, zero_tol=feasibility_tol)
+        equalities = np.reshape(prob.equalities, (-1, n_vars))
+        b = np.reshape(prob.b, (-1, ))
+        inequalities = np.reshape(prob.inequalities, (-1, n_vars))
+        bounds = np.atleast_2d(prob.bounds).T
+        var_bounds = np.atleast_2d(prob.variable_bounds).T
+        homogeneous = all(np.abs(b) < feasibility_tol)
+        fixed_non_zero = np.abs(prob.variable_bounds[:, 1]) > feasibility_tol
+        fixed_non_zero &= prob.variable_fixed
+        # check if there are any non-zero fixed variables, add them as
+        # equalities to the stoichiometric matrix
+        if any(fixed_non_zero):
+            n_fixed = fixed_non_zero.sum()
+            rows = np.zeros((n_fixed, n_vars))
+            rows[range(n_fixed), np.where(fixed_non_zero)] = 1.0
+            equalities = np.vstack([equalities, rows])
+            var_b = prob.variable_bounds[:, 1]
+            b = np.hstack([b, var_b[fixed_non_zero]])
+            homogeneous = False
+        # Set up a projection that can cast point into the nullspace
+        if equalities.shape[0] > 0:
+            nulls = nullspace(equalities)
+        else:
+            nulls = np.eye(n_vars)
+        # convert bounds to a matrix and add variable bounds as well
+        return Problem(
+            equalities=shared_np_array(equalities.shape, equalities),
+            b=shared_np_array(b.shape, b),
+            inequalities=shared_np_array(inequalities.shape, inequalities),
+            bounds=shared_np_array(bounds.shape, bounds),
+            variable_fixed=shared_np_array(prob.variable_fixed.shape,
+                                           prob.variable_fixed, integer=True),
+            variable_bounds=shared_np_array(var_bounds.shape, var_bounds),
+            nullspace=shared_np_array(nulls.shape, nulls),
+            homogeneous=homogeneous
+        )
+
+    def generate_fva_warmup(self, processes=1):
         """
         Adapted from cobra.flux_analysis.sampling.py
         __________________________________________
 
         Generate the warmup points for the sampler.
 
-        Generates warmup points by setting each flux as the sole objective
-        and minimizing/maximizing it. Also caches the projection of the
-        warmup points into the nullspace for non-homogeneous problems (only
-        if necessary).
-        """
-        self.n_warmup = 0
-        idx = np.hstack([self.var_idx])
-        self.warmup = np.zeros((len(idx), len(self.model.variables)))
-        self.model.objective = S.Zero
-        self.model.objective.direction = "max"
-        variables = self.model.variables
-        for i in idx:
-            # Omit fixed reactions
-            if self.problem.variable_fixed[i]:
-                self.model.logger.info("skipping fixed variable %s" % variables[i].name)
-                continue
-            self.model.objective.set_linear_coefficients({variables[i]: 1})
-            self.model.slim_optimize()
-            if not self.model.solver.status == OPTIMAL:
-                self.model.logger.info(
-                    "can not maximize variable %s, skipping it" % variables[
-                        i].name)
-                continue
-            primals = self.model.solver.primal_values
-            sol = [primals[v.name] for v in self.model.variables]
-            self.warmup[self.n_warmup,] = sol
-            self.n_warmup += 1
-            # revert objective
-            self.model.objective.set_linear_coefficients({variables[i]: 0})
-        # Shrink warmup points to measure
-        self.warmup = shared_np_array((self.n_warmup, len(variables)),
-                                      self.warmup[0:self.n_warmup, ])
+        Generates warmup points by setting each variable as the sole objective
+        and maximizing it, then minimizing it. With one process, a variable
+        that is already at its upper (lower) bound in a previous warmup point
+        is not maximized (minimized), since it would give nothing new. Most
+        flux variables are at their lower bound, 0, in the first points, so
+        they are only maximized, while the signed thermodynamic variables
+        (log concentrations, DeltaGs) are pushed both ways.
+
+        With several processes, the optimizations are split in one
+        contiguous chunk per process. Each chunk is solved on a new replica
+        of the model, unpickled from the same snapshot, and skips the
+        optimizations already covered by its own points. The points do not
+        depend on which process solves which chunk, or finishes first: they
+        are collected in the order of the chunks. Each process sends back
+        the distinct points of its chunk only.
+
+        The points are stored as they come, without a dense variables x
+        variables matrix: identical points (up to bounds_tol) are kept once,
+        they are stored with the warmup_dtype of the sampler, and if
+        max_warmup is set, a uniform random subset of max_warmup points is
+        kept (reservoir sampling). The center of the warmup, warmup_center,
+        is a running mean over all the distinct points, including the ones
+        that were not kept.
+
+        If the cache of the sampler is on, the warmup is looked up by the
+        fingerprint of the problem (see :meth:`fingerprint`) first in memory,
+        then in cache_dir, and only generated if it is not found. The
+        generated warmup is stored in both. With max_warmup, the cached
+        subset of points is the one chosen by the first seed.
+
+        :param processes: number of processes used for the warmup
+        """
+        if self.cache and self._load_cached_warmup(processes):
+            return
+
+        n_vars = len(self.model.variables)
+        # Omit fixed variables
+        idx = [i for i in self.var_idx if not self.problem.variable_fixed[i]]
+        self.model.logger.info('skipping {} fixed variables'
+                               .format(len(self.var_idx) - len(idx)))
+
+        var_bounds = self.problem.variable_bounds
+        # Maximizations first, then minimizations
+        tasks = [(i, 1) for i in idx] + [(i, -1) for i in idx]
+
+        points = []
+        seen = set()
+        total = np.zeros(n_vars)
+        n_points = 0
+        n_distinct = 0
+        random_state = np.random.RandomState(self._seed)
+
+        # The original objective is restored when leaving the context
+        with self.model:
+            if processes > 1:
+                snapshot = pickle.dumps(self.model)
+                size = -(-len(tasks) // processes)
+                chunks = [tasks[k:k + size]
+                          for k in range(0, len(tasks), size)]
+                with Pool(processes, initializer=_init_warmup_worker,
+                          initargs=(self.model, snapshot,
+                                    var_bounds)) as pool:
+                    chunks = pool.map(_warmup_chunk, chunks, chunksize=1)
+                # The duplicates already dropped by the processes
+                n_points = sum(n_duplicates for n_duplicates, _ in chunks)
+                results = (point for _, chunk in chunks for point in chunk)
+            else:
+                results = _warmup_points(self.model, tasks, var_bounds)
+
+            for point in results:
+                if point is None:
+                    continue
+                n_points += 1
+
+                key = hash(np.round(point / bounds_tol).tobytes())
+                if key in seen:
+                    continue
+                seen.add(key)
+                n_distinct += 1
+                total += point
+
+                point = _cast_within_bounds(point, self.warmup_dtype,
+                                            self.problem.variable_bounds)
+                if self.max_warmup is None or len(points) < self.max_warmup:
+                    points.append(point)
+                else:
+                    j = random_state.randint(n_distinct)
+                    if j < self.max_warmup:
+                        points[j] = point
+
+        self.model.logger.info('warmup: {} points, {} distinct, {} kept, {} '
+                               'optimizations skipped as the variable was '
+                               'already at its bound'
+                               .format(n_points, n_distinct, len(points),
+                                       len(tasks) - n_points))
+
+        self.n_warmup = len(points)
+        self.warmup = _shared_warmup_array(np.array(points, ndmin=2),
+                                           self.warmup_dtype)
+        self.warmup_center = total / max(n_distinct, 1)
+
+        if self.cache:
+            self._save_cached_warmup(processes)
+
+    def fingerprint(self, processes=1):
+        """
+        Hash of everything the warmup depends on: the names and bounds of the
+        variables, the names, bounds and coefficients of the constraints, the
+        warmup options of the sampler, and the number of processes of the
+        warmup, which sets its chunks of optimizations.
+
+        :param processes: number of processes used for the warmup
+        :return: hexadecimal string
+        """
+        sha = hashlib.sha1()
+        for names in (self.model.variables, self.model.constraints):
+            sha.update('\n'.join(x.name for x in names).encode())
+        problem = self.problem
+        for array in (problem.equalities, problem.b, problem.inequalities,
+                      problem.bounds, problem.variable_bounds):
+            sha.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+        sha.update(repr((self.max_warmup, self.warmup_dtype.str,
+                         processes)).encode())
+        return sha.hexdigest()
+
+    def _cache_file(self, key):
+        return os.path.join(self.cache_dir, 'warmup_{}.npz'.format(key))
+
+    def _load_cached_warmup(self, processes=1):
+        """
+        :return: True if the warmup was found in the memory or disk cache
+        """
+        key = self.fingerprint(processes)
+
+        if key in _warmup_cache:
+            _warmup_cache.move_to_end(key)
+            warmup, center = _warmup_cache[key]
+            where = 'memory'
+        elif self.cache_dir is not None \
+                and os.path.exists(self._cache_file(key)):
+            with np.load(self._cache_file(key)) as data:
+                warmup, center = data['warmup'], data['center']
+            _store_warmup(key, warmup, center)
+            where = self._cache_file(key)
+        else:
+            return False
+
+        self.n_warmup = warmup.shape[0]
+        self.warmup = _shared_warmup_array(warmup, self.warmup_dtype)
+        self.warmup_center = center.copy()
+        self.model.logger.info('warmup: {} points loaded from the cache ({})'
+                               .format(self.n_warmup, where))
+        return True
+
+    def _save_cached_warmup(self, processes=1):
+        key = self.fingerprint(processes)
+        # Private copy, the shared array of the sampler can be modified
+        _store_warmup(key, np.array(self.warmup), self.warmup_center.copy())
+
+        if self.cache_dir is not None:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            # Written under a temporary name, so that a concurrent reader
+            # never sees a partial file
+            tmp_file = self._cache_file(key) + '.{}.tmp'.format(os.getpid())
+            with open(tmp_file, 'wb') as fid:
+                np.savez(fid, warmup=self.warmup, center=self.warmup_center)
+            os.replace(tmp_file, self._cache_file(key))
+
+
+def _store_warmup(key, warmup, center):
+    """
+    Adds a warmup to the in-memory cache, dropping the least recently used
+    ones beyond WARMUP_CACHE_SIZE.
+    """
+    _warmup_cache[key] = (warmup, center)
+    _warmup_cache.move_to_end(key)
+    while len(_warmup_cache) > WARMUP_CACHE_SIZE:
+        _warmup_cache.popitem(last=False)
+
+
+def _cast_within_bounds(point, dtype, bounds):
+    """
+    Casts a point to dtype. Values that the rounding moves out of their
+    bounds are moved back to the nearest representable value within them,
+    otherwise the sampler can get stuck at the bounds.
+
+    :param point: numpy array
+    :param dtype: numpy dtype
+    :param bounds: array of the lower and upper bounds, of shape (2, len(point))
+    :return: numpy array of type dtype
+    """
+    cast = point.astype(dtype)
+    if cast.dtype == point.dtype:
+        return cast
+
+    # Nearest values of dtype within the bounds
+    lb, ub = bounds.astype(dtype)
+    outside = lb < bounds[0, ]
+    lb[outside] = np.nextafter(lb[outside], dtype.type(np.inf))
+    outside = ub > bounds[1, ]
+    ub[outside] = np.nextafter(ub[outside], dtype.type(-np.inf))
+
+    return np.clip(cast, lb, ub)
+
+
+def _shared_warmup_array(data, dtype):
+    """
+    Same as cobra.flux_analysis.sampling.shared_np_array, for float64 or
+    float32 data.
+
+    :param data: 2D numpy array
+    :param dtype: np.float64 or np.float32
+    :return: a numpy array in shared memory
+    """
+    if np.dtype(dtype) == np.float64:
+        return shared_np_array(data.shape, data)
+    elif np.dtype(dtype) == np.float32:
+        array = Array(ctypes.c_float, int(np.prod(data.shape)))
+        np_array = np.frombuffer(array.get_obj(), dtype=np.float32)
+        np_array = np_array.reshape(data.shape)
+        np_array[:] = data
+        return np_array
+    else:
+        raise ValueError('warmup_dtype must be np.float64 or np.float32')
+
+
+# Has to be declared outside of the class to be used for multiprocessing
+def _init_warmup_worker(model, snapshot, var_bounds):
+    """
+    Initializes a process of the warmup pool. With fork, the model and the
+    snapshot are inherited from the parent process.
+
+    :param model: the model to solve, whose solver configuration is copied
+        to the replicas
+    :param snapshot: the pickled model, from which the replica of each chunk
+        is made
+    :param var_bounds: lower and upper bounds of the variables
+    """
+    global _warmup_data
+    _warmup_data = (model, snapshot, var_bounds)
+
+
+def _warmup_chunk(tasks):
+    """
+    Solves a chunk of the warmup optimizations on a new replica of the model,
+    so that the points do not depend on the chunks the process solved
+    before.
+
+    :param tasks: list of (index of the variable, 1 to maximize or -1 to
+        minimize)
+    :return: (number of duplicate points dropped, list of the distinct
+        points)
+    """
+    model, snapshot, var_bounds = _warmup_data
+    replica = pickle.loads(snapshot)
+    copy_solver_configuration(model, replica)
+
+    points = list()
+    seen = set()
+    n_duplicates = 0
+    for point in _warmup_points(replica, tasks, var_bounds):
+        if point is None:
+            continue
+        key = hash(np.round(point / bounds_tol).tobytes())
+        if key in seen:
+            n_duplicates += 1
+            continue
+        seen.add(key)
+        points.append(point)
+
+    return n_duplicates, points
+
+
+def _warmup_points(model, tasks, var_bounds):
+    """
+    Maximizes or minimizes variables in turn. A variable that is already at
+    its upper (lower) bound in a previous point is not maximized
+    (minimized).
+
+    :param model: the model to solve
+    :param tasks: iterable of (index of the variable, 1 to maximize or -1 to
+        minimize)
+    :param var_bounds: lower and upper bounds of the variables
+    :return: generator of the solutions as numpy arrays, or None if the
+        variable was skipped or could not be optimized
+    """
+    variables = model.variables
+    # Flags of the variables already at their lower (first row) or upper
+    # (second row) bound
+    covered = np.zeros((2, len(variables)), dtype=bool)
+
+    model.objective = S.Zero
+    model.objective.direction = "max"
+
+    for i, sense in tasks:
+        if covered[(sense + 1) // 2, i]:
+            yield None
+            continue
+
+        model.objective.set_linear_coefficients({variables[i]: sense})
+        model.slim_optimize()
+        # revert objective
+        model.objective.set_linear_coefficients({variables[i]: 0})
+
+        if not model.solver.status == OPTIMAL:
+            model.logger.info(
+                "can not optimize variable %s, skipping it" % variables[i].name)
+            yield None
+            continue
+
+        primals = model.solver.primal_values
+        point = np.array([primals[v.name] for v in variables])
+        covered[0, point <= var_bounds[0, ] + bounds_tol] = 1
+        covered[1, point >= var_bounds[1, ] - bounds_tol] = 1
+        yield point
 
 
 # Next, we redefine the analysis class as both inheriting from the
@@ -104,33 +496,1408 @@ class GeneralizedHRSampler(HRSampler):
 # samplers
 
 class GeneralizedACHRSampler(GeneralizedHRSampler,ACHRSampler):
-    def __init__(self, model, thinning=100, seed=None):
+    def __init__(self, model, thinning=100, seed=None, copy=True,
+                 processes=1, max_warmup=None, warmup_dtype=np.float64,
+                 cache=True, cache_dir=None):
         """
         Adapted from cobra.flux_analysis.analysis
         __________________________________________
-        Initialize a new ACHRSampler."""
-        GeneralizedHRSampler.__init__(self, model, thinning, seed=seed)
-        self.generate_fva_warmup()
-        self.prev = self.center = self.warmup.mean(axis=0)
-        np.random.seed(self._seed)
+        Initialize a new ACHRSampler.
+
+        :param processes: number of processes used for the warmup only, the
+            sampling itself runs in a single process
+        :param max_warmup: see :class:`GeneralizedHRSampler`
+        :param warmup_dtype: see :class:`GeneralizedHRSampler`
+        :param cache: see :class:`GeneralizedHRSampler`
+        :param cache_dir: see :class:`GeneralizedHRSampler`
+        """
+        GeneralizedHRSampler.__init__(self, model, thinning, seed=seed,
+                                      copy=copy, max_warmup=max_warmup,
+                                      warmup_dtype=warmup_dtype, cache=cache,
+                                      cache_dir=cache_dir)
+        self.generate_fva_warmup(processes=processes)
+        self.prev = self.center = self.warmup_center.copy()
+        self.random_state = np.random.RandomState(self._seed)
+
+    def sample(self, n, fluxes=True):
+        """
+        Same as ACHRSampler.sample. Its steps draw from the global numpy
+        generator, which is given the state of the generator of the sampler
+        during the call, and restored afterwards: the chain does not depend
+        on other uses of the global generator, and is saved with the
+        sampler.
+
+        :param n: number of samples
+        :param fluxes: if True, returns the net fluxes of the reactions
+            instead of all the variables
+        :return: pandas.DataFrame with one row per sample
+        """
+        global_state = np.random.get_state()
+        np.random.set_state(self.random_state.get_state())
+        try:
+            return ACHRSampler.sample(self, n, fluxes=fluxes)
+        finally:
+            self.random_state.set_state(np.random.get_state())
+            np.random.set_state(global_state)
 
 class GeneralizedOptGPSampler(GeneralizedHRSampler, OptGPSampler):
-    def __init__(self, model, processes, thinning=100, seed=None):
+    def __init__(self, model, processes, thinning=100, seed=None, copy=True,
+                 max_warmup=None, warmup_dtype=np.float64, cache=True,
+                 cache_dir=None):
         """
         Adapted from cobra.flux_analysis.sampling.py
         __________________________________________
-        Initialize a new OptGPSampler."""
-        GeneralizedHRSampler.__init__(self, model, thinning, seed=seed)
-        self.generate_fva_warmup()
+        Initialize a new OptGPSampler.
+
+        :param max_warmup: see :class:`GeneralizedHRSampler`
+        :param warmup_dtype: see :class:`GeneralizedHRSampler`
+        :param cache: see :class:`GeneralizedHRSampler`
+        :param cache_dir: see :class:`GeneralizedHRSampler`
+        """
+        GeneralizedHRSampler.__init__(self, model, thinning, seed=seed,
+                                      copy=copy, max_warmup=max_warmup,
+                                      warmup_dtype=warmup_dtype, cache=cache,
+                                      cache_dir=cache_dir)
         self.processes = processes
+        self.generate_fva_warmup(processes=processes)
 
         # This maps our saved center into shared memory,
         # meaning they are synchronized across processes
         self.center = shared_np_array((len(self.model.variables), ),
-                                      self.warmup.mean(axis=0))
+                                      self.warmup_center)
+
+        # Last point of each chain of sample_until_converged()
+        self._chain_states = None
+        self._chain_rounds = 0
+        self.diagnostics = None
+
+    def _continue_chains(self, n, n_chains):
+        """
+        Draws n samples from each chain, starting where the chains stopped at
+        the previous call.
+
+        :param n: number of samples per chain
+        :param n_chains:
+        :return: list of arrays of shape (n, number of variables)
+        """
+        if self._chain_states is None:
+            self._chain_states = [None] * n_chains
+        elif len(self._chain_states) != n_chains:
+            self._chain_states = (self._chain_states[:n_chains] + [None] *
+                                  (n_chains - len(self._chain_states)))
+
+        seed = self._seed + self._chain_rounds * n_chains
+        args = [(n, idx, self._chain_states[idx], seed + idx)
+                for idx in range(n_chains)]
+
+        if self.processes > 1:
+            pool = Pool(min(self.processes, n_chains),
+                        initializer=_init_chain_worker, initargs=(self,))
+            results = pool.map(_continue_chain, args, chunksize=1)
+            pool.close()
+            pool.join()
+        else:
+            _init_chain_worker(self)
+            # The chains seed the global numpy generator
+            global_state = np.random.get_state()
+            try:
+                results = [_continue_chain(x) for x in args]
+            finally:
+                np.random.set_state(global_state)
+
+        self.retries += sum(r[0] for r in results)
+        self._chain_states = [r[2] for r in results]
+        self._chain_rounds += 1
+        chains = [r[1] for r in results]
+
+        # Update the global center
+        total = n * n_chains
+        self.center = (self.n_samples * self.center +
+                       sum(x.sum(axis=0) for x in chains)) / (self.n_samples + total)
+        self.n_samples += total
+
+        return chains
+
+    def sample(self, n, fluxes=True):
+        """
+        Adapted from cobra.flux_analysis.sampling.py
+        __________________________________________
+
+        Generates n samples, rounded up to a multiple of the number of
+        processes, with one chain per process.
+
+        Unlike the original, the chains go on from where the previous call
+        stopped instead of restarting from the warmup with the same seeds, so
+        that a run can be extended by calling sample again.
+
+        :param n: number of samples
+        :param fluxes: if True, returns the net fluxes of the reactions
+            instead of all the variables
+        :return: pandas.DataFrame with one row per sample
+        """
+        n_process = int(np.ceil(n / self.processes))
+        samples = np.vstack(self._continue_chains(n_process, self.processes))
+
+        if fluxes:
+            names, pos, neg = _get_column_selection(self.model, 'fluxes')
+            return pd.DataFrame(samples[:, pos] - samples[:, neg],
+                                columns=names)
+
+        return pd.DataFrame(samples,
+                            columns=[x.name for x in self.model.variables])
+
+    def sample_until_converged(self, min_ess=100, max_rhat=1.05,
+                               batch_size=100, max_samples=10000,
+                               n_chains=None, variables=None):
+        """
+        Samples by batches with several chains, that continue from one batch
+        to the next, until the convergence targets are reached for all the
+        monitored variables:
+
+        * the effective sample size (see :func:`effective_sample_size`) of
+          each variable is at least min_ess,
+        * the split-R̂ (see :func:`split_rhat`) of each variable is at most
+          max_rhat.
+
+        The diagnostics are computed after each batch, and the final ones
+        are kept in the diagnostics attribute of the sampler.
+
+        :param min_ess: target effective sample size
+        :param max_rhat: target split-R̂
+        :param batch_size: number of samples drawn by each chain between two
+            checks
+        :param max_samples: total number of samples after which the sampling
+            stops, even if the targets are not reached
+        :param n_chains: number of chains, by default the number of processes
+            (at least 2)
+        :param variables: variables to monitor, see :func:`stream_samples`.
+            By default all the variables are monitored.
+        :return: pandas.DataFrame of all the variables indexed by (chain,
+            sample). The diagnostics attribute is then a pandas.DataFrame
+            with the 'ess' and 'rhat' of each monitored variable.
+        """
+        if n_chains is None:
+            n_chains = max(2, self.processes)
+
+        names, pos, neg = _get_column_selection(self.model, variables)
+        has_neg = neg >= 0
+
+        chains = [[] for _ in range(n_chains)]
+        n_drawn = 0
+
+        while True:
+            for chain, new in zip(chains, self._continue_chains(batch_size,
+                                                                n_chains)):
+                chain.append(new)
+            n_drawn += batch_size * n_chains
+
+            values = np.stack([np.vstack(x) for x in chains])[:, :, pos]
+            if has_neg.any():
+                all_values = np.stack([np.vstack(x) for x in chains])
+                values[:, :, has_neg] -= all_values[:, :, neg[has_neg]]
+
+            ess = effective_sample_size(values)
+            rhat = split_rhat(values)
+
+            self.model.logger.info('sampling: {} samples, min ESS {:.1f}, '
+                                   'max split-R^ {:.3f}'
+                                   .format(n_drawn, ess.min(), rhat.max()))
+
+            if ess.min() >= min_ess and rhat.max() <= max_rhat:
+                break
+            if n_drawn + batch_size * n_chains > max_samples:
+                self.model.logger.warning('sampling: convergence targets not '
+                                          'reached after {} samples'
+                                          .format(n_drawn))
+                break
+
+        self.diagnostics = pd.DataFrame({'ess': ess, 'rhat': rhat},
+                                        index=names)
+
+        samples = pd.concat(
+            OrderedDict((idx, pd.DataFrame(np.vstack(x),
+                                           columns=[v.name for v in
+                                                    self.model.variables]))
+                        for idx, x in enumerate(chains)),
+            names=['chain', 'sample'])
+
+        return samples
+
+
+# Has to be declared outside of the class to be used for multiprocessing
+def _init_chain_worker(obj):
+    """
+    Initializes a process of the chain pool.
+
+    :param obj: the sampler
+    """
+    global _chain_sampler
+    _chain_sampler = obj
+
+
+def _continue_chain(args):
+    """
+    Adapted from cobra.flux_analysis.sampling._sample_chain
+    __________________________________________
+
+    Samples a single chain, starting from a given point instead of a new one.
+
+    :param args: (number of samples, chain index, starting point or None for a
+        new chain, seed)
+    :return: (number of retries of this call, samples, last point)
+    """
+    n, idx, prev, seed = args
+    sampler = _chain_sampler
+    center = sampler.center
+    retries = sampler.retries
+    np.random.seed(seed % np.iinfo(np.int32).max)
+
+    if prev is None:
+        pi = np.random.randint(sampler.n_warmup)
+        prev = _step(sampler, center, sampler.warmup[pi, ] - center, 0.95)
+
+    n_samples = max(sampler.n_samples, 1)
+    samples = np.zeros((n, center.shape[0]))
+
+    for i in range(1, sampler.thinning * n + 1):
+        pi = np.random.randint(sampler.n_warmup)
+        delta = sampler.warmup[pi, ] - center
+
+        prev = _step(sampler, prev, delta)
+        if sampler.problem.homogeneous and (
+                n_samples * sampler.thinning % sampler.nproj == 0):
+            prev = sampler._reproject(prev)
+            center = sampler._reproject(center)
+        if i % sampler.thinning == 0:
+            samples[i//sampler.thinning - 1, ] = prev
+        center = ((n_samples * center) / (n_samples + 1) +
+                  prev / (n_samples + 1))
+        n_samples += 1
+
+    # _step counts the retries on the sampler. They are returned instead, and
+    # added up by the caller, the same way with or without a pool
+    n_retries = sampler.retries - retries
+    sampler.retries = retries
+
+    return n_retries, samples, prev
+
+
+def _split_chains(chains):
+    """
+    Splits each chain in two halves, dropping the middle sample of chains
+    with an odd length.
+
+    :param chains: array of shape (chains, samples, variables)
+    :return: array of shape (2*chains, samples//2, variables)
+    """
+    half = chains.shape[1] // 2
+    return np.concatenate([chains[:, :half], chains[:, -half:]], axis=0)
+
+
+def _between_within_variances(chains):
+    """
+    :param chains: array of shape (chains, samples, variables)
+    :return: (within-chain variance W, pooled variance estimate var+)
+    """
+    n = chains.shape[1]
+    within = chains.var(axis=1, ddof=1).mean(axis=0)
+    between = n * chains.mean(axis=1).var(axis=0, ddof=1)
+    var_plus = (n - 1) / n * within + between / n
+    return within, var_plus
+
+
+def split_rhat(chains):
+    """
+    Split-R̂ of each variable (Gelman et al., Bayesian Data Analysis, 3rd
+    ed.). Values close to 1 mean the chains have mixed. Variables that are
+    constant in all the chains get 1.
+
+    :param chains: array of shape (chains, samples, variables)
+    :return: array of the split-R̂ of each variable
+    """
+    within, var_plus = _between_within_variances(_split_chains(chains))
+
+    rhat = np.ones(within.shape)
+    mixed = within > 0
+    rhat[mixed] = np.sqrt(var_plus[mixed] / within[mixed])
+    # Constant in each chain, but not the same constant
+    rhat[~mixed & (var_plus > 0)] = np.inf
+    return rhat
+
+
+def effective_sample_size(chains):
+    """
+    Effective sample size of each variable, computed on split chains from
+    their autocorrelation, truncated with Geyer's initial positive sequence
+    (Gelman et al., Bayesian Data Analysis, 3rd ed.). Variables that are
+    constant get the number of samples.
+
+    :param chains: array of shape (chains, samples, variables)
+    :return: array of the effective sample size of each variable
+    """
+    chains = _split_chains(chains)
+    m, n, _ = chains.shape
+    within, var_plus = _between_within_variances(chains)
+
+    # Autocovariance of each chain, by FFT
+    centered = chains - chains.mean(axis=1, keepdims=True)
+    size = 2 ** int(np.ceil(np.log2(2 * n)))
+    transform = np.fft.rfft(centered, n=size, axis=1)
+    acov = np.fft.irfft(transform * np.conjugate(transform), n=size,
+                        axis=1)[:, :n] / n
+
+    ess = np.full(within.shape, float(m * n))
+    mixed = var_plus > 0
+    rho = 1 - (within[mixed] - acov.mean(axis=0)[:, mixed]) / var_plus[mixed]
+    rho[0] = 1
+
+    # Sum of the autocorrelations, while the sums of consecutive pairs stay
+    # positive
+    n_pairs = n // 2
+    pairs = rho[0:2 * n_pairs:2] + rho[1:2 * n_pairs:2]
+    positive = np.cumprod(pairs > 0, axis=0).astype(bool)
+    tau = -1 + 2 * (pairs * positive).sum(axis=0)
+    tau = np.maximum(tau, 1 / np.log10(m * n))
+
+    ess[mixed] = m * n / tau
+    return ess
+
+
+class GeneralizedBatchSampler(GeneralizedHRSampler):
+    """
+    Artificial centering hit-and-run over many chains at once.
+
+    All the chains take their step together, as numpy operations on a
+    (chains x variables) matrix: the directions are drawn as a matrix from
+    the warmup points and the center, the step bounds are computed against
+    all the variable bounds and (sparse) inequality constraints at once, and
+    homogeneous problems are reprojected as a batch. This removes most of the
+    per-step Python overhead of ACHRSampler, on a single core.
+
+    The directions are combinations of warmup points, so the variables that
+    have the same value in all the warmup points never move. The chains are
+    only stepped on the other ones, the active variables.
+
+    The center is shared by the chains, and updated with all their points.
+    """
+
+    def __init__(self, model, n_chains=100, thinning=100, seed=None,
+                 copy=True, processes=1, max_warmup=None,
+                 warmup_dtype=np.float64, cache=True, cache_dir=None):
+        """
+        :param model: the model to sample, without integer variables
+        :param n_chains: number of chains advanced together
+        :param thinning:
+        :param seed:
+        :param copy: see :class:`GeneralizedHRSampler`
+        :param processes: number of processes used for the warmup only
+        :param max_warmup: see :class:`GeneralizedHRSampler`
+        :param warmup_dtype: see :class:`GeneralizedHRSampler`
+        :param cache: see :class:`GeneralizedHRSampler`
+        :param cache_dir: see :class:`GeneralizedHRSampler`
+        """
+        GeneralizedHRSampler.__init__(self, model, thinning, seed=seed,
+                                      copy=copy, max_warmup=max_warmup,
+                                      warmup_dtype=warmup_dtype, cache=cache,
+                                      cache_dir=cache_dir)
+        self.generate_fva_warmup(processes=processes)
+        self.center = self.warmup_center.copy()
+        self.n_chains = n_chains
+        self.random_state = np.random.RandomState(self._seed)
+
+        problem = self.problem
+        active = np.ptp(self.warmup, axis=0) > 0
+        self._active = np.flatnonzero(active)
+        self._active_warmup = np.asarray(self.warmup[:, active],
+                                         dtype=np.float64)
+        self._lower = problem.variable_bounds[0, active]
+        self._upper = problem.variable_bounds[1, active]
+
+        # The inactive variables only shift the inequalities, and the
+        # inequalities without active variables are constant
+        inequalities = csr_matrix(problem.inequalities)
+        if inequalities.shape[0] > 0:
+            offset = inequalities[:, np.flatnonzero(~active)].dot(
+                self.center[~active])
+            inequalities = inequalities[:, self._active]
+            rows = np.flatnonzero(np.diff(inequalities.indptr) > 0)
+            self._inequalities = inequalities[rows, ]
+            self._ineq_lower = problem.bounds[0, rows] - offset[rows]
+            self._ineq_upper = problem.bounds[1, rows] - offset[rows]
+        else:
+            self._inequalities = inequalities[:, self._active]
+
+        self.model.logger.info('batch sampler: {} chains on {} active '
+                               'variables'.format(n_chains, len(self._active)))
+
+        self.chains = self._new_points(n_chains)
+        self._update_ineq_values()
+
+    def _update_ineq_values(self, chains=None):
+        """
+        Computes the values of the inequalities at the chains. Between two
+        calls, they are updated along with the steps.
+
+        :param chains: boolean mask of the chains to update, all by default
+        """
+        if chains is None:
+            self._ineq_values = self._inequalities.dot(self.chains.T).T
+        elif chains.any():
+            self._ineq_values[chains] = \
+                self._inequalities.dot(self.chains[chains].T).T
+
+    def _new_points(self, n):
+        """
+        Draws points between the center and random warmup points. The center
+        being a mean of warmup points, these are feasible.
+
+        :param n: number of points
+        :return: array of shape (n, number of active variables)
+        """
+        center = self.center[self._active]
+        pi = self.random_state.randint(self.n_warmup, size=n)
+        fraction = self.random_state.uniform(size=(n, 1))
+        return center + fraction * (self._active_warmup[pi, ] - center)
+
+    @staticmethod
+    def _step_bounds(lower, upper, values, directions):
+        """
+        Step lengths alpha such that lower <= values + alpha*directions <=
+        upper, for each chain. Directions set to NaN are ignored.
+
+        :return: (lowest alpha, highest alpha), arrays with one value per chain
+        """
+        to_lower = ((1.0 - bounds_tol) * lower - values) / directions
+        to_upper = ((1.0 - bounds_tol) * upper - values) / directions
+        return (np.fmax.reduce(np.minimum(to_lower, to_upper), axis=1),
+                np.fmin.reduce(np.maximum(to_lower, to_upper), axis=1))
 
+    def _batch_step(self):
+        """
+        Moves all the chains by one hit-and-run step.
+        """
+        chains = self.chains
+        center = self.center[self._active]
+
+        pi = self.random_state.randint(self.n_warmup, size=self.n_chains)
+        directions = self._active_warmup[pi, ] - center
+        # The tiny components are only ignored in the step bounds, the chains
+        # move along the whole direction to stay in the nullspace
+        valid_directions = np.where(np.abs(directions) > feasibility_tol,
+                                    directions, np.nan)
+
+        with np.errstate(invalid='ignore'):
+            alpha_min, alpha_max = self._step_bounds(self._lower, self._upper,
+                                                     chains, valid_directions)
+
+            if self._inequalities.shape[0] > 0:
+                ineq_directions = self._inequalities.dot(directions.T).T
+                valid_directions = np.where(
+                    np.abs(ineq_directions) > feasibility_tol,
+                    ineq_directions, np.nan)
+                ineq_min, ineq_max = self._step_bounds(
+                    self._ineq_lower, self._ineq_upper, self._ineq_values,
+                    valid_directions)
+                alpha_min = np.fmax(alpha_min, ineq_min)
+                alpha_max = np.fmin(alpha_max, ineq_max)
+
+        # The chains can be slightly out of their bounds, and directions can
+        # be all invalid
+        alpha_min = np.where(np.isnan(alpha_min), 0, np.minimum(alpha_min, 0))
+        alpha_max = np.where(np.isnan(alpha_max), 0, np.maximum(alpha_max, 0))
+
+        alpha = self.random_state.uniform(alpha_min, alpha_max)
+        chains = chains + alpha[:, np.newaxis] * directions
+        if self._inequalities.shape[0] > 0:
+            self._ineq_values += alpha[:, np.newaxis] * ineq_directions
+
+        # Chains that left the feasible region are restarted
+        lost = self._min_bounds_dist(chains, self._ineq_values) < -bounds_tol
+        if lost.any():
+            self.retries += lost.sum()
+            chains[lost] = self._new_points(lost.sum())
+
+        self.center[self._active] = ((self.n_samples * center
+                                      + chains.sum(axis=0))
+                                     / (self.n_samples + self.n_chains))
+        self.n_samples += self.n_chains
+
+        reprojected = np.zeros(self.n_chains, dtype=bool)
+        if self.problem.homogeneous and \
+                (self.n_samples // self.n_chains) % self.nproj == 0:
+            chains, reprojected = self._batch_reproject(chains)
+            self.center = self._reproject(self.center)
+
+        self.chains = chains
+        self._update_ineq_values(lost | reprojected)
+
+    def _min_bounds_dist(self, points, values=None):
+        """
+        Same as HRSampler._bounds_dist, for each row of points.
+
+        :param points: array of shape (n, number of active variables)
+        :param values: values of the inequalities at the points, computed if
+            not given
+        :return: the smallest distance of each point to its bounds, negative
+            if a bound is violated
+        """
+        dist = np.minimum(points - self._lower,
+                          self._upper - points).min(axis=1)
+        if self._inequalities.shape[0] > 0:
+            if values is None:
+                values = self._inequalities.dot(points.T).T
+            dist = np.minimum(dist,
+                              np.minimum(values - self._ineq_lower,
+                                         self._ineq_upper - values)
+                              .min(axis=1))
+        return dist
+
+    def _batch_reproject(self, points):
+        """
+        Same as HRSampler._reproject, for each row of points.
+
+        :param points: array of shape (n, number of active variables)
+        :return: (points, boolean mask of the points that were changed)
+        """
+        if self.problem.equalities.shape[0] == 0:
+            return points, np.zeros(points.shape[0], dtype=bool)
+
+        full = self._full_points(points)
+        residuals = np.abs(full.dot(self.problem.equalities.T)
+                           - self.problem.b).max(axis=1)
+        off = residuals > feasibility_tol
+        if off.any():
+            nulls = self.problem.nullspace
+            points[off] = full[off].dot(nulls).dot(nulls.T)[:, self._active]
+            lost = off.copy()
+            lost[off] = self._min_bounds_dist(points[off]) < -bounds_tol
+            if lost.any():
+                points[lost] = self._new_points(lost.sum())
+        return points, off
+
+    def _full_points(self, points):
+        """
+        :param points: array of shape (n, number of active variables)
+        :return: the points with all the variables of the model
+        """
+        full = np.tile(self.center, (points.shape[0], 1))
+        full[:, self._active] = points
+        return full
+
+    def sample(self, n, fluxes=True):
+        """
+        Samples from all the chains. The chains go on from where the previous
+        call stopped.
+
+        :param n: number of samples, taken from the chains in turn
+        :param fluxes: if True, returns the net fluxes of the reactions
+            instead of all the variables
+        :return: pandas.DataFrame with one row per sample
+        """
+        n_rounds = int(np.ceil(n / self.n_chains))
+        samples = np.zeros((n_rounds * self.n_chains, len(self._active)))
+        # Clears the rounding errors of the updates
+        self._update_ineq_values()
+
+        for i in range(n_rounds):
+            for _ in range(self.thinning):
+                self._batch_step()
+            samples[i*self.n_chains:(i+1)*self.n_chains, ] = self.chains
+
+        samples = self._full_points(samples[:n, ])
+
+        if fluxes:
+            names, pos, neg = _get_column_selection(self.model, 'fluxes')
+            return pd.DataFrame(samples[:, pos] - samples[:, neg],
+                                columns=names)
+
+        return pd.DataFrame(samples,
+                            columns=[x.name for x in self.model.variables])
+
+
+class GeneralizedCHRSampler(GeneralizedHRSampler):
+    """
+    Coordinate hit-and-run in a rounded parametrization of the polytope.
+
+    TFA polytopes are very anisotropic (fluxes span +/-1000 while log
+    concentrations span a few units), which makes hit-and-run mix slowly.
+    Here:
+
+    * the equalities are eliminated with a basis N of their null space,
+      x = center + N y,
+    * the polytope is rounded with an isotropic transform y = T z, T being the
+      Cholesky factor of the covariance of the warmup points, then of the
+      samples of a first run (see rounding),
+    * the chains move along one coordinate of z at a time. A step only reads
+      one column of the constraints, and only updates the value of each
+      constraint along this column.
+
+    Like :class:`GeneralizedBatchSampler`, the chains are advanced together
+    with numpy operations.
+    """
+
+    def __init__(self, model, n_chains=100, thinning=None, seed=None,
+                 copy=True, processes=1, rounding=2, max_warmup=None,
+                 warmup_dtype=np.float64, cache=True, cache_dir=None):
+        """
+        :param model: the model to sample, without integer variables
+        :param n_chains: number of chains advanced together
+        :param thinning: number of coordinate steps between two samples of a
+            chain, by default the dimension of the polytope
+        :param seed:
+        :param copy: see :class:`GeneralizedHRSampler`
+        :param processes: number of processes used for the warmup only
+        :param rounding: number of rounding passes. The first one uses the
+            warmup points, the next ones the samples of the previous pass.
+            With 0, the polytope is not rounded.
+        :param max_warmup: see :class:`GeneralizedHRSampler`
+        :param warmup_dtype: see :class:`GeneralizedHRSampler`
+        :param cache: see :class:`GeneralizedHRSampler`
+        :param cache_dir: see :class:`GeneralizedHRSampler`
+        """
+        GeneralizedHRSampler.__init__(self, model, thinning, seed=seed,
+                                      copy=copy, max_warmup=max_warmup,
+                                      warmup_dtype=warmup_dtype, cache=cache,
+                                      cache_dir=cache_dir)
+        self.generate_fva_warmup(processes=processes)
+        self.center = self.warmup_center.copy()
+        self.n_chains = n_chains
+        self.random_state = np.random.RandomState(self._seed)
+
+        problem = self.problem
+        # The null space of the problem leaves the variables fixed to 0 free
+        fixed = problem.variable_fixed.astype(bool)
+        equalities = np.vstack([problem.equalities,
+                                np.eye(len(fixed))[fixed]])
+        nulls = nullspace(equalities) if equalities.shape[0] > 0 \
+            else np.eye(len(fixed))
+        self.dim = nulls.shape[1]
+        if thinning is None:
+            self.thinning = self.dim
+
+        # Bounds of the variables and inequalities, relative to the center
+        rows = nulls[~fixed]
+        lower = (problem.variable_bounds[0, ] - self.center)[~fixed]
+        upper = (problem.variable_bounds[1, ] - self.center)[~fixed]
+        if problem.inequalities.shape[0] > 0:
+            values = problem.inequalities.dot(self.center)
+            rows = np.vstack([rows, problem.inequalities.dot(nulls)])
+            lower = np.hstack([lower, problem.bounds[0, ] - values])
+            upper = np.hstack([upper, problem.bounds[1, ] - values])
+        keep = np.abs(rows).max(axis=1) > feasibility_tol
+        self._null_rows = rows[keep]
+        self._lower = lower[keep]
+        self._upper = upper[keep]
+        self._nullspace = nulls
+
+        # Until rounded, y = z
+        self._transform = np.eye(self.dim)
+        self._set_transform(self._transform)
+        self.chains = np.zeros((n_chains, self.dim))
+
+        warmup = (np.asarray(self.warmup, dtype=np.float64)
+                  - self.center).dot(nulls)
+        for i in range(rounding):
+            if i == 0:
+                points = warmup
+            else:
+                points = self._sample_chains(max(self.dim, 2 * n_chains))
+                points = points.dot(self._transform.T)
+            self._round(points)
+            self._warmup_z = np.linalg.solve(self._transform, warmup.T).T
+            self.chains = self._new_points(n_chains)
+        if rounding == 0:
+            self._warmup_z = warmup
+            self.chains = self._new_points(n_chains)
+
+        self._update_values()
+
+        self.model.logger.info('CHR sampler: {} chains in {} dimensions, '
+                               '{} constraints'
+                               .format(n_chains, self.dim,
+                                       self._null_rows.shape[0]))
+
+    def _set_transform(self, transform):
+        """
+        :param transform: matrix T of y = T z
+        """
+        self._transform = transform
+        # One row per coordinate of z, read in turn by the steps
+        self._columns = np.ascontiguousarray(self._null_rows.dot(transform).T)
+        self._basis = self._nullspace.dot(transform)
+
+    def _round(self, points):
+        """
+        Sets the transform to the Cholesky factor of the covariance of
+        points, given in y coordinates.
+
+        :param points: array of shape (n, dim)
+        """
+        covariance = np.cov(points, rowvar=False) if len(points) > 1 \
+            else np.eye(self.dim)
+        covariance = np.atleast_2d(covariance)
+        # Directions that the points do not span keep a small scale
+        scale = max(np.trace(covariance) / self.dim, feasibility_tol)
+        covariance += 1e-6 * scale * np.eye(self.dim)
+        self._set_transform(np.linalg.cholesky(covariance))
+
+    def _new_points(self, n):
+        """
+        Draws points between the center and random warmup points, in z
+        coordinates.
+        """
+        pi = self.random_state.randint(self.n_warmup, size=n)
+        fraction = self.random_state.uniform(size=(n, 1))
+        return fraction * self._warmup_z[pi, ]
+
+    def _update_values(self, chains=None):
+        """
+        Computes the values of the constraints at the chains. Between two
+        calls, they are updated along with the steps.
+
+        :param chains: boolean mask of the chains to update, all by default
+        """
+        if chains is None:
+            self._values = self.chains.dot(self._columns)
+        elif chains.any():
+            self._values[chains] = self.chains[chains].dot(self._columns)
+
+    def _coordinate_step(self):
+        """
+        Moves each chain along one random coordinate.
+        """
+        coordinates = self.random_state.randint(self.dim, size=self.n_chains)
+        columns = self._columns[coordinates]
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            alpha_min, alpha_max = GeneralizedBatchSampler._step_bounds(
+                self._lower, self._upper, self._values,
+                np.where(columns != 0, columns, np.nan))
+        alpha_min = np.where(np.isnan(alpha_min), 0, np.minimum(alpha_min, 0))
+        alpha_max = np.where(np.isnan(alpha_max), 0, np.maximum(alpha_max, 0))
+        alpha = self.random_state.uniform(alpha_min, alpha_max)
+
+        self.chains[np.arange(self.n_chains), coordinates] += alpha
+        self._values += alpha[:, np.newaxis] * columns
+
+        lost = np.minimum(self._values - self._lower,
+                          self._upper - self._values).min(axis=1) < -bounds_tol
+        if lost.any():
+            self.retries += lost.sum()
+            self.chains[lost] = self._new_points(lost.sum())
+            self._update_values(lost)
+
+        self.n_samples += self.n_chains
+
+    def _sample_chains(self, n):
+        """
+        :param n: number of samples
+        :return: the samples in z coordinates
+        """
+        n_rounds = int(np.ceil(n / self.n_chains))
+        samples = np.zeros((n_rounds * self.n_chains, self.dim))
+        # Clears the rounding errors of the updates
+        self._update_values()
+
+        for i in range(n_rounds):
+            for _ in range(self.thinning):
+                self._coordinate_step()
+            samples[i*self.n_chains:(i+1)*self.n_chains, ] = self.chains
+
+        return samples[:n, ]
+
+    def sample(self, n, fluxes=True):
+        """
+        Samples from all the chains. The chains go on from where the previous
+        call stopped.
+
+        :param n: number of samples, taken from the chains in turn
+        :param fluxes: if True, returns the net fluxes of the reactions
+            instead of all the variables
+        :return: pandas.DataFrame with one row per sample
+        """
+        samples = self.center + self._sample_chains(n).dot(self._basis.T)
+
+        if fluxes:
+            names, pos, neg = _get_column_selection(self.model, 'fluxes')
+            return pd.DataFrame(samples[:, pos] - samples[:, neg],
+                                columns=names)
+
+        return pd.DataFrame(samples,
+                            columns=[x.name for x in self.model.variables])
+
+
+class ProfileSampler(object):
+    """
+    Samples a ThermoModel within one or more fixed directionality profiles,
+    without stripping its integer variables first.
+
+    For each profile, the use variables are made continuous and fixed at the
+    values of the profile (see
+    :func:`~.pytfa.optim.utils.continuous_use_variables`), which turns the
+    problem into the LP of this profile. The matrices of the sampling problem
+    and the warmup points are built from the model itself, and the model is
+    restored afterwards. No copy of the model is made.
+
+    The samples of all profiles are returned together, indexed by profile.
+    The infeasible profiles are skipped: only the feasible ones are kept in
+    the profiles attribute, and the labels of the others in the infeasible
+    attribute.
+    """
+
+    def __init__(self, model, profiles, method="achr", thinning=100,
+                 processes=1, seed=None, max_warmup=None,
+                 warmup_dtype=np.float64, cache=True, cache_dir=None):
+        """
+        :param model: pytfa.core.ThermoModel
+        :param profiles: a directionality profile, or a list of them, or a dict
+            {label: profile}. A profile is either a dict {use variable name:
+            0 or 1} (see :func:`~.pytfa.optim.utils.get_directionality_profile`)
+            or a solution of the model.
+        :param method: 'optgp', 'achr', 'batch' or 'chr', see :func:`sample`
+        :param thinning:
+        :param processes: number of processes, only used for the warmup with
+            'achr'
+        :param seed:
+        :param max_warmup: see :class:`GeneralizedHRSampler`
+        :param warmup_dtype: see :class:`GeneralizedHRSampler`
+        :param cache: see :class:`GeneralizedHRSampler`
+        :param cache_dir: see :class:`GeneralizedHRSampler`
+        """
+        if method not in ("optgp", "achr", "batch", "chr"):
+            raise ValueError("method must be 'optgp', 'achr', 'batch' or "
+                             "'chr'!")
+
+        self.model = model
+
+        if not isinstance(profiles, (list, tuple, dict)) \
+                or (isinstance(profiles, dict)
+                    and not all(isinstance(x, dict) or hasattr(x, 'raw')
+                                for x in profiles.values())):
+            profiles = [profiles]
+        if not isinstance(profiles, dict):
+            profiles = OrderedDict(enumerate(profiles))
+
+        self.profiles = OrderedDict()
+        self.samplers = OrderedDict()
+        self.infeasible = []
+
+        for label, profile in profiles.items():
+            if hasattr(profile, 'raw'):
+                profile = get_directionality_profile(model, profile)
+
+            with continuous_use_variables(model, profile):
+                model.slim_optimize()
+                if model.solver.status != OPTIMAL:
+                    model.logger.warning('Profile {} is infeasible, '
+                                         'skipping it'.format(label))
+                    self.infeasible.append(label)
+                    continue
+
+                if method == "optgp":
+                    sampler = GeneralizedOptGPSampler(model, processes,
+                                                      thinning=thinning,
+                                                      seed=seed,
+                                                      copy=False,
+                                                      max_warmup=max_warmup,
+                                                      warmup_dtype=warmup_dtype,
+                                                      cache=cache,
+                                                      cache_dir=cache_dir)
+                elif method == "batch":
+                    sampler = GeneralizedBatchSampler(model,
+                                                      thinning=thinning,
+                                                      seed=seed,
+                                                      copy=False,
+                                                      processes=processes,
+                                                      max_warmup=max_warmup,
+                                                      warmup_dtype=warmup_dtype,
+                                                      cache=cache,
+                                                      cache_dir=cache_dir)
+                elif method == "chr":
+                    sampler = GeneralizedCHRSampler(model,
+                                                    thinning=thinning,
+                                                    seed=seed,
+                                                    copy=False,
+                                                    processes=processes,
+                                                    max_warmup=max_warmup,
+                                                    warmup_dtype=warmup_dtype,
+                                                    cache=cache,
+                                                    cache_dir=cache_dir)
+                else:
+                    sampler = GeneralizedACHRSampler(model,
+                                                     thinning=thinning,
+                                                     seed=seed,
+                                                     copy=False,
+                                                     processes=processes,
+                                                     max_warmup=max_warmup,
+                                                     warmup_dtype=warmup_dtype,
+                                                     cache=cache,
+                                                     cache_dir=cache_dir)
+            self.profiles[label] = profile
+            self.samplers[label] = sampler
+
+    def sample(self, n, fluxes=False):
+        """
+        Samples each feasible profile.
+
+        :param n: number of samples per profile
+        :param fluxes: only False is supported, all the variables are returned
+        :return: pandas.DataFrame with one column per variable of the model,
+            and a (profile, sample) MultiIndex
+        """
+        samples = OrderedDict((label, sampler.sample(n, fluxes=False))
+                              for label, sampler in self.samplers.items())
+
+        return pd.concat(samples, names=['profile', 'sample'])
 
-def sample(model, n, method="optgp", thinning=100, processes=1, seed=None):
+
+def get_concentration_space(tmodel, profile):
+    """
+    Builds the thermodynamic part of a TFA problem for a fixed directionality
+    profile, as a model of its own: once the use variables are fixed, the
+    constraints on the log concentrations, the DeltaGs and the DeltaGstds
+    (and the other thermodynamic variables) no longer involve the fluxes.
+
+    The DeltaGs that are defined by an equality (NegativeDeltaG constraints
+    of non-compact models) are substituted by their definition, so that the
+    space is a polytope on the log concentrations and the DeltaGstds. Their
+    bounds become constraints of the space.
+
+    Constraints that involve both fluxes and other variables than the use
+    variables are not in the space, a warning lists them.
+
+    :param tmodel: pytfa.thermo.ThermoModel
+    :param profile: dict {use variable name: 0 or 1}, see
+        :func:`~.pytfa.optim.utils.get_directionality_profile`. The use
+        variables that are not in it must have been eliminated.
+    :return: (space, definitions) with space a cobra.Model without reactions
+        holding the variables and constraints of the thermodynamic space, and
+        definitions a dict {DeltaG name: (constant, {variable name:
+        coefficient})} of the substituted DeltaGs
+    """
+    flux_vars = {x.name for rxn in tmodel.reactions
+                 for x in (rxn.forward_variable, rxn.reverse_variable)}
+    integer_vars = [x.name for x in tmodel.variables
+                    if x.type != 'continuous' and x.name not in profile]
+    if integer_vars:
+        raise ValueError('The profile does not fix the integer variables {}'
+                         .format(integer_vars[:10]))
+
+    # Rows {name: [{variable name: coefficient}, lb, ub]}, the use variables
+    # being constants
+    rows = OrderedDict()
+    coupled = []
+    for cons in tmodel.constraints:
+        coeffs = {x.name: k for x, k in
+                  cons.get_linear_coefficients(cons.variables).items()}
+        if set(coeffs) & flux_vars:
+            if set(coeffs) - flux_vars - set(profile):
+                coupled.append(cons.name)
+            continue
+        shift = sum(k * profile[x] for x, k in coeffs.items() if x in profile)
+        coeffs = {x: k for x, k in coeffs.items() if x not in profile}
+        if coeffs:
+            rows[cons.name] = [coeffs,
+                               None if cons.lb is None else cons.lb - shift,
+                               None if cons.ub is None else cons.ub - shift]
+
+    if coupled:
+        tmodel.logger.warning('{} constraints coupling the fluxes and the '
+                              'thermodynamic variables are ignored: {}'
+                              .format(len(coupled), coupled[:10]))
+
+    bounds = {x.name: [x.lb, x.ub] for x in tmodel.variables}
+
+    # Rows on a single variable, like the DeltaG couplings, are bounds
+    for name, (coeffs, lb, ub) in list(rows.items()):
+        if len(coeffs) != 1:
+            continue
+        (x, k), = coeffs.items()
+        lb, ub = (lb, ub) if k > 0 else (ub, lb)
+        if lb is not None:
+            bounds[x][0] = max(bounds[x][0], lb / k)
+        if ub is not None:
+            bounds[x][1] = min(bounds[x][1], ub / k)
+        del rows[name]
+
+    # DG = (lb - sum of the other terms) / coefficient of DG
+    definitions = dict()
+    for cons in tmodel.get_constraints_of_type(NegativeDeltaG):
+        dg_name = DeltaG.prefix + cons.id
+        coeffs, lb, ub = rows.get(cons.name, (dict(), None, None))
+        if dg_name not in coeffs or lb is None or lb != ub:
+            continue
+        a = coeffs[dg_name]
+        definitions[dg_name] = (lb / a, {x: -k / a for x, k in coeffs.items()
+                                         if x != dg_name})
+        del rows[cons.name]
+
+    for coeffs_lb_ub in rows.values():
+        coeffs = coeffs_lb_ub[0]
+        for dg_name in set(coeffs) & set(definitions):
+            k = coeffs.pop(dg_name)
+            constant, terms = definitions[dg_name]
+            for x, c in terms.items():
+                coeffs[x] = coeffs.get(x, 0) + k * c
+            for i in (1, 2):
+                if coeffs_lb_ub[i] is not None:
+                    coeffs_lb_ub[i] -= k * constant
+
+    for dg_name, (constant, terms) in definitions.items():
+        lb, ub = bounds[dg_name]
+        rows[dg_name] = [dict(terms),
+                         None if lb is None else lb - constant,
+                         None if ub is None else ub - constant]
+
+    space_vars = {x.name for x in tmodel.log_concentration}
+    for coeffs, _, _ in rows.values():
+        space_vars.update(coeffs)
+
+    space = Model(tmodel.id + '_thermo_space')
+    space.solver = tmodel.solver.interface
+    space.logger = tmodel.logger
+
+    variables = OrderedDict(
+        (x.name, space.problem.Variable(x.name, lb=bounds[x.name][0],
+                                        ub=bounds[x.name][1]))
+        for x in tmodel.variables if x.name in space_vars)
+    constraints = [space.problem.Constraint(S.Zero, name=name, lb=lb, ub=ub)
+                   for name, (_, lb, ub) in rows.items()]
+
+    space.add_cons_vars(list(variables.values()) + constraints)
+    space.solver.update()
+    for cons, (coeffs, _, _) in zip(constraints, rows.values()):
+        cons.set_linear_coefficients({variables[x]: k
+                                      for x, k in coeffs.items() if k != 0})
+
+    tmodel.logger.info('thermodynamic space: {} variables, {} constraints, '
+                       '{} DeltaG substituted'
+                       .format(len(variables), len(constraints),
+                               len(definitions)))
+    return space, definitions
+
+
+class ConcentrationSampler(object):
+    """
+    Samples the log concentrations of a TFA model for a fixed directionality
+    profile. The samples are drawn in the thermodynamic space of the profile
+    (see :func:`get_concentration_space`), which has far fewer variables than
+    the whole problem, and whose chains do not have to move the fluxes.
+
+    With a fixed profile, the fluxes and the thermodynamic variables are
+    independent, so the log concentrations have the same distribution as in
+    samples of the whole problem.
+    """
+
+    def __init__(self, tmodel, profile, method="batch", thinning=100,
+                 processes=1, seed=None, **kwargs):
+        """
+        :param tmodel: pytfa.thermo.ThermoModel
+        :param profile: a directionality profile (dict {use variable name:
+            0 or 1}) or a solution of the model
+        :param method: 'optgp', 'achr', 'batch' or 'chr', see :func:`sample`
+        :param thinning:
+        :param processes: number of processes, used for the warmup, and the
+            sampling with 'optgp'
+        :param seed:
+        :param kwargs: passed to the sampler, e.g. max_warmup or cache_dir
+        """
+        if hasattr(profile, 'raw'):
+            profile = get_directionality_profile(tmodel, profile)
+
+        self.model = tmodel
+        self.profile = profile
+        self.space, self.definitions = get_concentration_space(tmodel,
+                                                               profile)
+
+        self.space.slim_optimize()
+        if self.space.solver.status != OPTIMAL:
+            raise ValueError('The thermodynamic space of the profile is '
+                             'infeasible')
+
+        if method == "optgp":
+            self.sampler = GeneralizedOptGPSampler(self.space, processes,
+                                                   thinning=thinning,
+                                                   seed=seed, copy=False,
+                                                   **kwargs)
+        elif method == "achr":
+            self.sampler = GeneralizedACHRSampler(self.space,
+                                                  thinning=thinning,
+                                                  seed=seed, copy=False,
+                                                  processes=processes,
+                                                  **kwargs)
+        elif method == "batch":
+            self.sampler = GeneralizedBatchSampler(self.space,
+                                                   thinning=thinning,
+                                                   seed=seed, copy=False,
+                                                   processes=processes,
+                                                   **kwargs)
+        elif method == "chr":
+            self.sampler = GeneralizedCHRSampler(self.space,
+                                                 thinning=thinning,
+                                                 seed=seed, copy=False,
+                                                 processes=processes,
+                                                 **kwargs)
+        else:
+            raise ValueError("method must be 'optgp', 'achr', 'batch' or "
+                             "'chr'!")
+
+    def sample(self, n, thermo=False):
+        """
+        :param n: number of samples
+        :param thermo: if True, also returns the other variables of the
+            thermodynamic space (DeltaGstd, ...) and the substituted DeltaGs,
+            by variable name
+        :return: pandas.DataFrame of the log concentrations, with one column
+            per metabolite id. Log concentrations that were fixed when the
+            model was converted are included with their value.
+        """
+        samples = self.sampler.sample(n, fluxes=False)
+
+        lc_vars = [x for x in self.model.log_concentration
+                   if x.name in samples.columns]
+        concentrations = pd.DataFrame(samples[[x.name for x in lc_vars]].values,
+                                      columns=[x.id for x in lc_vars])
+
+        for name, value in self.model._fixed_vars.items():
+            if name.startswith(LogConcentration.prefix):
+                concentrations[name[len(LogConcentration.prefix):]] = value
+
+        if thermo:
+            others = samples.drop([x.name for x in lc_vars], axis=1)
+            for dg_name, (constant, terms) in self.definitions.items():
+                others[dg_name] = constant + sum(k * samples[x]
+                                                 for x, k in terms.items())
+            return pd.concat([concentrations, others], axis=1)
+
+        return concentrations
+
+
+def _get_column_selection(model, variables):
+    """
+    Translates a selection of variables into column indices of the samples.
+
+    :param model:
+    :param variables: None for all the variables, or an iterable of variable
+        names, variable classes (e.g. ThermoDisplacement) and 'fluxes' (or
+        cobra.Reaction) for the net fluxes of the reactions
+    :return: (names, positive indices, negative indices), the value of a
+        column is samples[positive] - samples[negative], with a negative
+        index of -1 meaning no negative part
+    """
+    var_index = {v.name: i for i, v in enumerate(model.variables)}
+
+    if variables is None:
+        names = list(var_index.keys())
+        return names, np.arange(len(names)), -np.ones(len(names), dtype=int)
+
+    if isinstance(variables, (str, type)):
+        variables = [variables]
+
+    names, pos, neg = [], [], []
+    for kind in variables:
+        if kind == Reaction or \
+                (isinstance(kind, str) and kind.lower() == 'fluxes'):
+            for rxn in model.reactions:
+                names.append(rxn.id)
+                pos.append(var_index[rxn.forward_variable.name])
+                neg.append(var_index[rxn.reverse_variable.name])
+        elif isinstance(kind, type):
+            for var in model.get_variables_of_type(kind):
+                names.append(var.name)
+                pos.append(var_index[var.name])
+                neg.append(-1)
+        else:
+            names.append(kind)
+            pos.append(var_index[kind])
+            neg.append(-1)
+
+    return names, np.array(pos, dtype=int), np.array(neg, dtype=int)
+
+
+def _chain_samplers(sampler):
+    """
+    :param sampler: a generalized sampler, a :class:`ProfileSampler` or a
+        :class:`ConcentrationSampler`
+    :return: list of the generalized samplers it holds
+    """
+    if hasattr(sampler, 'samplers'):
+        return list(sampler.samplers.values())
+    if hasattr(sampler, 'sampler'):
+        return [sampler.sampler]
+    return [sampler]
+
+
+def save_sampler(sampler, filename):
+    """
+    Saves a sampler with the state of its chains (current points, center,
+    counters and random generators) and its warmup, so that the sampling can
+    be continued with :func:`load_sampler` without redoing the warmup or the
+    burn-in.
+
+    The file is written under a temporary name first, so that a crash while
+    saving never leaves a partial file.
+
+    :param sampler: a generalized sampler, a :class:`ProfileSampler` or a
+        :class:`ConcentrationSampler`
+    :param filename:
+    """
+    # OptGPSampler does not pickle its model, they are saved next to it
+    models = [x.model for x in _chain_samplers(sampler)]
+
+    tmp_file = filename + '.{}.tmp'.format(os.getpid())
+    with open(tmp_file, 'wb') as fid:
+        pickle.dump({'sampler': sampler, 'models': models}, fid,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, filename)
+
+
+def load_sampler(filename):
+    """
+    Loads a sampler saved by :func:`save_sampler`. Its chains go on from
+    where they were when it was saved.
+
+    Example:
+    ```python
+    sampler = load_sampler('checkpoint.pkl')
+    more_samples = sampler.sample(1000, fluxes=False)
+    ```
+
+    :param filename:
+    :return: the sampler
+    """
+    with open(filename, 'rb') as fid:
+        data = pickle.load(fid)
+
+    sampler = data['sampler']
+    for chain_sampler, model in zip(_chain_samplers(sampler), data['models']):
+        if getattr(chain_sampler, 'model', None) is None:
+            chain_sampler.model = model
+    return sampler
+
+
+def stream_samples(sampler, n, chunk_size=1000, variables=None,
+                   checkpoint=None):
+    """
+    Generates n samples by chunks, so that they never need to be all in
+    memory at once.
+
+    Example:
+    ```python
+    sampler = GeneralizedACHRSampler(continuous_model)
+    for chunk in stream_samples(sampler, 100000,
+                                variables=['fluxes', ThermoDisplacement]):
+        do_something(chunk)
+    ```
+
+    :param sampler: a generalized sampler, or a :class:`ProfileSampler`
+    :param n: number of samples (per profile for a :class:`ProfileSampler`)
+    :param chunk_size: number of samples per chunk
+    :param variables: variables to keep, see :func:`_get_column_selection`.
+        None keeps all the variables.
+    :param checkpoint: optional file where the sampler is saved (see
+        :func:`save_sampler`) after each chunk is drawn. After a crash, the
+        sampling can be resumed from the last chunk with :func:`load_sampler`.
+    :return: generator of pandas.DataFrame
+    """
+    names, pos, neg = _get_column_selection(sampler.model, variables)
+    has_neg = neg >= 0
+
+    done = 0
+    while done < n:
+        size = min(chunk_size, n - done)
+        chunk = sampler.sample(size, fluxes=False)
+
+        # OptGP rounds the number of samples up to a multiple of its processes
+        if isinstance(chunk.index, pd.MultiIndex):
+            chunk = chunk.groupby(level=0, sort=False).head(size)
+            index = pd.MultiIndex.from_arrays(
+                [chunk.index.get_level_values(0),
+                 chunk.index.get_level_values(1) + done],
+                names=chunk.index.names)
+        else:
+            chunk = chunk.iloc[:size]
+            index = pd.RangeIndex(done, done + size)
+
+        values = chunk.values[:, pos]
+        values[:, has_neg] -= chunk.values[:, neg[has_neg]]
+        done += size
+
+        if checkpoint is not None:
+            save_sampler(sampler, checkpoint)
+
+        yield pd.DataFrame(values, index=index, columns=names)
+
+
+def sample_to_file(sampler, n, filename, chunk_size=1000, variables=None,
+                   checkpoint=None):
+    """
+    Writes n samples to a file, chunk by chunk. The format is given by the
+    extension of the file:
+
+    * '.npy': a numpy array of shape (samples, variables), written through a
+      memmap, so it can be read back with numpy.load(filename, mmap_mode='r').
+      The column names (and the profile of each row, for a
+      :class:`ProfileSampler`) are written in a JSON file next to it, with the
+      same name and a '.json' extension.
+    * '.parquet': a parquet file, written by row groups. Needs pyarrow.
+
+    :param sampler: a generalized sampler, or a :class:`ProfileSampler`
+    :param n: number of samples (per profile for a :class:`ProfileSampler`)
+    :param filename:
+    :param chunk_size: number of samples per chunk
+    :param variables: variables to keep, see :func:`stream_samples`
+    :param checkpoint: optional file where the sampler is saved after each
+        chunk, see :func:`stream_samples`
+    :return: the column names
+    """
+    names = _get_column_selection(sampler.model, variables)[0]
+    extension = os.path.splitext(filename)[1].lower()
+    chunks = stream_samples(sampler, n, chunk_size, variables, checkpoint)
+
+    if extension == '.npy':
+        n_rows = n * len(getattr(sampler, 'samplers', [None]))
+        array = open_memmap(filename, mode='w+', dtype=float,
+                            shape=(n_rows, len(names)))
+        metadata = {'columns': names}
+        row = 0
+        for chunk in chunks:
+            array[row:row + len(chunk)] = chunk.values
+            row += len(chunk)
+            if isinstance(chunk.index, pd.MultiIndex):
+                metadata.setdefault('profiles', []).extend(
+                    chunk.index.get_level_values(0).tolist())
+        array.flush()
+        del array
+
+        with open(os.path.splitext(filename)[0] + '.json', 'w') as fid:
+            json.dump(metadata, fid)
+
+    elif extension == '.parquet':
+        if pyarrow is None:
+            raise ImportError('Writing parquet files requires pyarrow')
+        writer = None
+        for chunk in chunks:
+            if isinstance(chunk.index, pd.MultiIndex):
+                chunk = chunk.reset_index()
+            table = pyarrow.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(filename, table.schema)
+            writer.write_table(table)
+        if writer is not None:
+            writer.close()
+
+    else:
+        raise ValueError('Unknown file format {}, use .npy or .parquet'
+                         .format(extension))
+
+    return names
+
+
+def sample(model, n, method="optgp", thinning=100, processes=1, seed=None,
+           profiles=None, min_ess=None, max_rhat=None, batch_size=100,
+           max_warmup=None, warmup_dtype=np.float64, cache=True,
+           cache_dir=None):
     """
     Sample valid flux distributions from a thermo cobra_model.
 
@@ -148,6 +1915,19 @@ def sample(model, n, method="optgp", thinning=100, processes=1, seed=None):
     2. 'achr' which uses artificial centering hit-and-run. This is a single
        process method with good convergence [2]_.
 
+    or
+
+    3. 'batch' which also uses artificial centering hit-and-run, but steps
+       many chains at once with vectorized operations, see
+       :class:`GeneralizedBatchSampler`.
+
+    or
+
+    4. 'chr' which uses coordinate hit-and-run in a rounded parametrization
+       of the polytope, see :class:`GeneralizedCHRSampler`. Its thinning
+       counts coordinate steps, so it should be about the dimension of the
+       polytope.
+
     Parameters
     ----------
     model : pytfa.core.ThermoModel
@@ -164,17 +1944,42 @@ def sample(model, n, method="optgp", thinning=100, processes=1, seed=None):
         benchmarks gives approximately uncorrelated samples. If set to one
         will return all iterates.
     processes : int, optional
-        Only used for 'optgp'. The number of processes used to generate
-        samples.
+        The number of processes used to generate the warmup points, and with
+        'optgp' the samples.
     seed : positive integer, optional
         The random number seed to be used. Initialized to current time stamp
         if None.
+    profiles : optional
+        Directionality profiles to sample in, see :class:`ProfileSampler`.
+        If given, the model can be a TFA model with its use variables, and
+        `n` samples are drawn for each profile.
+    min_ess, max_rhat : float, optional
+        Convergence targets, only used for 'optgp'. If one of them is given,
+        the chains are sampled by batches of `batch_size` until the targets
+        are reached, or until `n` samples are drawn, see
+        :func:`GeneralizedOptGPSampler.sample_until_converged`, whose
+        diagnostics attribute holds the final effective sample sizes and
+        split-R̂.
+    batch_size : int, optional
+        Number of samples drawn by each chain between two convergence checks.
+    max_warmup : int, optional
+        Maximum number of warmup points kept by the sampler.
+    warmup_dtype : numpy dtype, optional
+        Storage type of the warmup points, np.float32 halves their memory.
+    cache : bool, optional
+        Whether to reuse the warmup of a previous call on the same problem.
+    cache_dir : str, optional
+        Directory where the warmups are also saved, to be reused across
+        sessions.
 
     Returns
     -------
     pandas.DataFrame
         The generated flux samples. Each row corresponds to a sample of the
-        fluxes and the columns are the reactions.
+        fluxes and the columns are the reactions. If profiles are given, the
+        index tells which profile each sample comes from. If convergence
+        targets are given, all the variables are returned, indexed by
+        (chain, sample).
 
     Notes
     -----
@@ -193,11 +1998,52 @@ def sample(model, n, method="optgp", thinning=100, processes=1, seed=None):
        David E. Kaufman Robert L. Smith
        Operations Research 199846:1 , 84-95
     """
+    if profiles is not None:
+        sampler = ProfileSampler(model, profiles, method=method,
+                                 thinning=thinning, processes=processes,
+                                 seed=seed, max_warmup=max_warmup,
+                                 warmup_dtype=warmup_dtype, cache=cache,
+                                 cache_dir=cache_dir)
+        return sampler.sample(n)
+
+    if min_ess is not None or max_rhat is not None:
+        if method != "optgp":
+            raise ValueError("convergence targets need several chains, "
+                             "use method 'optgp'")
+        sampler = GeneralizedOptGPSampler(model, processes, thinning=thinning,
+                                          seed=seed, max_warmup=max_warmup,
+                                          warmup_dtype=warmup_dtype,
+                                          cache=cache, cache_dir=cache_dir)
+        return sampler.sample_until_converged(
+            min_ess=0 if min_ess is None else min_ess,
+            max_rhat=np.inf if max_rhat is None else max_rhat,
+            batch_size=batch_size,
+            max_samples=n)
+
     if method == "optgp":
-        sampler = GeneralizedOptGPSampler(model, processes, thinning=thinning, seed=seed)
+        sampler = GeneralizedOptGPSampler(model, processes, thinning=thinning,
+                                          seed=seed, max_warmup=max_warmup,
+                                          warmup_dtype=warmup_dtype,
+                                          cache=cache, cache_dir=cache_dir)
     elif method == "achr":
-        sampler = GeneralizedACHRSampler(model, thinning=thinning, seed=seed)
+        sampler = GeneralizedACHRSampler(model, thinning=thinning, seed=seed,
+                                         processes=processes,
+                                         max_warmup=max_warmup,
+                                         warmup_dtype=warmup_dtype,
+                                         cache=cache, cache_dir=cache_dir)
+    elif method == "batch":
+        sampler = GeneralizedBatchSampler(model, thinning=thinning, seed=seed,
+                                          processes=processes,
+                                          max_warmup=max_warmup,
+                                          warmup_dtype=warmup_dtype,
+                                          cache=cache, cache_dir=cache_dir)
+    elif method == "chr":
+        sampler = GeneralizedCHRSampler(model, thinning=thinning, seed=seed,
+                                        processes=processes,
+                                        max_warmup=max_warmup,
+                                        warmup_dtype=warmup_dtype,
+                                        cache=cache, cache_dir=cache_dir)
     else:
-        raise ValueError("method must be 'optgp' or 'achr'!")
+        raise ValueError("method must be 'optgp', 'achr', 'batch' or 'chr'!")
 
     return sampler.sample(n, fluxes = False)
\ No newline at end of file
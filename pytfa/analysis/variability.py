@@ -21,6 +21,7 @@ from optlang.exceptions import SolverError
 from optlang.interface import INFEASIBLE
 
 from ..optim import DeltaG
+from ..optim import heuristics
 from ..optim.constraints import ForbiddenProfile
 from ..optim.utils import get_direction_use_variables
 from ..optim.variables import ForwardUseVariable
@@ -123,18 +124,25 @@ def _variability_analysis_element(tmodel, var, sense):
 
 
 
-def variability_analysis(tmodel, kind='reactions', proc_num = BEST_THREAD_RATIO):
+def variability_analysis(tmodel, kind='reactions', proc_num = BEST_THREAD_RATIO,
+                         warm_start = False):
     """
     Performs variability analysis, gicven a variable type
 
     :param tmodel:
     :param kind:
     :param proc_num:
+    :param warm_start: if True, a feasible point is found first with
+        :func:`~.pytfa.optim.heuristics.warm_start` and given to the solver as
+        MIP start for all the solves (Gurobi and CPLEX only)
     :return:
     """
 
     objective = tmodel.objective
 
+    if warm_start:
+        heuristics.warm_start(tmodel)
+
     # If the kind variable is iterable, we perform variability analysis on each,
     # one at a time
     if hasattr(kind, '__iter__') and not isinstance(kind, str):
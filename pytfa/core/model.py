@@ -62,6 +62,14 @@ class LCSBModel(ABC):
         self._cons_queue = list()
         self._var_queue = list()
 
+        # Variables that were fixed and taken out of the solver problem, with
+        # the value they were fixed at. Useful to still report them in
+        # solutions
+        self._fixed_vars = dict()
+        # Variables that were substituted by an affine expression of other
+        # variables, as {name: (offset, {variable name: coefficient})}
+        self._folded_vars = dict()
+
     @abstractmethod
     def copy(self):
         """
@@ -257,11 +265,13 @@ class LCSBModel(ABC):
         """
         objective_value = self.solver.objective.value
         status = self.solver.status
-        variables = pd.Series(data=self.solver.primal_values)
+        var_primals = self.solver.primal_values
+        eliminated = self.get_eliminated_values(var_primals)
+        variables = pd.concat([pd.Series(data=var_primals),
+                               pd.Series(data=eliminated, dtype=float)])
 
         fluxes = empty(len(self.reactions))
         rxn_index = list()
-        var_primals = self.solver.primal_values
 
         for (i, rxn) in enumerate(self.reactions):
             rxn_index.append(rxn.id)
@@ -276,13 +286,44 @@ class LCSBModel(ABC):
 
         self.solution.raw = variables
 
+        values = {k:v.scaling_factor * var_primals[k]
+                  for k,v in self._var_dict.items()}
+        values.update(eliminated)
         self.\
-            solution.values = pd.DataFrame.from_dict({k:v.unscaled
-                                                 for k,v in self._var_dict.items()},
-                                                 orient = 'index')
+            solution.values = pd.DataFrame.from_dict(values, orient = 'index')
 
         return solution
 
+    def get_eliminated_values(self, var_primals):
+        """
+        Computes the value of the variables that are not in the solver problem
+        anymore, either because they were fixed (self._fixed_vars) or folded
+        into other variables (self._folded_vars)
+
+        Names that are still variables of the solver are skipped, so that
+        they are not reported twice.
+
+        :param var_primals: dict-like of the primal values of the solver
+            variables, indexed by name
+        :return: dict {variable name: value}
+        """
+        values = {k:v for k,v in self._fixed_vars.items()
+                  if k not in var_primals}
+
+        for name, (offset, coeffs) in self._folded_vars.items():
+            if name in var_primals:
+                continue
+            values[name] = offset + sum(coeff * var_primals[var_name]
+                                        for var_name, coeff in coeffs.items())
+
+        n_skipped = len(self._fixed_vars) + len(self._folded_vars) \
+                    - len(values)
+        if n_skipped:
+            self.logger.warning('{} eliminated variables are still in the '
+                                'solver problem'.format(n_skipped))
+
+        return values
+
     def optimize(self, objective_sense=None, **kwargs):
         """
         Call the Model.optimize function (which really is but an interface to the
@@ -324,7 +365,8 @@ class LCSBModel(ABC):
         """
 
         constraint_key = constraint_type.__name__
-        return self._cons_kinds[constraint_key]
+        # .get() does not add the missing kinds to the defaultdict
+        return self._cons_kinds.get(constraint_key, DictList())
 
     def get_variables_of_type(self, variable_type):
         """
@@ -336,4 +378,5 @@ class LCSBModel(ABC):
         """
 
         variable_key = variable_type.__name__
-        return self._var_kinds[variable_key]
+        # .get() does not add the missing kinds to the defaultdict
+        return self._var_kinds.get(variable_key, DictList())
@@ -13,6 +13,7 @@ Input/Output tools to import or export pytfa models
 import pickle
 import zlib
 import numpy as np
+import pandas as pd
 import re
 
 from cobra import Model, Reaction, Metabolite
@@ -23,9 +24,9 @@ from ..utils.numerics import BIGM_DG
 from warnings import warn
 
 try:
-    from scipy.sparse import dok_matrix, lil_matrix
+    from scipy.sparse import coo_matrix, dok_matrix, lil_matrix
 except ImportError:
-    dok_matrix, lil_matrix = None, None
+    coo_matrix, dok_matrix, lil_matrix = None, None, None
 
 
 def import_matlab_model(path, variable_name=None):
@@ -407,37 +408,47 @@ def create_generalized_matrix(tmodel, array_type = 'dense'):
     """
     Returns the generalized stoichiomatric matrix used for TFA
 
-    :param array_type:
+    The coefficients are read once per constraint from the solver, and the
+    matrix is assembled from (row, column, value) triplets.
+
+    :param array_type: 'dense', 'dok', 'lil', 'csr', 'csc' or 'DataFrame'
     :param tmodel: pytfa.ThermoModel
 
     :returns: matrix.
     """
 
-    if array_type not in ('DataFrame', 'dense') and not dok_matrix:
+    if array_type not in ('DataFrame', 'dense') and not coo_matrix:
         raise ValueError('Sparse matrices require scipy')
+    if array_type not in ('dense', 'dok', 'lil', 'csr', 'csc', 'DataFrame'):
+        raise ValueError('Unknown array type: {}'.format(array_type))
 
     dtype = np.float64
 
-    array_constructor = {'dense': np.zeros, 'dok': dok_matrix,
-        'lil': lil_matrix, 'DataFrame': np.zeros, }
-
     n_constraints = len(tmodel.constraints)
     n_variables = len(tmodel.variables)
-    array = array_constructor[array_type]((n_constraints, n_variables),
-                                          dtype=dtype)
 
-    c_ind = {x:e for e,x in enumerate(tmodel.constraints)}
-    v_ind = {x:e for e,x in enumerate(tmodel.variables)}
+    v_ind = {x.name:e for e,x in enumerate(tmodel.variables)}
 
-    for this_cons in tmodel.constraints:
+    rows, columns, values = list(), list(), list()
+    for e, this_cons in enumerate(tmodel.constraints):
         var_coeff_dict = this_cons.get_linear_coefficients(this_cons.variables)
 
         for this_var,coeff in var_coeff_dict.items():
-            array[c_ind[this_cons], v_ind[this_var]] = coeff
+            rows.append(e)
+            columns.append(v_ind[this_var.name])
+            values.append(coeff)
+
+    if array_type in ('dense', 'DataFrame'):
+        array = np.zeros((n_constraints, n_variables), dtype=dtype)
+        array[rows, columns] = values
+    else:
+        array = coo_matrix((np.array(values, dtype=dtype), (rows, columns)),
+                           shape=(n_constraints, n_variables))
+        array = array.asformat(array_type)
 
     if array_type == 'DataFrame':
-        metabolite_ids = [met.id for met in tmodel.constraints]
-        reaction_ids = [rxn.id for rxn in tmodel.variables]
+        metabolite_ids = [met.name for met in tmodel.constraints]
+        reaction_ids = [rxn.name for rxn in tmodel.variables]
         return pd.DataFrame(array, index=metabolite_ids, columns=reaction_ids)
 
     else:
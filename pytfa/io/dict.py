@@ -9,6 +9,7 @@
 Make the model serializable
 """
 from collections import OrderedDict, defaultdict
+from copy import deepcopy
 import cobra.io.dict as cbd
 from cobra.exceptions import SolverNotFound
 
@@ -192,7 +193,7 @@ def model_to_dict(model):
 
         if is_thermo and not is_peptide: # peptides have no thermo
             the_met = model.metabolites.get_by_id(the_met_id)
-            _add_thermo_metabolite_info(the_met, rxn_dict)
+            _add_thermo_metabolite_info(the_met, met_dict)
             met_dict['kind'] = 'Metabolite'
 
     # Relaxation info
@@ -201,12 +202,22 @@ def model_to_dict(model):
     except AttributeError:
         pass
 
+    # Variables fixed or folded, and removed from the problem
+    obj['fixed_vars'] = dict(model._fixed_vars)
+    obj['folded_vars'] = deepcopy(model._folded_vars)
+
+    # Reactions left to convert
+    try:
+        obj['lazy_conversion'] = deepcopy(model._lazy_conversion)
+    except AttributeError:
+        pass
+
     return obj
 
 
 def _add_thermo_reaction_info(rxn, rxn_dict):
     if hasattr(rxn, 'thermo'):
-        rxn_dict['thermo'] = rxn.thermo
+        rxn_dict['thermo'] = dict(rxn.thermo)
 
 def _add_thermo_metabolite_info(met, met_dict):
     if hasattr(met, 'thermo'):
@@ -252,6 +263,7 @@ def model_from_dict(obj, solver=None):
                                   hook=hook,
                                   ub = ub,
                                   lb = lb,
+                                  scaling_factor = scaling_factor,
                                   queue=True)
 
         elif classname in METABOLITE_VARIABLE_SUBCLASSES:
@@ -261,6 +273,7 @@ def model_from_dict(obj, solver=None):
                                   hook=hook,
                                   ub = ub,
                                   lb = lb,
+                                  scaling_factor = scaling_factor,
                                   queue=True)
 
         elif classname in ENZYME_VARIABLE_SUBCLASSES:
@@ -270,6 +283,7 @@ def model_from_dict(obj, solver=None):
                                   hook=hook,
                                   ub = ub,
                                   lb = lb,
+                                  scaling_factor = scaling_factor,
                                   queue=True)
 
         elif classname in MODEL_VARIABLE_SUBCLASSES:
@@ -280,6 +294,7 @@ def model_from_dict(obj, solver=None):
                                   id_ = this_id,
                                   ub = ub,
                                   lb = lb,
+                                  scaling_factor = scaling_factor,
                                   queue=True)
 
         else:
@@ -354,6 +369,19 @@ def model_from_dict(obj, solver=None):
     except KeyError:
         pass
 
+    # Variables fixed or folded, and removed from the problem
+    try:
+        new._fixed_vars = dict(obj['fixed_vars'])
+        new._folded_vars = deepcopy(obj['folded_vars'])
+    except KeyError:
+        pass
+
+    # Reactions left to convert
+    try:
+        new._lazy_conversion = deepcopy(obj['lazy_conversion'])
+    except KeyError:
+        pass
+
     return new
 
 
@@ -10,8 +10,16 @@ Debugging of models
 
 """
 
-from collections import defaultdict
+from math import ceil
+from multiprocessing import Pool
+from time import time
+
+import numpy as np
 import pandas as pd
+from optlang.interface import OPTIMAL, INFEASIBLE
+from optlang.symbolics import Zero
+
+from ..io.base import create_generalized_matrix
 
 def debug_iis(model):
     """
@@ -41,34 +49,378 @@ def debug_iis(model):
 
     return out_c, out_v
 
+def find_iis(model, constraints=None, variables=None, elastic=True,
+             relax_integers=False, processes=1, time_limit=None):
+    """
+    Finds an Irreducible Inconsistent Subsystem (IIS) with any solver. The
+    pytfa constraints and the bounds of the pytfa variables are the soft
+    elements of the search; the other constraints and bounds of the model
+    (e.g. mass balances and flux bounds) are always enforced.
+
+    * The elastic filter adds slacks to the soft elements and minimizes
+      them. The elements with a slack are enforced, until the problem is
+      infeasible: the enforced elements then contain an IIS.
+    * The deletion filter removes these elements one by one, and keeps the
+      ones without which the model becomes feasible.
+
+    The model is modified in place and restored, so the solver re-optimizes
+    from its previous basis. With several processes, the deletion probes
+    are run in parallel on forked replicas of the model.
+
+    :param model: pytfa.core.model.LCSBModel
+    :param constraints: Iterable of the soft GenericConstraint, all by
+        default
+    :param variables: Iterable of the GenericVariable whose bounds are soft,
+        all the continuous ones by default
+    :param elastic: if False, the deletion filter is run over all the soft
+        elements
+    :param relax_integers: if True, the IIS of the LP relaxation is computed,
+        which is faster but ignores the infeasibilities due to integrality
+    :param processes: number of parallel deletion probes
+    :param time_limit: optional time limit, in seconds. If reached, the
+        elements found so far are returned: they are infeasible, but may not
+        be irreducible.
+    :return: (constraints, variables): lists of the GenericConstraint and of
+        the GenericVariable in the IIS, or None if the soft elements are not
+        the cause of the infeasibility
+    """
+    if constraints is None:
+        constraints = model._cons_dict.values()
+    if variables is None:
+        variables = [x for x in model._var_dict.values()
+                     if x.variable.type == 'continuous']
+    constraints = list(constraints)
+    elements = constraints + list(variables)
+    # Optlang objects, whose bounds are removed to relax the element
+    objects = [x.constraint for x in constraints] \
+        + [x.variable for x in elements[len(constraints):]]
+    bounds = [(x.lb, x.ub) for x in objects]
+
+    deadline = None if time_limit is None else time() + time_limit
+    timeout = model.solver.configuration.timeout
+    integers = [(x, x.type, x.lb, x.ub) for x in model.variables
+                if relax_integers and x.type != 'continuous']
+
+    try:
+        for x, _, _, _ in integers:
+            x.type = 'continuous'
+
+        candidates = list(range(len(elements)))
+        if elastic:
+            candidates = _elastic_filter(model, objects, bounds, deadline)
+            if candidates is None:
+                return None
+
+        # The other elements are removed during the deletion filter
+        for i in set(range(len(elements))) - set(candidates):
+            _set_bounds(objects[i], None, None)
+
+        with model:
+            model.objective = model.problem.Objective(Zero, sloppy=True)
+            iis = _deletion_filter(model, objects, bounds, candidates,
+                                   processes, deadline)
+    finally:
+        for x, lb in zip(objects, bounds):
+            _set_bounds(x, *lb)
+        for x, type_, lb, ub in integers:
+            x.type = type_
+            x.set_bounds(lb, ub)
+        model.solver.configuration.timeout = timeout
+
+    if iis is None:
+        return None
+
+    model.logger.info('IIS of {} elements'.format(len(iis)))
+    out_c = [elements[i] for i in iis if i < len(constraints)]
+    out_v = [elements[i] for i in iis if i >= len(constraints)]
+    return out_c, out_v
+
+def _set_bounds(obj, lb, ub):
+    """
+    Sets the bounds of an optlang variable or constraint. The lower bound is
+    set first, which is valid from free bounds.
+    """
+    obj.ub = None
+    obj.lb = lb
+    obj.ub = ub
+
+def _set_timeout(model, deadline):
+    """
+    :return: False if the deadline is reached
+    """
+    if deadline is None:
+        return True
+    remaining = deadline - time()
+    if remaining <= 0:
+        return False
+    model.solver.configuration.timeout = int(ceil(remaining))
+    return True
+
+def _elastic_filter(model, objects, bounds, deadline):
+    """
+    :return: the indices of the elements that contain an IIS, all of them
+        if the deadline is reached, or None if the IIS is not among them
+    """
+    # The slacks, the bound rows and the objective are removed on exit
+    with model:
+        slacks = [(model.problem.Variable('IISNeg_{}'.format(i), lb=0),
+                   model.problem.Variable('IISPos_{}'.format(i), lb=0))
+                  for i in range(len(objects))]
+        model.add_cons_vars([x for pair in slacks for x in pair])
+
+        # Variable bounds are made elastic by moving them to a row
+        bound_rows = {i: model.problem.Constraint(Zero, lb=bounds[i][0],
+                                                  ub=bounds[i][1],
+                                                  name='IISBound_{}'.format(i))
+                      for i, x in enumerate(objects)
+                      if isinstance(x, model.problem.Variable)}
+        model.add_cons_vars(list(bound_rows.values()))
+        model.solver.update()
+
+        model.objective = model.problem.Objective(Zero, direction='min',
+                                                  sloppy=True)
+        model.objective.set_linear_coefficients(
+            {x: 1 for pair in slacks for x in pair})
+
+        epsilon = model.solver.configuration.tolerances.feasibility
+        enforced = list()
+        try:
+            for i, x in enumerate(objects):
+                neg, pos = slacks[i]
+                if i in bound_rows:
+                    _set_bounds(x, None, None)
+                    bound_rows[i].set_linear_coefficients({x: 1, neg: 1,
+                                                           pos: -1})
+                else:
+                    x.set_linear_coefficients({neg: 1, pos: -1})
+
+            while _set_timeout(model, deadline):
+                model.slim_optimize()
+                status = model.solver.status
+                if status == INFEASIBLE:
+                    if not enforced:
+                        model.logger.error('The model is infeasible without '
+                                           'the soft constraints and bounds')
+                        return None
+                    return enforced
+                if status != OPTIMAL:
+                    break
+                used = [i for i, (neg, pos) in enumerate(slacks)
+                        if neg.primal > epsilon or pos.primal > epsilon]
+                if not used:
+                    model.logger.info('The model is feasible')
+                    return None
+                for i in used:
+                    for x in slacks[i]:
+                        x.ub = 0
+                enforced += used
+        finally:
+            for i in bound_rows:
+                _set_bounds(objects[i], *bounds[i])
+
+    model.logger.warning('Elastic filter stopped early, all the elements are '
+                         'kept')
+    return list(range(len(objects)))
+
+def _deletion_filter(model, objects, bounds, candidates, processes,
+                     deadline):
+    """
+    :return: the indices of the elements of the IIS, or None if the model is
+        feasible with the candidates
+    """
+    global _iis_data
+    _iis_data = (model, objects, bounds, deadline)
+
+    if not _probe((None, [])):
+        model.logger.info('The model is feasible')
+        return None
+
+    pool = None
+    if processes > 1:
+        pool = Pool(processes, initializer=_init_iis_worker,
+                    initargs=(model, objects, bounds, deadline))
+
+    try:
+        necessary = list()
+        dropped = list()
+        remaining = list(candidates)
+        while remaining:
+            if deadline is not None and time() > deadline:
+                model.logger.warning('IIS search stopped early, the result '
+                                     'may not be irreducible')
+                return necessary + remaining
+
+            batch = remaining[:processes]
+            tasks = [(i, dropped) for i in batch]
+            results = pool.map(_probe, tasks) if pool is not None \
+                else [_probe(tasks[0])]
+
+            # An element without which the model is feasible is in the IIS.
+            # This holds for any subset of the elements left, but only the
+            # first element that can be dropped is dropped.
+            for i, infeasible in zip(batch, results):
+                if not infeasible:
+                    necessary.append(i)
+                    remaining.remove(i)
+            for i, infeasible in zip(batch, results):
+                if infeasible:
+                    dropped.append(i)
+                    remaining.remove(i)
+                    break
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    return sorted(necessary)
+
+# Has to be declared outside of the function to be used for multiprocessing
+def _init_iis_worker(model, objects, bounds, deadline):
+    """
+    Initializes a process of the deletion probes. With fork, the model is
+    inherited from the parent process.
+    """
+    global _iis_data
+    _iis_data = (model, objects, bounds, deadline)
+
+def _probe(task):
+    """
+    Checks if the model is infeasible without some elements.
+
+    :param task: (index of the element probed or None, indices of the
+        elements already dropped)
+    :return: True if the solver proves the model infeasible
+    """
+    model, objects, bounds, deadline = _iis_data
+    i, dropped = task
+    removed = dropped + ([] if i is None else [i])
+    try:
+        for j in removed:
+            _set_bounds(objects[j], None, None)
+        _set_timeout(model, deadline)
+        model.slim_optimize()
+        return model.solver.status == INFEASIBLE
+    finally:
+        for j in removed:
+            _set_bounds(objects[j], *bounds[j])
+
+def _coefficient_extremes(matrix):
+    """
+    Smallest and largest absolute non-zero coefficient of each row of a
+    sparse matrix, with their column.
+
+    :param matrix: scipy.sparse.csr_matrix
+    :return: (min values, min columns, max values, max columns), with NaN
+        values and -1 columns for empty rows
+    """
+    n_rows = matrix.shape[0]
+    data = np.abs(matrix.data)
+    min_values = np.full(n_rows, np.nan)
+    max_values = np.full(n_rows, np.nan)
+    min_columns = np.full(n_rows, -1)
+    max_columns = np.full(n_rows, -1)
+
+    for i in range(n_rows):
+        start, stop = matrix.indptr[i], matrix.indptr[i+1]
+        values = data[start:stop]
+        nonzero = np.flatnonzero(values)
+        if len(nonzero) == 0:
+            continue
+        i_min = start + nonzero[values[nonzero].argmin()]
+        i_max = start + nonzero[values[nonzero].argmax()]
+        min_values[i], min_columns[i] = data[i_min], matrix.indices[i_min]
+        max_values[i], max_columns[i] = data[i_max], matrix.indices[i_max]
+
+    return min_values, min_columns, max_values, max_columns
+
+def _row_kinds(model):
+    """
+    :return: the pytfa class of each constraint, 'MassBalance' for the
+        metabolites, 'Other' otherwise
+    """
+    return [type(model._cons_dict[x.name]).__name__
+            if x.name in model._cons_dict
+            else 'MassBalance' if x.name in model.metabolites
+            else 'Other' for x in model.constraints]
+
+def _column_kinds(model):
+    """
+    :return: the pytfa class of each variable, 'Flux' for the forward and
+        reverse variables of the reactions, 'Other' otherwise
+    """
+    fluxes = set(x.name for rxn in model.reactions
+                 for x in (rxn.forward_variable, rxn.reverse_variable))
+    return [type(model._var_dict[x.name]).__name__
+            if x.name in model._var_dict
+            else 'Flux' if x.name in fluxes
+            else 'Other' for x in model.variables]
+
+def conditioning_report(model):
+    """
+    Ranges of the absolute non-zero coefficients of the constraint matrix,
+    per row, per column and per type of constraint. The range is given as
+    log10(max/min), in orders of magnitude.
+
+    :param model: pytfa.core.model.LCSBModel
+    :return: (rows, columns, types): pandas.DataFrame with the columns
+        ['kind', 'min', 'max', 'range'] indexed by constraint and variable
+        names, and a summary by kind of constraint, with its number of rows
+    """
+    matrix = create_generalized_matrix(model, array_type='csr')
+
+    def prep_result(matrix, names, kinds):
+        min_values, _, max_values, _ = _coefficient_extremes(matrix)
+        res = pd.DataFrame({'kind': kinds,
+                            'min': min_values,
+                            'max': max_values,
+                            'range': np.log10(max_values / min_values)},
+                           index=names,
+                           columns=['kind', 'min', 'max', 'range'])
+        return res
+
+    rows = prep_result(matrix, [x.name for x in model.constraints],
+                       _row_kinds(model))
+    columns = prep_result(matrix.T.tocsr(), [x.name for x in model.variables],
+                          _column_kinds(model))
+
+    types = rows.groupby('kind').agg({'min': 'min', 'max': 'max'})
+    types.insert(0, 'n', rows.groupby('kind').size())
+    types['range'] = np.log10(types['max'] / types['min'])
+
+    model.logger.info('Coefficient range: {:.1f} orders of magnitude'
+                      .format(np.log10(rows['max'].max() / rows['min'].min())))
+
+    return rows, columns, types
+
 def find_extreme_coeffs(model,n=5):
-    max_coeff_dict = defaultdict(int)
-    min_coeff_dict = defaultdict(lambda:1000)
-    max_cons_dict = dict()
-    min_cons_dict = dict()
-
-    for the_cons in model.constraints:
-        for the_var, the_coeff in the_cons.expression.as_coefficients_dict().items():
-            if abs(the_coeff) > max_coeff_dict[the_var.name]:
-                max_coeff_dict[the_var.name] = abs(the_coeff)
-                max_cons_dict[the_var.name] = the_cons.name
-            if 0 < abs(the_coeff) < min_coeff_dict[the_var.name]:
-                min_coeff_dict[the_var.name] = abs(the_coeff)
-                min_cons_dict[the_var.name] = the_cons.name
-
-    def prep_result(cons_dict, coeff_dict):
-        coeff_data = pd.DataFrame.from_dict(coeff_dict, orient = 'index')
-        cons_data = pd.DataFrame.from_dict(cons_dict, orient = 'index')
-
-        res = pd.concat([cons_data, coeff_data], axis = 1)
-        res.columns = ['constraint','coeff']
+    """
+    Finds the variables with the largest and the smallest absolute
+    coefficients of the constraint matrix.
+
+    :param model:
+    :param n: number of variables of each kind
+    :return: pandas.DataFrame indexed by variable, with the constraint and
+        the absolute coefficient, the n largest first, then the n smallest
+    """
+    matrix = create_generalized_matrix(model, array_type='csc').T.tocsr()
+    min_values, min_rows, max_values, max_rows = _coefficient_extremes(matrix)
+    var_names = [x.name for x in model.variables]
+    cons_names = [x.name for x in model.constraints]
+
+    def prep_result(values, rows):
+        has_coeff = rows >= 0
+        res = pd.DataFrame({'constraint': [cons_names[i]
+                                           for i in rows[has_coeff]],
+                            'coeff': values[has_coeff]},
+                           index=[x for x, y in zip(var_names, has_coeff)
+                                  if y],
+                           columns=['constraint','coeff'])
         res.index.name = 'variable'
         return res
 
-
-    ret1 = prep_result(max_cons_dict, max_coeff_dict)\
+    ret1 = prep_result(max_values, max_rows)\
         .sort_values('coeff',ascending=False).head(n)
-    ret2 = prep_result(min_cons_dict, min_coeff_dict)\
+    ret2 = prep_result(min_values, min_rows)\
         .sort_values('coeff',ascending=True).head(n)
 
     return pd.concat([ret1, ret2], axis = 0)
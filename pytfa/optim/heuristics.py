@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: pytfa
+   :platform: Unix, Windows
+   :synopsis: Thermodynamics-based Flux Analysis
+
+.. moduleauthor:: pyTFA team
+
+Primal heuristics for TFA problems: a feasible point is built from the LP
+relaxation of the problem, and used to warm start the MILP
+
+"""
+
+from cobra.util.solver import fix_objective_as_constraint
+from optlang.interface import OPTIMAL
+from optlang.symbolics import Zero
+
+from .constraints import NegativeDeltaG
+from .utils import continuous_use_variables
+from .variables import DeltaG, ForwardUseVariable, BackwardUseVariable
+from ..utils import numerics
+
+EPSILON = numerics.EPSILON
+
+
+def get_deltag_bounds(tmodel):
+    """
+    Bounds the DeltaG of each reaction from its NegativeDeltaG constraint and
+    the bounds of the other variables of the constraint (DeltaGstd, LCs).
+    These bounds are looser than the ones of a variability analysis, but cost
+    no solve.
+
+    :param tmodel: pytfa.thermo.ThermoModel
+    :return: dict {reaction id: (DeltaG lower bound, DeltaG upper bound)}
+    """
+    bounds = dict()
+
+    for cons in tmodel.get_constraints_of_type(NegativeDeltaG):
+        try:
+            dg = tmodel._var_dict[DeltaG.prefix + cons.id].variable
+        except KeyError:
+            continue
+        coeffs = cons.constraint.get_linear_coefficients(
+            cons.constraint.variables)
+        a = coeffs.pop(dg)
+
+        # lb <= a*DG + s <= ub, with s in [s_min, s_max]
+        s_min = sum(min(k * x.lb, k * x.ub) for x, k in coeffs.items())
+        s_max = sum(max(k * x.lb, k * x.ub) for x, k in coeffs.items())
+        limits = ((cons.constraint.lb - s_max) / a,
+                  (cons.constraint.ub - s_min) / a)
+
+        bounds[cons.id] = (max(min(limits), dg.lb), min(max(limits), dg.ub))
+
+    return bounds
+
+
+def get_candidate_profile(tmodel, loopless = True, flux_tol = 1e-9,
+                          use_deltag_bounds = True):
+    """
+    Builds a candidate directionality profile from the LP relaxation of the
+    TFA problem. Directions that the DeltaG bounds forbid (see
+    :func:`get_deltag_bounds`) are blocked first. If loopless is True, the
+    total flux is then minimized at the optimum of the relaxation, which
+    removes the loops from the flux distribution. Each reaction takes the
+    direction of its net flux, and reactions without flux get no direction.
+
+    :param tmodel: pytfa.thermo.ThermoModel
+    :param loopless: if True, minimizes the total flux of the solution
+    :param flux_tol: net fluxes smaller than this are considered zero
+    :param use_deltag_bounds: if False, no direction is blocked, e.g. when
+        the DeltaG bounds are the ones being relaxed
+    :return: (profile, bound) with profile a dict {use variable name: 0 or 1}
+        and bound the objective value of the relaxation, which bounds the one
+        of the MILP
+    """
+    epsilon = tmodel.solver.configuration.tolerances.feasibility
+
+    fwd_use = {x.id: x for x in tmodel.get_variables_of_type(ForwardUseVariable)}
+    bwd_use = {x.id: x for x in tmodel.get_variables_of_type(BackwardUseVariable)}
+
+    with continuous_use_variables(tmodel):
+        # The bounds of the use variables are restored on exit
+        deltag_bounds = get_deltag_bounds(tmodel) if use_deltag_bounds \
+            else dict()
+        for rxn_id, (dg_lb, dg_ub) in deltag_bounds.items():
+            if dg_lb > -epsilon and rxn_id in fwd_use:
+                fwd_use[rxn_id].variable.ub = 0
+            if dg_ub < epsilon and rxn_id in bwd_use:
+                bwd_use[rxn_id].variable.ub = 0
+
+        bound = tmodel.slim_optimize()
+
+        if tmodel.solver.status != OPTIMAL:
+            return None, bound
+
+        if loopless:
+            with tmodel:
+                fix_objective_as_constraint(tmodel, fraction=1.0)
+                tmodel.objective = tmodel.problem.Objective(
+                    Zero, direction='min', sloppy=True)
+                tmodel.objective.set_linear_coefficients(
+                    {x: 1 for rxn in tmodel.reactions
+                     for x in (rxn.forward_variable, rxn.reverse_variable)})
+                tmodel.slim_optimize()
+                net_fluxes = {x.id: x.forward_variable.primal
+                                    - x.reverse_variable.primal
+                              for x in tmodel.reactions}
+        else:
+            net_fluxes = {x.id: x.forward_variable.primal
+                                - x.reverse_variable.primal
+                          for x in tmodel.reactions}
+
+    profile = dict()
+    for rxn_id, use_var in fwd_use.items():
+        profile[use_var.name] = int(net_fluxes[rxn_id] > flux_tol)
+    for rxn_id, use_var in bwd_use.items():
+        profile[use_var.name] = int(net_fluxes[rxn_id] < -flux_tol)
+
+    return profile, bound
+
+
+def find_feasible_point(tmodel, profile):
+    """
+    Solves the LP of a directionality profile, without copying the cobra_model
+    (see :func:`~.pytfa.optim.utils.continuous_use_variables`). The solution
+    is feasible for the MILP.
+
+    :param tmodel: pytfa.thermo.ThermoModel
+    :param profile: dict {use variable name: 0 or 1}
+    :return: the solution of the LP, or None if the profile is infeasible
+    """
+    with continuous_use_variables(tmodel, profile):
+        tmodel.slim_optimize()
+        if tmodel.solver.status != OPTIMAL:
+            return None
+        return tmodel.get_solution()
+
+
+def set_mip_start(tmodel, solution):
+    """
+    Gives the values of a solution to the solver as a MIP start. Only Gurobi
+    and CPLEX support it.
+
+    :param tmodel: pytfa.thermo.ThermoModel
+    :param solution: a feasible solution, with values in solution.raw
+    :return: True if the MIP start was set, False if the solver does not
+        support it
+    """
+    interface = tmodel.solver.interface.__name__
+    values = {x.name: solution.raw[x.name] for x in tmodel.variables}
+
+    if interface == 'optlang.gurobi_interface':
+        for x in tmodel.variables:
+            x._internal_variable.Start = values[x.name]
+        tmodel.solver.problem.update()
+        return True
+
+    elif interface == 'optlang.cplex_interface':
+        import cplex
+        mip_starts = tmodel.solver.problem.MIP_starts
+        mip_starts.add(cplex.SparsePair(ind=list(values.keys()),
+                                        val=list(values.values())),
+                       mip_starts.effort_level.repair)
+        return True
+
+    return False
+
+
+def warm_start(tmodel, loopless = True):
+    """
+    Finds a feasible point of the TFA problem with
+    :func:`get_candidate_profile` and :func:`find_feasible_point`, and sets it
+    as MIP start when the solver supports it.
+
+    :param tmodel: pytfa.thermo.ThermoModel
+    :param loopless: see :func:`get_candidate_profile`
+    :return: (solution, bound), with solution the feasible point (None if the
+        heuristic failed) and bound the objective value of the LP relaxation
+    """
+    profile, bound = get_candidate_profile(tmodel, loopless=loopless)
+
+    if profile is None:
+        tmodel.logger.info('Heuristic: the LP relaxation has no optimum')
+        return None, bound
+
+    solution = find_feasible_point(tmodel, profile)
+
+    if solution is None:
+        tmodel.logger.info('Heuristic: the candidate profile is infeasible')
+        return None, bound
+
+    tmodel.logger.info('Heuristic: feasible point with objective {}, '
+                       'relaxation bound {}'
+                       .format(solution.objective_value, bound))
+
+    if not set_mip_start(tmodel, solution):
+        tmodel.logger.debug('MIP starts are not supported by {}'
+                            .format(tmodel.solver.interface.__name__))
+
+    return solution, bound
+
+
+def heuristic_optimize(tmodel, loopless = True, **kwargs):
+    """
+    Solves the TFA problem, starting from the feasible point of
+    :func:`warm_start`. If the objective value of the point reaches the bound
+    of the LP relaxation, the point is optimal and is returned without solving
+    the MILP. Otherwise the MILP is solved, from this MIP start if the solver
+    supports it.
+
+    :param tmodel: pytfa.thermo.ThermoModel
+    :param loopless: see :func:`get_candidate_profile`
+    :param kwargs: passed to :func:`~.pytfa.core.LCSBModel.optimize`
+    :return: the solution
+    """
+    solution, bound = warm_start(tmodel, loopless=loopless)
+
+    if solution is not None and \
+            abs(solution.objective_value - bound) <= EPSILON * max(1, abs(bound)):
+        tmodel.logger.info('Heuristic: the feasible point is optimal')
+        tmodel.solution = solution
+        return solution
+
+    return tmodel.optimize(**kwargs)
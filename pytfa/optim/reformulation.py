@@ -9,10 +9,14 @@
 MILP-fu to reformulate problems
 
 """
-import sympy
-# import optlang
 from collections import namedtuple
 
+import numpy as np
+import sympy
+from optlang.symbolics import Zero
+
+from .variables import GenericVariable
+
 # Faster than optlang Constraint object
 ConstraintTuple = namedtuple('ConstraintTuple',['name','expression','ub','lb'])
 
@@ -72,32 +76,38 @@ def glovers_linearization(b, fy, z = None, L=0, U=1000):
     if z is None:
         name = '__MUL__'.join([b.name, fy.name])
         z = sympy.Symbol(name = name)
+    else:
+        name = z.name
 
     # 1st Glovers constraint
     # L*b <= z
     # 0 <= z - L*b
-    cons1 = optlang.Constraint(name = name + '_1',
-                               expression = z - L*b,
-                               lb = 0)
+    cons1 = ConstraintTuple(name = name + '_1',
+                            expression = z - L*b,
+                            lb = 0,
+                            ub = None)
     # 2nd Glovers constraint
     # z <= U*b
     # 0 <= U*b - z
-    cons2 = optlang.Constraint(name = name + '_2',
-                               expression = U*b - z,
-                               lb=0)
+    cons2 = ConstraintTuple(name = name + '_2',
+                            expression = U*b - z,
+                            lb = 0,
+                            ub = None)
 
     # 3rd Glovers constraint
     # fy - U*(1-b) <= z
     # 0 <= z - fy + U*(1-b)
-    cons3 = optlang.Constraint(name = name + '_3',
-                               expression = z - fy + U*(1-b),
-                               lb = 0)
+    cons3 = ConstraintTuple(name = name + '_3',
+                            expression = z - fy + U*(1-b),
+                            lb = 0,
+                            ub = None)
     # 4th Glovers constraint
     # z <= fy - L*(1-b)
     # 0 <= fy - L*(1-b) - z
-    cons4 = optlang.Constraint(name = name + '_4',
-                               expression = fy - L*(1-b) - z,
-                               lb=0)
+    cons4 = ConstraintTuple(name = name + '_4',
+                            expression = fy - L*(1-b) - z,
+                            lb = 0,
+                            ub = None)
 
     return z, [cons1,cons2,cons3,cons4]
 
@@ -163,3 +173,113 @@ def petersen_linearization(b, x, z = None, M=1000):
 
 
 
+
+
+def linearize_products(model, binaries, continuous, L=None, U=None,
+                       method='glover'):
+    """
+    Linearizes the products z_i = b_i*x_i of many binary variables b_i and
+    continuous variables x_i at once. The product variables and the
+    constraints are added to the model in bulk, and their coefficients are
+    set afterwards, without building symbolic expressions.
+
+    The bounds used in the linearization are tightened with the bounds of
+    the continuous variables: L_i = max(L_i, x_i.lb), U_i = min(U_i, x_i.ub)
+
+    * method='glover', see :func:`glovers_linearization`:
+
+      { L*b <= z <= U*b
+      { x - U*(1-b) <= z <= x - L*(1-b)
+
+    * method='petersen', see :func:`petersen_linearization`, for x >= 0
+      (x.lb >= 0, a missing lower bound is negative) and M = U:
+
+      { x + U*b - U <= z <= U*b
+      { z <= x
+
+    The constraints are named after the product variable, like in the
+    single-product functions.
+
+    :param model: a cobra.Model or pytfa.core.model.LCSBModel
+    :param binaries: iterable of binary optlang variables (or pytfa
+        variables)
+    :param continuous: iterable of continuous optlang variables (or pytfa
+        variables), of same length
+    :param L: minimal values of the continuous variables, scalar or array.
+        Defaults to their lower bounds
+    :param U: maximal values of the continuous variables, scalar or array.
+        Defaults to their upper bounds
+    :param method: 'glover' or 'petersen'
+    :return: (products, constraints): the list of product variables z_i, in
+        the order of the inputs, and the list of the added constraints
+    """
+
+    binaries = [x.variable if isinstance(x, GenericVariable) else x
+                for x in binaries]
+    continuous = [x.variable if isinstance(x, GenericVariable) else x
+                  for x in continuous]
+
+    if len(binaries) != len(continuous):
+        raise ValueError('binaries and continuous must have the same length')
+    if method not in ('glover', 'petersen'):
+        raise ValueError('Unknown linearization method: {}'.format(method))
+    for b in binaries:
+        assert(b.type == OPTLANG_BINARY)
+
+    n = len(continuous)
+    lb = np.array([-np.inf if x.lb is None else x.lb for x in continuous],
+                  dtype=float)
+    ub = np.array([np.inf if x.ub is None else x.ub for x in continuous],
+                  dtype=float)
+    L = lb if L is None else np.maximum(np.broadcast_to(L, n), lb)
+    U = ub if U is None else np.minimum(np.broadcast_to(U, n), ub)
+
+    if not (np.isfinite(L).all() and np.isfinite(U).all()):
+        raise ValueError('L and U must be finite, either given or from the '
+                         'bounds of the continuous variables')
+    # On the bounds of x: L does not make x nonnegative
+    if method == 'petersen' and (lb < 0).any():
+        raise ValueError('The Petersen linearization needs x >= 0, from the '
+                         'lower bounds of the continuous variables')
+
+    names = ['__MUL__'.join([b.name, x.name])
+             for b, x in zip(binaries, continuous)]
+
+    # z is 0 or x
+    products = [model.problem.Variable(name,
+                                       lb=min(l, 0),
+                                       ub=max(u, 0))
+                for name, l, u in zip(names, L, U)]
+
+    # (name, lb, ub, coefficients) of the rows
+    rows = list()
+    for name, z, b, x, l, u in zip(names, products, binaries, continuous,
+                                   L, U):
+        if method == 'glover':
+            # L*b <= z
+            # z <= U*b
+            # x - U*(1-b) <= z
+            # z <= x - L*(1-b)
+            rows += [(name + '_1', 0, None, {z: 1, b: -l}),
+                     (name + '_2', 0, None, {b: u, z: -1}),
+                     (name + '_3', -u, None, {z: 1, x: -1, b: -u}),
+                     (name + '_4', l, None, {x: 1, z: -1, b: l})]
+        else:
+            # x + U*b - U <= z
+            # z <= U*b
+            # z <= x
+            rows += [(name + '_1', None, u, {x: 1, b: u, z: -1}),
+                     (name + '_2', 0, None, {b: u, z: -1}),
+                     (name + '_3', 0, None, {x: 1, z: -1})]
+
+    constraints = [model.problem.Constraint(Zero, name=name, lb=lb, ub=ub)
+                   for name, lb, ub, _ in rows]
+
+    model.add_cons_vars(products)
+    model.add_cons_vars(constraints)
+    model.solver.update()
+
+    for cons, (_, _, _, coeffs) in zip(constraints, rows):
+        cons.set_linear_coefficients(coeffs)
+
+    return products, constraints
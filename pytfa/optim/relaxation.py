@@ -11,16 +11,26 @@ Relaxation of models with constraint too tight
 """
 
 from collections import OrderedDict
+from contextlib import contextmanager
 from copy import deepcopy
+from math import ceil
+from multiprocessing import Pool, Queue
+from queue import Empty
+from time import time
+from warnings import warn
 
 from tqdm import tqdm
 import pandas as pd
 from cobra.util.solver import set_objective
 from optlang.exceptions import SolverError
+from optlang.interface import OPTIMAL, FEASIBLE, TIME_LIMIT, INFEASIBLE
+from optlang.symbolics import Zero
 
 from .constraints import NegativeDeltaG
 from .config import dg_relax_config
-from .utils import get_solution_value_for_variables, chunk_sum, symbol_sum
+from .heuristics import get_candidate_profile, find_feasible_point
+from .utils import get_solution_value_for_variables, chunk_sum, symbol_sum, \
+    continuous_use_variables
 from .variables import PosSlackVariable, NegSlackVariable, DeltaGstd, \
     LogConcentration, NegSlackLC, PosSlackLC
 from ..utils import numerics
@@ -63,6 +73,8 @@ def relax_dgo(tmodel, reactions_to_ignore=(), solver=None, in_place = False):
     :return: a cobra_model with relaxed bounds on standard Gibbs free energy
     """
 
+    _check_dgo_variables(tmodel)
+
     if solver is None:
         solver = tmodel.solver.interface
 
@@ -258,169 +270,823 @@ def relax_dgo(tmodel, reactions_to_ignore=(), solver=None, in_place = False):
 
 
 
-def relax_lc(tmodel, metabolites_to_ignore = (), solver = None):
+def _check_dgo_variables(tmodel):
+    """
+    Raises a ValueError if the DeltaGstd variables of the model were folded
+    into the NegativeDeltaG constraints by convert(compact=True), since
+    there is then no variable to relax.
     """
+    if any(x.startswith(DeltaGstd.prefix) for x in tmodel._folded_vars):
+        raise ValueError('The DeltaGstd variables of {} are folded into its '
+                         'NegativeDeltaG constraints (compact formulation), '
+                         'they cannot be relaxed. Convert the model with '
+                         'compact=False to relax them.'.format(tmodel.name))
 
-    :param metabolites_to_ignore:
-    :param in_tmodel:
-    :type in_tmodel: pytfa.thermo.ThermoModel:
-    :param min_objective_value:
-    :return:
+
+def _relaxation_candidates(tmodel, dgo, lc, reactions_to_ignore,
+                           metabolites_to_ignore):
+    """
+    :return: OrderedDict {variable name: (GenericVariable, negative slack
+        prefix, positive slack prefix)} of the variables to relax
     """
+    candidates = OrderedDict()
+    if dgo:
+        _check_dgo_variables(tmodel)
+        for x in tmodel.get_variables_of_type(DeltaGstd):
+            if x.id not in reactions_to_ignore:
+                candidates[x.name] = (x, NegSlackVariable.prefix,
+                                      PosSlackVariable.prefix)
+    if lc:
+        for x in tmodel.get_variables_of_type(LogConcentration):
+            if x.id not in metabolites_to_ignore \
+                    and x.name not in metabolites_to_ignore:
+                candidates[x.name] = (x, NegSlackLC.prefix, PosSlackLC.prefix)
+    return candidates
+
+
+def _add_relaxation(tmodel, candidates, objective, weights):
+    """
+    Adds the slacks of the candidates to the NegativeDeltaG rows, and the
+    relaxation objective. To be called in a `with tmodel` block, which
+    removes them on exit.
 
-    if solver is None:
-        solver = tmodel.solver
+    :return: (slacks, indicators): OrderedDict {variable name: (negative
+        slack, positive slack)} and, with the 'count' objective,
+        OrderedDict {variable name: binary indicator}
+    """
+    # Coefficients of the relaxed variables in the NegativeDeltaG rows
+    terms = OrderedDict()
+    for this_neg_dg in tmodel.get_constraints_of_type(NegativeDeltaG):
+        constraint = this_neg_dg.constraint
+        for var, coeff in constraint.get_linear_coefficients(
+                constraint.variables).items():
+            if var.name in candidates:
+                terms.setdefault(var.name, []).append((constraint, coeff))
+
+    slacks = OrderedDict(
+        (name, (tmodel.problem.Variable(candidates[name][1]
+                                        + candidates[name][0].id,
+                                        lb=0, ub=BIGM_DG),
+                tmodel.problem.Variable(candidates[name][2]
+                                        + candidates[name][0].id,
+                                        lb=0, ub=BIGM_DG)))
+        for name in terms)
+
+    new_vars = [x for pair in slacks.values() for x in pair]
+    indicators = OrderedDict()
+    if objective == 'count':
+        indicators = OrderedDict(
+            (name, tmodel.problem.Variable('RelaxUse_' + name,
+                                           type='binary'))
+            for name in slacks)
+        new_vars += list(indicators.values())
+    tmodel.add_cons_vars(new_vars)
+
+    # The slacks can only be used if the indicator is on
+    couplings = [tmodel.problem.Constraint(Zero, ub=0,
+                                           name='RelaxCoupling_' + name)
+                 for name in indicators]
+    tmodel.add_cons_vars(couplings)
+    tmodel.solver.update()
+
+    # One coefficient update per row
+    row_coeffs = OrderedDict()
+    for name, (neg_slack, pos_slack) in slacks.items():
+        for constraint, coeff in terms[name]:
+            row_coeffs.setdefault(constraint, dict()).update(
+                {neg_slack: -coeff, pos_slack: coeff})
+    for constraint, coeffs in tqdm(row_coeffs.items(),
+                                   desc='adding slacks'):
+        constraint.set_linear_coefficients(coeffs)
+
+    for coupling, (name, indicator) in zip(couplings, indicators.items()):
+        neg_slack, pos_slack = slacks[name]
+        coupling.set_linear_coefficients({neg_slack: 1, pos_slack: 1,
+                                          indicator: -BIGM_DG})
+
+    tmodel.objective = tmodel.problem.Objective(Zero, direction='min',
+                                                sloppy=True)
+    if objective == 'count':
+        penalties = {indicator: weights.get(name, 1)
+                     for name, indicator in indicators.items()}
+    else:
+        penalties = {x: weights.get(name, 1)
+                     for name, pair in slacks.items() for x in pair}
+    tmodel.objective.set_linear_coefficients(penalties)
 
-    # Create a copy of the cobra_model on which we will perform the slack addition
-    slack_model = deepcopy(tmodel)
-    slack_model.solver = solver
+    return slacks, indicators
 
-    # Create a copy that will receive the relaxation
-    relaxed_model = deepcopy(tmodel)
-    relaxed_model.solver = solver
 
-    # Do not relax if cobra_model is already optimal
-    try:
-        solution = tmodel.optimize()
-    except SolverError as SE:
+def _relaxation_table(candidates, slack_values, epsilon, apply,
+                      report_all=False):
+    """
+    :param slack_values: dict {variable name: (negative slack value,
+        positive slack value)}
+    :param report_all: if True, all the variables of slack_values are in the
+        table, even the ones without a slack above epsilon
+    :return: the relaxation table of the variables with a slack above
+        epsilon, or None if there is none
+    """
+    changes = OrderedDict()
+
+    for name, (delta_lb, delta_ub) in slack_values.items():
+        if report_all or delta_lb > epsilon or delta_ub > epsilon:
+            the_var = candidates[name][0].variable
+            previous_lb = the_var.lb
+            previous_ub = the_var.ub
+            new_lb = previous_lb - (delta_lb + epsilon)
+            new_ub = previous_ub + (delta_ub + epsilon)
+
+            if apply:
+                the_var.set_bounds(new_lb, new_ub)
+
+            changes[name] = [previous_lb,
+                             previous_ub,
+                             delta_lb,
+                             delta_ub,
+                             new_lb,
+                             new_ub]
+
+    if len(changes) == 0:
+        return None
+
+    relax_table = pd.DataFrame.from_dict(changes, orient='index')
+    relax_table.columns = ['lb_in',
+                           'ub_in',
+                           'lb_change',
+                           'ub_change',
+                           'lb_out',
+                           'ub_out']
+
+    return relax_table
+
+
+def relax_model(tmodel, dgo=True, lc=False, objective='l1', weights=None,
+                reactions_to_ignore=(), metabolites_to_ignore=(),
+                apply=False):
+    """
+    Minimal feasibility relaxation of the bounds of the DeltaGstd and/or log
+    concentration variables of a model, with any optlang solver.
+
+    Each relaxed variable gets a negative and a positive slack, added with
+    the coefficient of the variable to the NegativeDeltaG rows it appears
+    in. The slacks are added in place with coefficient updates, and removed
+    with the objective once their values are read, so the model is back to
+    its original state on return.
+
+    The objective can be:
+
+    * 'l1': the (weighted) sum of the slacks,
+    * 'count': the (weighted) number of relaxed variables. Each variable
+      gets a binary indicator that its slacks need.
+
+    :param tmodel: pytfa.thermo.ThermoModel
+    :param dgo: if True, the DeltaGstd variables are relaxed
+    :param lc: if True, the log concentration variables are relaxed. With
+        dgo, both are relaxed jointly, in a single solve.
+    :param objective: 'l1' or 'count'
+    :param weights: optional dict {variable name: weight} of the penalties,
+        1 by default
+    :param reactions_to_ignore: Iterable of reactions whose DeltaGstd should
+        not be relaxed
+    :param metabolites_to_ignore: Iterable of metabolites whose log
+        concentration should not be relaxed
+    :param apply: if True, the bounds of the relaxed variables are widened
+    :return: the relaxation table, indexed by variable name, or None if no
+        relaxation was found
+    """
+    if objective not in ('l1', 'count'):
+        raise ValueError("objective must be 'l1' or 'count'")
+    if weights is None:
+        weights = dict()
+
+    candidates = _relaxation_candidates(tmodel, dgo, lc, reactions_to_ignore,
+                                        metabolites_to_ignore)
+
+    # The slacks and the objective are removed on exit
+    with tmodel:
+        slacks, _ = _add_relaxation(tmodel, candidates, objective, weights)
+
+        tmodel.logger.info('Optimizing slack model')
+        tmodel.slim_optimize()
         status = tmodel.solver.status
-        tmodel.logger.error(SE)
-        tmodel.logger.warning('Solver status: {}'.format(status))
-    # if tmodel.solver.status == OPTIMAL:
-    #     raise Exception('Model is already optimal')
+        if status in (TIME_LIMIT, FEASIBLE) \
+                and tmodel.solver.objective.value is not None:
+            tmodel.logger.warning('Relaxation stopped early (solver status: '
+                                  '{}), it may not be minimal'.format(status))
+        elif status != OPTIMAL:
+            tmodel.logger.error('Relaxation could not complete '
+                                '(solver status: {})'.format(status))
+            return None
+
+        slack_values = OrderedDict((name, (neg.primal, pos.primal))
+                                   for name, (neg, pos) in slacks.items())
+
+    epsilon = tmodel.solver.configuration.tolerances.feasibility
+    relax_table = _relaxation_table(candidates, slack_values, epsilon, apply)
+
+    if relax_table is None:
+        tmodel.logger.error('Relaxation could not complete '
+                            '(no relaxation found)')
 
-    # Find variables that represent standard Gibbs Energy change
-    my_lc = relaxed_model.get_variables_of_type(LogConcentration)
+    return relax_table
 
-    # Find constraints that represent negativity of Gibbs Energy change
-    my_neg_dg = slack_model.get_constraints_of_type(NegativeDeltaG)
 
-    changes = OrderedDict()
-    objective = 0
+def relax_dgo_inplace(tmodel, reactions_to_ignore=(), apply=False):
+    """
+    Same relaxation as :func:`relax_dgo`, without copying the model: the
+    slack variables are added as columns of the existing NegativeDeltaG
+    rows, by coefficient updates. Once their values are read, the slacks
+    and the objective are removed and the model is back to its original
+    state. See :func:`relax_model`.
 
-    pos_slack = dict()
-    neg_slack = dict()
+    :param tmodel: pytfa.thermo.ThermoModel
+    :param reactions_to_ignore: Iterable of reactions that should not be relaxed
+    :param apply: if True, the bounds of the DeltaGstd variables of tmodel are
+        relaxed, as in the relaxed model returned by :func:`relax_dgo`
+    :return: the relaxation table (see :func:`relax_dgo`), or None if no
+        relaxation was found
+    """
+    relax_table = relax_model(tmodel, dgo=True, lc=False,
+                              reactions_to_ignore=reactions_to_ignore,
+                              apply=apply)
 
-    for this_lc in my_lc:
-        if this_lc.name in metabolites_to_ignore:
-            continue
+    if relax_table is not None:
+        relax_table.index = [x[len(DeltaGstd.prefix):]
+                             for x in relax_table.index]
 
-        neg_slack[this_lc.name] = slack_model.add_variable(NegSlackLC,
-                                             this_lc,
-                                             lb= 0,
-                                             ub= BIGM_DG)
+    return relax_table
 
-        pos_slack[this_lc.name] = slack_model.add_variable(PosSlackLC,
-                                             this_lc,
-                                             lb= 0,
-                                             ub= BIGM_DG)
 
-        # Update the objective with the new variables
-        objective += (neg_slack[this_lc.name] + pos_slack[this_lc.name])
+def _is_infeasible(tmodel):
+    """
+    Feasibility check of a model, with a zero objective.
 
-    for this_neg_dg in my_neg_dg:
+    :param tmodel: pytfa.thermo.ThermoModel
+    :return: True if the solver proves the model infeasible
+    """
+    with tmodel:
+        tmodel.objective = tmodel.problem.Objective(Zero, direction='min',
+                                                    sloppy=True)
+        tmodel.slim_optimize()
+        return tmodel.solver.status == INFEASIBLE
 
-        # If there is no thermo, or relaxation forbidden, pass
-        if this_neg_dg.id not in my_neg_dg:
-            continue
 
+def find_conflicting_bounds(tmodel, variables, time_limit=None):
+    """
+    Deletion filter over the bounds of variables: finds a subset of them
+    whose bounds, together with the other (hard) constraints of the model,
+    form an irreducible infeasible subsystem (IIS).
+
+    The bounds are widened by BIGM_DG group by group. A group that leaves the
+    model infeasible is not needed and stays widened; otherwise its bounds
+    are restored and it is split in two, down to single variables. Only
+    feasibility problems are solved, so any solver can be used.
+
+    :param tmodel: pytfa.thermo.ThermoModel
+    :param variables: Iterable of pytfa.optim.variables.GenericVariable whose
+        bounds are soft
+    :param time_limit: optional time limit of each feasibility solve, in
+        seconds. A solve that does not prove infeasibility keeps the bounds.
+    :return: the list of the GenericVariable in the IIS, or None if the model
+        is still infeasible with all the bounds widened
+    """
+    variables = list(variables)
+    original_bounds = {x: (x.variable.lb, x.variable.ub) for x in variables}
+    timeout = tmodel.solver.configuration.timeout
 
-        subs_dict = {k: slack_model.variables.get(k.name) \
-                     for k in this_neg_dg.constraint.variables}
+    def widen(group):
+        for x in group:
+            lb, ub = original_bounds[x]
+            x.variable.set_bounds(lb - BIGM_DG, ub + BIGM_DG)
 
-        # Create the new constraint by adding the slack variables to the
-        # negative delta G constraint (from the initial cobra_model)
-        new_expr = this_neg_dg.constraint.expression.subs(subs_dict)
+    def restore(group):
+        for x in group:
+            x.variable.set_bounds(*original_bounds[x])
 
-        for this_var in this_neg_dg.constraint.variables:
-            if not this_var.name in neg_slack:
+    conflict = list()
+    try:
+        if time_limit is not None:
+            tmodel.solver.configuration.timeout = time_limit
+
+        widen(variables)
+        if _is_infeasible(tmodel):
+            tmodel.logger.error('The model is infeasible independently of '
+                                'the bounds of the variables')
+            return None
+        restore(variables)
+
+        groups = [variables[:len(variables)//2], variables[len(variables)//2:]]
+        n_solves = 1
+        while groups:
+            group = groups.pop(0)
+            if not group:
+                continue
+            widen(group)
+            n_solves += 1
+            if _is_infeasible(tmodel):
                 continue
+            restore(group)
+            if len(group) == 1:
+                conflict.append(group[0])
+            else:
+                groups[0:0] = [group[:len(group)//2], group[len(group)//2:]]
 
-            met_id = pos_slack[this_var.name].id
-            the_met = slack_model.metabolites.get_by_id(met_id)
-            stoich = this_neg_dg.reaction.metabolites[the_met]
-            new_expr += slack_model.RT * stoich \
-                        * \
-            (pos_slack[this_var.name] - neg_slack[this_var.name])
+        tmodel.logger.info('Found {} conflicting bounds in {} solves'
+                           .format(len(conflict), n_solves))
+    finally:
+        restore(variables)
+        tmodel.solver.configuration.timeout = timeout
 
-        # Remove former constraint to override it
-        slack_model.remove_constraint(this_neg_dg)
+    return conflict
 
-        # Add the new variant
-        slack_model.add_constraint(NegativeDeltaG, this_neg_dg.reaction,
-                                   expr=new_expr, lb=0, ub=0)
 
-    # Change the objective to minimize slack
-    set_objective(slack_model, objective)
+def relax_iis(tmodel, dgo=True, lc=False, objective='l1', weights=None,
+              reactions_to_ignore=(), metabolites_to_ignore=(),
+              max_iterations=10, time_limit=None, apply=False):
+    """
+    IIS-guided relaxation: instead of relaxing against every NegativeDeltaG
+    constraint at once, isolates an irreducible infeasible subsystem of the
+    DeltaGstd and/or log concentration bounds (see
+    :func:`find_conflicting_bounds`), and relaxes only the variables in it
+    with :func:`relax_model`. This is repeated until the model is feasible.
+
+    :param tmodel: pytfa.thermo.ThermoModel
+    :param dgo: see :func:`relax_model`
+    :param lc: see :func:`relax_model`
+    :param objective: see :func:`relax_model`
+    :param weights: see :func:`relax_model`
+    :param reactions_to_ignore: see :func:`relax_model`
+    :param metabolites_to_ignore: see :func:`relax_model`
+    :param max_iterations: maximal number of IIS relaxed
+    :param time_limit: optional time limit of each feasibility solve of the
+        deletion filter, in seconds
+    :param apply: if True, the bounds of the relaxed variables are widened
+    :return: the relaxation table, indexed by variable name, or None if no
+        relaxation was found. A variable relaxed in several iterations has
+        its changes summed.
+    """
+    candidates = [x[0] for x in _relaxation_candidates(
+        tmodel, dgo, lc, reactions_to_ignore, metabolites_to_ignore).values()]
+
+    tables = list()
+    for iteration in range(max_iterations):
+        if not _is_infeasible(tmodel):
+            break
+
+        conflict = find_conflicting_bounds(tmodel, candidates, time_limit)
+        if not conflict:
+            break
+        tmodel.logger.info('Relaxing IIS {}: {}'
+                           .format(iteration, [x.name for x in conflict]))
+
+        # The variables outside of the IIS are not relaxed
+        in_conflict = set(x.name for x in conflict)
+        ignored = [x for x in candidates if x.name not in in_conflict]
+        table = relax_model(
+            tmodel, dgo=dgo, lc=lc, objective=objective, weights=weights,
+            reactions_to_ignore=list(reactions_to_ignore)
+                + [x.id for x in ignored if isinstance(x, DeltaGstd)],
+            metabolites_to_ignore=list(metabolites_to_ignore)
+                + [x.id for x in ignored if isinstance(x, LogConcentration)],
+            apply=True)
+        if table is None:
+            break
+        tables.append(table)
+    else:
+        if _is_infeasible(tmodel):
+            tmodel.logger.warning('The model is still infeasible after {} '
+                                  'iterations'.format(max_iterations))
 
-    # Update variables and constraints references
-    slack_model.repair()
+    if len(tables) == 0:
+        tmodel.logger.error('Relaxation could not complete '
+                            '(no relaxation found)')
+        return None
 
-    # Relax
-    slack_model.objective.direction = 'min'
-    relaxation = slack_model.optimize()
+    relax_table = pd.concat(tables).groupby(level=0, sort=False).agg(
+        OrderedDict([('lb_in', 'first'),
+                     ('ub_in', 'first'),
+                     ('lb_change', 'sum'),
+                     ('ub_change', 'sum'),
+                     ('lb_out', 'last'),
+                     ('ub_out', 'last')]))
 
-    # Extract the relaxation values from the solution, by type
-    my_neg_slacks = slack_model.get_variables_of_type(NegSlackLC)
-    my_pos_slacks = slack_model.get_variables_of_type(PosSlackLC)
+    if not apply:
+        for name, row in relax_table.iterrows():
+            tmodel.variables.get(name).set_bounds(row['lb_in'], row['ub_in'])
 
-    neg_slack_values = get_solution_value_for_variables(relaxation,
-                                                        my_neg_slacks)
-    pos_slack_values = get_solution_value_for_variables(relaxation,
-                                                        my_pos_slacks)
-    epsilon = relaxed_model.solver.configuration.tolerances.feasibility
+    return relax_table
 
-    for this_met in relaxed_model.metabolites:
-        # No thermo, or relaxation forbidden
-        if this_met.id in metabolites_to_ignore or this_met.id not in my_lc:
-            continue
 
-        # Get the standard delta G variable
-        the_lc = my_lc.get_by_id(this_met.id)
+def enumerate_relaxations(tmodel, dgo=True, lc=False, weights=None,
+                          reactions_to_ignore=(), metabolites_to_ignore=(),
+                          max_relaxations=10, time_limit=None, processes=1):
+    """
+    Enumerates alternative minimal relaxations, to see which DeltaGstd and/or
+    log concentration bounds are really in conflict.
+
+    The relaxation uses the 'count' objective of :func:`relax_model`. Once a
+    set of relaxed variables is found, an integer cut on their indicators
+    forbids it (and its supersets), and the model is solved again. The
+    relaxations are found by increasing (weighted) number of relaxed
+    variables.
+
+    With several processes, the search is partitioned with the first
+    relaxation {v_1, ..., v_k}: the i-th partition does not relax v_i and
+    relaxes v_1, ..., v_i-1. The partitions are enumerated by the workers in
+    parallel, and the relaxations are yielded as they are found, so they are
+    only sorted within a partition. As v_1, ..., v_i-1 are forced in the
+    i-th partition, each relaxation found there is first reduced to a
+    minimal one (see :func:`_minimize_relaxation`), which can belong to
+    another partition: the relaxations already yielded are skipped.
+
+    :param tmodel: pytfa.thermo.ThermoModel
+    :param dgo: see :func:`relax_model`
+    :param lc: see :func:`relax_model`
+    :param weights: see :func:`relax_model`
+    :param reactions_to_ignore: see :func:`relax_model`
+    :param metabolites_to_ignore: see :func:`relax_model`
+    :param max_relaxations: maximal number of relaxations
+    :param time_limit: optional time limit of the enumeration, in seconds
+    :param processes: number of worker processes
+    :return: generator of relaxation tables, indexed by variable name. The
+        bounds of tmodel are not changed.
+    """
+    if weights is None:
+        weights = dict()
+
+    candidates = _relaxation_candidates(tmodel, dgo, lc, reactions_to_ignore,
+                                        metabolites_to_ignore)
+    deadline = None if time_limit is None else time() + time_limit
+    timeout = tmodel.solver.configuration.timeout
+    epsilon = tmodel.solver.configuration.tolerances.feasibility
+
+    # The slacks, the cuts and the objective are removed on exit
+    with tmodel:
+        slacks, indicators = _add_relaxation(tmodel, candidates, 'count',
+                                             weights)
+        data = (tmodel, candidates, slacks, indicators, epsilon, deadline)
+
+        try:
+            if processes == 1:
+                for relax_table in _enumerate_partition(data, 0, [], [],
+                                                        max_relaxations):
+                    yield relax_table
+                return
+
+            first = list(_enumerate_partition(data, 0, [], [], 1))
+            if not first:
+                return
+            yield first[0]
+
+            # Partitions of the other relaxations
+            relaxed = list(first[0].index)
+            found = {frozenset(relaxed)}
+            tasks = [(i + 1, relaxed[:i], [name])
+                     for i, name in enumerate(relaxed)]
+
+            queue = Queue()
+            pool = Pool(min(processes, len(tasks)),
+                        initializer=_init_enumeration_worker,
+                        initargs=(data, queue, max_relaxations - 1))
+            try:
+                pool.map_async(_enumeration_element, tasks, chunksize=1)
+                n_found = 1
+                n_running = len(tasks)
+                while n_running > 0 and n_found < max_relaxations:
+                    try:
+                        relax_table = queue.get(
+                            timeout=None if deadline is None
+                            else max(deadline - time(), 0))
+                    except Empty:
+                        break
+                    if relax_table is None:
+                        n_running -= 1
+                        continue
+                    if frozenset(relax_table.index) in found:
+                        continue
+                    found.add(frozenset(relax_table.index))
+                    n_found += 1
+                    yield relax_table
+            finally:
+                pool.terminate()
+                pool.join()
+        finally:
+            tmodel.solver.configuration.timeout = timeout
+
+
+def _enumerate_partition(data, partition, fixed_on, fixed_off, limit):
+    """
+    Enumerates the relaxations in a partition of the search, with integer
+    cuts. If some variables are forced to be relaxed, each relaxation is
+    reduced to a minimal one before it is returned and cut.
+
+    :param data: (model, candidates, slacks, indicators, epsilon, deadline),
+        see :func:`enumerate_relaxations`
+    :param partition: id of the partition, used to name the cuts
+    :param fixed_on: names of the variables that are relaxed
+    :param fixed_off: names of the variables that are not relaxed
+    :param limit: maximal number of relaxations
+    :return: generator of relaxation tables
+    """
+    model, candidates, slacks, indicators, epsilon, deadline = data
+    fixed = fixed_on + fixed_off
+    bounds = {name: (indicators[name].lb, indicators[name].ub)
+              for name in fixed}
 
-        # Get the relaxation
-        lc_delta_lb = neg_slack_values[
-            my_neg_slacks \
-            .get_by_id(this_met.id).name]
-        lc_delta_ub = \
-            pos_slack_values[my_pos_slacks \
-            .get_by_id(this_met.id).name]
+    try:
+        for name in fixed_on:
+            indicators[name].set_bounds(1, 1)
+        for name in fixed_off:
+            indicators[name].set_bounds(0, 0)
+
+        # The cuts are removed on exit
+        with model:
+            for n_found in range(limit):
+                if deadline is not None:
+                    remaining = deadline - time()
+                    if remaining <= 0:
+                        break
+                    model.solver.configuration.timeout = int(ceil(remaining))
+
+                model.slim_optimize()
+                if model.solver.status != OPTIMAL:
+                    break
+
+                relaxed = [name for name, indicator in indicators.items()
+                           if indicator.primal > 0.5]
+                slack_values = OrderedDict(
+                    (name, (slacks[name][0].primal, slacks[name][1].primal))
+                    for name in relaxed)
+                if fixed_on:
+                    slack_values = _minimize_relaxation(model, slacks,
+                                                        indicators,
+                                                        slack_values)
+                    relaxed = list(slack_values)
+
+                relax_table = _relaxation_table(candidates, slack_values,
+                                                epsilon, apply=False,
+                                                report_all=True)
+                if relax_table is None:
+                    # The model is feasible without relaxation
+                    break
+                yield relax_table
+
+                cut = model.problem.Constraint(
+                    Zero, ub=len(relaxed) - 1,
+                    name='RelaxCut_{}_{}'.format(partition, n_found))
+                model.add_cons_vars([cut])
+                model.solver.update()
+                cut.set_linear_coefficients({indicators[name]: 1
+                                             for name in relaxed})
+    finally:
+        for name, (lb, ub) in bounds.items():
+            indicators[name].set_bounds(lb, ub)
+
+
+def _minimize_relaxation(model, slacks, indicators, slack_values):
+    """
+    Deletion filter over a relaxation: each relaxed variable is dropped in
+    turn, and stays dropped if the model can still be relaxed with the
+    remaining ones. The indicators of the other variables are off during the
+    solves, and their bounds are restored afterwards.
+
+    A solve that is not optimal (e.g. stopped by the time limit) keeps the
+    variable, so the relaxation may not be minimal if the time runs out.
+
+    :param slacks: see :func:`_add_relaxation`
+    :param indicators: see :func:`_add_relaxation`
+    :param slack_values: OrderedDict {variable name: (negative slack value,
+        positive slack value)} of a relaxation
+    :return: OrderedDict {variable name: (negative slack value, positive
+        slack value)} of a minimal relaxation
+    """
+    bounds = {name: (x.lb, x.ub) for name, x in indicators.items()}
 
-        # Apply reaction delta G standard bound change
-        if lc_delta_lb > 0 or lc_delta_ub > 0:
+    try:
+        for name, indicator in indicators.items():
+            if name not in slack_values:
+                indicator.set_bounds(0, 0)
+            else:
+                indicator.set_bounds(0, 1)
+
+        for name in list(slack_values):
+            if name not in slack_values:
+                continue
+            indicators[name].set_bounds(0, 0)
+            model.slim_optimize()
+            if model.solver.status != OPTIMAL:
+                indicators[name].set_bounds(0, 1)
+                continue
 
-            # Store previous values
-            previous_lc_lb = the_lc.variable.lb
-            previous_lc_ub = the_lc.variable.ub
+            # The relaxation of the solution is a subset of the remaining
+            # variables
+            remaining = [other for other in slack_values
+                         if indicators[other].primal > 0.5]
+            for other in slack_values:
+                if other not in remaining:
+                    indicators[other].set_bounds(0, 0)
+            slack_values = OrderedDict(
+                (other, (slacks[other][0].primal, slacks[other][1].primal))
+                for other in remaining)
+    finally:
+        for name, (lb, ub) in bounds.items():
+            indicators[name].set_bounds(lb, ub)
+
+    return slack_values
+
+
+# Has to be declared outside of the function to be used for multiprocessing
+def _init_enumeration_worker(data, queue, limit):
+    """
+    Initializes a process of the enumeration pool. With fork, the model with
+    the relaxation is inherited from the parent process.
 
-            # Apply change
-            the_lc.variable.lb -= (lc_delta_lb + epsilon)
-            the_lc.variable.ub += (lc_delta_ub + epsilon)
+    :param data: see :func:`_enumerate_partition`
+    :param queue: multiprocessing.Queue receiving the relaxation tables, and
+        None when a partition is done
+    :param limit: maximal number of relaxations of a partition
+    """
+    global _enumeration_data
+    _enumeration_data = (data, queue, limit)
+
+
+def _enumeration_element(task):
+    """
+    Enumerates the relaxations of a partition.
+
+    :param task: (id of the partition, names of the variables that are
+        relaxed, names of the variables that are not relaxed)
+    """
+    data, queue, limit = _enumeration_data
+    try:
+        for relax_table in _enumerate_partition(data, *task, limit=limit):
+            queue.put(relax_table)
+    finally:
+        queue.put(None)
 
-            # If needed, store that in a report table
-            changes[this_met.id] = [
-                previous_lc_lb,
-                previous_lc_ub,
-                lc_delta_lb,
-                lc_delta_ub,
-                the_lc.variable.lb,
-                the_lc.variable.ub]
+
+def relax_tiered(tmodel, dgo=True, lc=False, weights=None,
+                 reactions_to_ignore=(), metabolites_to_ignore=(),
+                 tiers=('lp', 'profile', 'milp'), apply=False):
+    """
+    Tiered relaxation: tries cheap diagnoses of the infeasibility before the
+    slack MILP of :func:`relax_model`.
+
+    * 'lp': if the LP relaxation of the model (see
+      :func:`~pytfa.optim.utils.continuous_use_variables`) is infeasible, it
+      is relaxed with slacks. The relaxation answers if the model is then
+      feasible for a candidate directionality profile (see
+      :func:`~pytfa.optim.heuristics.get_candidate_profile`).
+    * 'profile': the LP of a candidate directionality profile, built from
+      the LP relaxation without the directions that the DeltaG bounds
+      forbid, is relaxed with slacks. Any point of this LP is
+      feasible for the MILP, so the relaxation always answers if found.
+    * 'milp': the slack MILP of :func:`relax_model`.
+
+    The LP tiers give a relaxation that makes the model feasible, but that
+    is not necessarily minimal for the MILP.
+
+    :param tmodel: pytfa.thermo.ThermoModel
+    :param dgo: see :func:`relax_model`
+    :param lc: see :func:`relax_model`
+    :param weights: see :func:`relax_model`
+    :param reactions_to_ignore: see :func:`relax_model`
+    :param metabolites_to_ignore: see :func:`relax_model`
+    :param tiers: the tiers to try, in order
+    :param apply: if True, the bounds of the relaxed variables are widened
+    :return: (relax_table, tier, times): the relaxation table (or None), the
+        tier that answered (or None), and a pandas.Series of the time spent
+        in each tier tried, in seconds
+    """
+    kwargs = dict(dgo=dgo, lc=lc, weights=weights,
+                  reactions_to_ignore=reactions_to_ignore,
+                  metabolites_to_ignore=metabolites_to_ignore)
+    times = OrderedDict()
+    relax_table = None
+    answer = None
+    profile = None
+
+    for tier in tiers:
+        t0 = time()
+
+        if tier == 'lp':
+            lp_table = None
+            with continuous_use_variables(tmodel):
+                if _is_infeasible(tmodel):
+                    lp_table = relax_model(tmodel, **kwargs)
+            if lp_table is not None:
+                with _relaxed_bounds(tmodel, lp_table):
+                    profile, _ = get_candidate_profile(tmodel)
+                    if profile is not None \
+                            and find_feasible_point(tmodel, profile) \
+                            is not None:
+                        relax_table = lp_table
+                        answer = tier
+
+        elif tier == 'profile':
+            if profile is None:
+                profile, _ = get_candidate_profile(tmodel,
+                                                   use_deltag_bounds=False)
+            if profile is not None:
+                with continuous_use_variables(tmodel, profile):
+                    if _is_infeasible(tmodel):
+                        relax_table = relax_model(tmodel, **kwargs)
+                        if relax_table is not None:
+                            answer = tier
+                    else:
+                        tmodel.logger.info('The model is feasible, with the '
+                                           'candidate directionality profile')
+                        times[tier] = time() - t0
+                        break
+
+        elif tier == 'milp':
+            relax_table = relax_model(tmodel, **kwargs)
+            if relax_table is not None:
+                answer = tier
+
+        else:
+            raise ValueError("Unknown tier: {}".format(tier))
+
+        times[tier] = time() - t0
+        tmodel.logger.info('Relaxation tier {}: {:.2f} s, {}'.format(
+            tier, times[tier], 'answered' if answer else 'not answered'))
+        if answer is not None:
+            break
+
+    if apply and relax_table is not None:
+        for name, row in relax_table.iterrows():
+            tmodel.variables.get(name).set_bounds(row['lb_out'],
+                                                  row['ub_out'])
+
+    return relax_table, answer, pd.Series(times)
+
+
+@contextmanager
+def _relaxed_bounds(tmodel, relax_table):
+    """
+    Context manager that applies the bounds of a relaxation table, and
+    restores the original ones on exit.
+    """
+    variables = [tmodel.variables.get(name) for name in relax_table.index]
+    saved = [(x, x.lb, x.ub) for x in variables]
+    try:
+        for x in variables:
+            row = relax_table.loc[x.name]
+            x.set_bounds(row['lb_out'], row['ub_out'])
+        yield tmodel
+    finally:
+        for x, lb, ub in saved:
+            x.set_bounds(lb, ub)
+
+
+def relax_lc(tmodel, metabolites_to_ignore = (), solver = None,
+             in_place = False):
+    """
+    Relaxes the bounds of the log concentrations with :func:`relax_model`:
+    the slacks of each log concentration enter the NegativeDeltaG rows with
+    the coefficient of the log concentration (RT times its stoichiometry),
+    by coefficient updates, and are removed once solved.
+
+    :param metabolites_to_ignore: Iterable of metabolites whose log
+        concentration should not be relaxed
+    :param tmodel:
+    :type tmodel: pytfa.thermo.ThermoModel:
+    :param solver: solver to use (e.g. 'optlang-glpk', 'optlang-cplex',
+        'optlang-gurobi'
+    :param in_place: if True, tmodel is relaxed and returned as the relaxed
+        model, without any copy. Otherwise a copy of tmodel is relaxed.
+    :return: (relaxed_model, slack_model, relax_table), relax_table being
+        indexed by metabolite id. slack_model is deprecated and always None:
+        no slack model is built anymore.
+    """
+
+    warn('The slack model returned by relax_lc is deprecated and always '
+         'None', DeprecationWarning, stacklevel=2)
+
+    if in_place:
+        relaxed_model = tmodel
+    else:
+        # Create a copy that will receive the relaxation
+        relaxed_model = tmodel.copy()
+    if solver is not None:
+        relaxed_model.solver = solver
+
+    relax_table = relax_model(relaxed_model, dgo=False, lc=True,
+                              metabolites_to_ignore=metabolites_to_ignore,
+                              apply=True)
+
+    if relax_table is None:
+        return relaxed_model, None, None
+
+    relax_table.index = [x[len(LogConcentration.prefix):]
+                         for x in relax_table.index]
 
     # Obtain relaxation
     relaxed_model.optimize()
 
-    # Format relaxation
-    relax_table = pd.DataFrame.from_dict(changes,
-                                         orient = 'index')
-    relax_table.columns = [ 'lb_in',
-                            'ub_in',
-                            'lb_change',
-                            'ub_change',
-                            'lb_out',
-                            'ub_out']
-
     tmodel.logger.info('\n' + relax_table.__str__())
 
     relaxed_model.relaxation = relax_table
 
-    return relaxed_model, slack_model, relax_table
+    return relaxed_model, None, relax_table
@@ -9,8 +9,10 @@
 Relaxation of models with constraint too tight
 
 """
+from contextlib import contextmanager
 from copy import deepcopy
 
+import numpy as np
 import optlang
 import pandas as pd
 import sympy
@@ -18,7 +20,7 @@ from cobra.core.solution import Solution
 
 from .constraints import GenericConstraint
 from .variables import ForwardUseVariable, BackwardUseVariable
-from .variables import GenericVariable
+from .variables import GenericVariable, DeltaG, DeltaGstd, LogConcentration
 
 SYMPY_ADD_CHUNKSIZE = 100
 INTEGER_VARIABLE_TYPES = ('binary','integer')
@@ -198,9 +200,81 @@ def get_direction_use_variables(tmodel,solution):
             else bwd_use_variables.get_by_id(x.id)
             for x in tmodel.reactions ]
 
+def get_directionality_profile(tmodel, solution, flux_tol = 1e-9):
+    """
+    Returns the directionality profile of a solution, as the values of the use
+    variables of the cobra_model, rounded to integers. Use variables that were
+    eliminated from the cobra_model (see
+    :func:`~.pytfa.ThermoModel.eliminate_use_variables`) are not included,
+    their value is already fixed.
+
+    With big-M couplings, the solver can return a use variable within its
+    integrality tolerance of 0 while the matching flux is not zero. Such use
+    variables are set to 1, so that the profile is consistent with the fluxes
+    of the solution.
+
+    :type tmodel: pytfa.core.ThermoModel
+    :param tmodel:
+    :param solution:
+    :param flux_tol: fluxes above this value activate their use variable
+    :return: dict {use variable name: 0 or 1}
+    """
+    profile = dict()
+
+    for use_variables, flux_attr in \
+            ((tmodel.get_variables_of_type(ForwardUseVariable), 'forward_variable'),
+             (tmodel.get_variables_of_type(BackwardUseVariable), 'reverse_variable')):
+        for x in use_variables:
+            flux = solution.raw[getattr(x.reaction, flux_attr).name]
+            profile[x.name] = int(round(solution.raw[x.name]) or flux > flux_tol)
+
+    return profile
+
+@contextmanager
+def continuous_use_variables(tmodel, profile = None):
+    """
+    Context manager that makes the use variables of the cobra_model continuous,
+    so that the problem becomes its LP relaxation. If a directionality profile
+    is given, its use variables are fixed at their values, and the problem is
+    the LP of this profile. The types and bounds of the use variables are
+    restored on exit, so this does not need a copy of the cobra_model.
+
+    Example:
+    ```python
+    with continuous_use_variables(tmodel, profile):
+        tmodel.slim_optimize()
+    ```
+
+    :param tmodel:
+    :param profile: dict {use variable name: 0 or 1}, as returned by
+        :func:`get_directionality_profile`
+    :return:
+    """
+    use_variables = [x.variable for x in
+                     tuple(tmodel.get_variables_of_type(ForwardUseVariable))
+                     + tuple(tmodel.get_variables_of_type(BackwardUseVariable))]
+    saved = [(x, x.type, x.lb, x.ub) for x in use_variables]
+
+    try:
+        for x in use_variables:
+            x.type = 'continuous'
+        if profile is not None:
+            for x in use_variables:
+                value = profile[x.name]
+                x.set_bounds(value, value)
+        yield tmodel
+    finally:
+        for x, type_, lb, ub in saved:
+            x.type = type_
+            x.set_bounds(lb, ub)
+
 def get_primal(tmodel, vartype, index_by_reactions = False):
     """
-    Returns the primal value of the cobra_model for variables of a given type
+    Returns the primal value of the cobra_model for variables of a given type.
+    Variables that are not in the solver problem anymore (fixed by
+    :func:`~.pytfa.ThermoModel.presolve`, or folded by the compact
+    formulation) are included, with the value they take in the solution.
+
     :param tmodel:
     :param vartype: Class of variable. Ex: pytfa.optim.variables.ThermoDisplacement
     :param index_by_reactions: Set to true to get reaction names as index instead of
@@ -210,51 +284,269 @@ def get_primal(tmodel, vartype, index_by_reactions = False):
 
     the_vars = tmodel.get_variables_of_type(vartype)
 
+    values = {x.name:x.variable.primal for x in the_vars}
+    ids = {x.name:x.id for x in the_vars}
+
+    if vartype.prefix:
+        eliminated = tmodel.get_eliminated_values(tmodel.solver.primal_values)
+        for name, value in eliminated.items():
+            if name.startswith(vartype.prefix) and name not in values:
+                values[name] = value
+                ids[name] = name[len(vartype.prefix):]
+
     if index_by_reactions:
-        return pd.Series({x.id:x.variable.primal
-                          for x in the_vars})
+        return pd.Series({ids[k]:v for k,v in values.items()})
     else:
-        return pd.Series({x.name:x.variable.primal
-                          for x in the_vars})
+        return pd.Series(values)
 
 
-def strip_from_integer_variables(tmodel):
+def compute_scaling_factors(tmodel, kinds = (DeltaG, DeltaGstd,
+                                             LogConcentration), n_iter = 20):
     """
-    Removes all integer and binary variables of a cobra_model, to make it sample-able
-    :param tmodel:
+    Computes scaling factors of the variables of some kinds, with geometric
+    mean scaling of the constraint matrix: the rows and the columns of these
+    variables are alternately divided by the geometric mean of their
+    absolute coefficients. The row factors are only used for the
+    computation; the columns of the other variables are not scaled.
+
+    The factors are powers of 2, which do not introduce rounding errors,
+    and include the current scaling factors of the variables.
+
+    Flux variables are not scaled: they are not pytfa variables, and cobra
+    reads their values directly from the solver.
+
+    :param tmodel: pytfa.thermo.ThermoModel
+    :param kinds: classes of the variables to scale
+    :param n_iter: number of passes over the rows and columns
+    :return: pandas.Series of the scaling factors, indexed by variable name
+    """
+    from ..io.base import create_generalized_matrix
+
+    matrix = create_generalized_matrix(tmodel, array_type='csr').tocoo()
+    nonzero = matrix.data != 0
+    rows = matrix.row[nonzero]
+    columns = matrix.col[nonzero]
+    log_coeffs = np.log2(np.abs(matrix.data[nonzero]))
+
+    variables = [x for kind in kinds for x in tmodel.get_variables_of_type(kind)]
+    index = {x.name: e for e, x in enumerate(tmodel.variables)}
+    scaled = np.zeros(len(tmodel.variables), dtype=bool)
+    scaled[[index[x.name] for x in variables]] = True
+
+    n_rows = np.bincount(rows, minlength=matrix.shape[0])
+    n_columns = np.bincount(columns, minlength=matrix.shape[1])
+
+    # log2 of the factors of the columns
+    column_factors = np.zeros(matrix.shape[1])
+    for _ in range(n_iter):
+        row_factors = -np.bincount(rows,
+                                   weights=log_coeffs + column_factors[columns],
+                                   minlength=matrix.shape[0]) \
+                      / np.maximum(n_rows, 1)
+        column_factors = -np.bincount(columns,
+                                      weights=log_coeffs + row_factors[rows],
+                                      minlength=matrix.shape[1]) \
+                         / np.maximum(n_columns, 1)
+        column_factors[~scaled] = 0
+
+    return pd.Series({x.name: x.scaling_factor
+                             * 2. ** np.round(column_factors[index[x.name]])
+                      for x in variables})
+
+def apply_scaling_factors(tmodel, factors):
+    """
+    Sets the scaling factors of variables. If the scaling factor of quantity
+    X is a, it is represented by the variable X_hat = X/a (see
+    :attr:`~pytfa.optim.variables.GenericVariable.unscaled`): the
+    coefficients of the variable are multiplied, and its bounds divided, by
+    the change of its factor. The values of the solutions in
+    `solution.values` are unscaled, while the solver values are scaled.
+    The coefficients of the variables in the folded variables of a compact
+    model (see :meth:`~pytfa.core.model.LCSBModel.get_eliminated_values`)
+    are multiplied too, so that the folded values stay unscaled.
+
+    Flux variables cannot be scaled: they are not pytfa variables, and cobra
+    reads their values directly from the solver.
+
+    Constraints added afterwards must use the unscaled variables.
+
+    :param tmodel: pytfa.thermo.ThermoModel
+    :param factors: dict-like {variable name: scaling factor}, as returned by
+        :func:`compute_scaling_factors`
     :return:
     """
-    continuous_model = tmodel.copy()
-    continuous_model.name = tmodel.name + ' - continuous'
-
-    integer_variables = set()
-
-    constraints_with_integer_variables = []
-
-    # We go through all the constraint descriptors and check if at least one of
-    # their variables is in the integer variable list
-    for this_cons in continuous_model._cons_dict.values():
-        has_integer_variable = False
-        for this_var in this_cons.constraint.variables:
-            if this_var.type in INTEGER_VARIABLE_TYPES:
-                has_integer_variable += True
-                this_var_descriptor = continuous_model._var_dict[this_var.name]
-                integer_variables.add(this_var_descriptor)
-        constraints_with_integer_variables.append(this_cons)
-
-    for this_cons in constraints_with_integer_variables:
-        continuous_model.remove_constraint(this_cons)
-
+    from ..io.base import create_generalized_matrix
+
+    changes = {name: factor / tmodel._var_dict[name].scaling_factor
+               for name, factor in factors.items()
+               if factor != tmodel._var_dict[name].scaling_factor}
+    if not changes:
+        return
+
+    matrix = create_generalized_matrix(tmodel, array_type='csc')
+    index = {x.name: e for e, x in enumerate(tmodel.variables)}
+    constraints = list(tmodel.constraints)
+
+    # One coefficient update per row
+    row_coeffs = dict()
+    for name, change in changes.items():
+        the_var = tmodel._var_dict[name].variable
+        column = index[name]
+        start, stop = matrix.indptr[column], matrix.indptr[column + 1]
+        for row, coeff in zip(matrix.indices[start:stop],
+                              matrix.data[start:stop]):
+            row_coeffs.setdefault(row, dict())[the_var] = coeff * change
+    for row, coeffs in row_coeffs.items():
+        constraints[row].set_linear_coefficients(coeffs)
+
+    the_vars = [tmodel._var_dict[name].variable for name in changes]
+    objective_coeffs = tmodel.objective.get_linear_coefficients(the_vars)
+    tmodel.objective.set_linear_coefficients(
+        {x: coeff * changes[x.name] for x, coeff in objective_coeffs.items()
+         if coeff != 0})
+
+    # The folded variables are computed from the solver values
+    for name, (offset, coeffs) in tmodel._folded_vars.items():
+        if any(x in changes for x in coeffs):
+            tmodel._folded_vars[name] = (
+                offset, {x: coeff * changes.get(x, 1)
+                         for x, coeff in coeffs.items()})
+
+    for name, change in changes.items():
+        var = tmodel._var_dict[name]
+        lb, ub = var.variable.lb, var.variable.ub
+        var.variable.set_bounds(None if lb is None else lb / change,
+                                None if ub is None else ub / change)
+        var._scaling_factor = factors[name]
+
+    tmodel.logger.info('Scaled {} variables'.format(len(changes)))
+
+def get_continuous_model(tmodel, method = 'relax', values = None,
+                         inplace = False):
+    """
+    Returns a continuous version of a cobra_model, e.g. to sample it:
+
+    * 'relax': the integer variables become continuous within their bounds
+      (binaries in [0,1]). This is the LP relaxation of the cobra_model.
+    * 'fix': the integer variables are fixed at the given values and removed.
+      Their contribution is moved to the bounds of the constraints, and the
+      constraints left without variables are removed. The fixed values are
+      kept in self._fixed_vars, like with
+      :func:`~.pytfa.ThermoModel.eliminate_use_variables`.
+    * 'remove': the integer variables are removed, together with all the
+      constraints that contain them.
+
+    The constraints that contain integer variables are found from the
+    integer columns of the sparse constraint matrix, and everything is
+    removed from the solver in one go.
+
+    :param tmodel: pytfa.core.model.LCSBModel
+    :param method: 'relax', 'fix' or 'remove'
+    :param values: for 'fix', dict-like {variable name: value} of the integer
+        variables. Defaults to the values in tmodel.solution, with the use
+        variables from :func:`get_directionality_profile`
+    :param inplace: if False, the cobra_model is copied first
+    :return: the continuous cobra_model
+    """
+    from ..io.base import create_generalized_matrix
+
+    if method not in ('relax', 'fix', 'remove'):
+        raise ValueError('Unknown method: {}'.format(method))
+
+    if method == 'fix' and values is None:
+        try:
+            solution = tmodel.solution
+        except AttributeError:
+            raise ValueError('The values of the integer variables are needed, '
+                             'either given or from a solution of the model')
+        values = dict(solution.raw)
+        values.update(get_directionality_profile(tmodel, solution))
+
+    if inplace:
+        continuous_model = tmodel
+    else:
+        continuous_model = tmodel.copy()
+        continuous_model.name = tmodel.name + ' - continuous'
+
+    is_integer = np.array([x.type in INTEGER_VARIABLE_TYPES
+                           for x in continuous_model.variables], dtype=bool)
+    integer_variables = [x for x, i in zip(continuous_model.variables,
+                                           is_integer) if i]
+
+    if method == 'relax':
+        for this_var in integer_variables:
+            this_var.type = 'continuous'
+        continuous_model.logger.info('Relaxed {} integer variables'
+                                     .format(len(integer_variables)))
+        return continuous_model
+
+    matrix = create_generalized_matrix(continuous_model, array_type='csc')
+    matrix.eliminate_zeros()
+    integer_columns = matrix[:, is_integer]
+    has_integer = integer_columns.getnnz(axis=1) > 0
+
+    constraints = continuous_model.constraints
+
+    if method == 'remove':
+        to_remove = [constraints[i] for i in np.flatnonzero(has_integer)]
+    else:
+        fixed = {x.name: int(round(values[x.name])) for x in integer_variables}
+        shift = integer_columns.dot(np.array([fixed[x.name]
+                                              for x in integer_variables]))
+        has_continuous = matrix[:, ~is_integer].getnnz(axis=1) > 0
+        empty = has_integer & ~has_continuous
+
+        # Constraints without continuous variables must hold for the values
+        epsilon = continuous_model.solver.configuration.tolerances.feasibility
+        violated = [constraints[i].name for i in np.flatnonzero(empty)
+                    if (constraints[i].lb is not None
+                        and shift[i] < constraints[i].lb - epsilon)
+                    or (constraints[i].ub is not None
+                        and shift[i] > constraints[i].ub + epsilon)]
+        if violated:
+            raise ValueError('The values of the integer variables violate '
+                             'the constraints {}'.format(violated))
+
+        for i in np.flatnonzero(has_integer & has_continuous & (shift != 0)):
+            this_cons = constraints[i]
+            lb = None if this_cons.lb is None else this_cons.lb - shift[i]
+            ub = None if this_cons.ub is None else this_cons.ub - shift[i]
+            # Keeps lb <= ub while moving the bounds
+            if shift[i] > 0:
+                this_cons.lb = lb
+                this_cons.ub = ub
+            else:
+                this_cons.ub = ub
+                this_cons.lb = lb
+
+        to_remove = [constraints[i] for i in np.flatnonzero(empty)]
+        continuous_model._fixed_vars.update(fixed)
+
+    # Remove everything in one go, it is much faster for the solver
+    for this_cons in to_remove:
+        continuous_model._cons_dict.pop(this_cons.name, None)
     for this_var in integer_variables:
-        continuous_model.remove_variable(this_var)
+        continuous_model._var_dict.pop(this_var.name, None)
 
-    continuous_model.solver.update()
-    # This will update the values =
-    print('Is the cobra_model still integer ? {}'     \
-          .format(continuous_model.solver.is_integer))
+    continuous_model.remove_cons_vars(to_remove + integer_variables)
+    continuous_model.repair()
 
+    continuous_model.logger.info('Removed {} integer variables and {} '
+                                 'constraints'.format(len(integer_variables),
+                                                      len(to_remove)))
     return continuous_model
 
+def strip_from_integer_variables(tmodel):
+    """
+    Removes all integer and binary variables of a cobra_model, and the
+    constraints that contain them, to make it sample-able.
+    See :func:`get_continuous_model` to relax or fix them instead.
+
+    :param tmodel:
+    :return:
+    """
+    return get_continuous_model(tmodel, method='remove')
+
 def copy_solver_configuration(source, target):
     """
     Copies the solver configuration from a source model to a target model
@@ -12,11 +12,14 @@ Thermodynamic cobra_model class and methods definition
 """
 
 import re
+import time
 from copy import deepcopy
+from functools import partial
 from math import log
 
 import pandas as pd
 from cobra import Model
+from cobra.util.context import get_context
 
 from ..core.model import LCSBModel
 from . import std
@@ -76,6 +79,9 @@ class ThermoModel(LCSBModel, Model):
         self._var_dict = dict()
         self._cons_dict = dict()
 
+        # Conversion options and reactions left to convert, see convert(lazy=True)
+        self._lazy_conversion = None
+
         self._init_thermo()
 
         self.logger.info('# Model initialized with units {} and temperature {} K'  \
@@ -287,12 +293,14 @@ class ThermoModel(LCSBModel, Model):
         self.logger.info('# Model preparation done.')
 
 
-    def _convert_metabolite(self, met, add_potentials, verbose):
+    def _convert_metabolite(self, met, add_potentials, verbose, compact=False):
         """
         Given a enzyme, proceeds to create the necessary variables and
         constraints for thermodynamics-based modeling
 
         :param met:
+        :param compact: if True, fixed log concentrations and potentials are
+            not created as variables (see :func:`~.pytfa.ThermoModel.convert`)
         :return:
         """
 
@@ -311,14 +319,21 @@ class ThermoModel(LCSBModel, Model):
         LC = None
 
         if metformula == 'H2O':
-            LC = self.add_variable(LogConcentration, met, lb=0, ub=0)
+            if compact:
+                self._fixed_vars[LogConcentration.prefix + met.id] = 0
+            else:
+                LC = self.add_variable(LogConcentration, met, lb=0, ub=0)
 
         elif metformula == 'H':
-            LC = self.add_variable(
-                              LogConcentration,
-                              met,
-                              lb=log(10 ** -Comp_pH),
-                              ub=log(10 ** -Comp_pH))
+            if compact:
+                self._fixed_vars[LogConcentration.prefix + met.id] = \
+                    log(10 ** -Comp_pH)
+            else:
+                LC = self.add_variable(
+                                  LogConcentration,
+                                  met,
+                                  lb=log(10 ** -Comp_pH),
+                                  ub=log(10 ** -Comp_pH))
 
         elif ('seed_id' in met.annotation
               and met.annotation['seed_id'] == 'cpd11416'):
@@ -333,7 +348,11 @@ class ThermoModel(LCSBModel, Model):
                                     lb=metLConc_lb,
                                     ub=metLConc_ub)
 
-            if add_potentials:
+            if add_potentials and compact:
+                # P_met = DGF_met + RT*LC_met, no need for a variable
+                self._folded_vars['P_' + met.id] = (metDeltaGF,
+                                                    {LC.name: self.RT})
+            elif add_potentials:
                 P = self.add_variable( 'P_' + met.id, P_lb, P_ub)
                 self.P_vars[met] = P
                 # Formulate the constraint
@@ -352,16 +371,36 @@ class ThermoModel(LCSBModel, Model):
             # Register the variable to find it more easily
             self.LC_vars[met] = LC
 
+    def _has_thermo_constraints(self, rxn):
+        """
+        :param rxn:
+        :return: True if the conversion adds thermodynamic constraints to the
+            reaction, False if it only adds use variables
+        """
+        # Is it a water transport reaction ?
+        H2OtRxns = False
+        if rxn.thermo['isTrans'] and len(rxn.reactants) == 1:
+            if rxn.reactants[0].annotation['seed_id'] == 'cpd00001':
+                H2OtRxns = True
+
+        # if the reaction is flagged with rxnThermo, and it's not a H2O
+        # transport, we will add thermodynamic constraints
+        return rxn.thermo['computed'] and not H2OtRxns
+
     def _convert_reaction(self, rxn,
                           add_potentials,
                           add_displacement,
-                          verbose):
+                          verbose,
+                          compact=False):
         """
 
         :param rxn:
         :param add_potentials:
         :param add_displacement:
         :param verbose:
+        :param compact: if True, the DeltaGstd variable is not created, its
+            range is put on the bounds of the NegativeDeltaG constraint instead
+            (see :func:`~.pytfa.ThermoModel.convert`)
         :return:
         """
 
@@ -372,18 +411,10 @@ class ThermoModel(LCSBModel, Model):
 
         epsilon = self.solver.configuration.tolerances.feasibility
 
-        # Is it a water transport reaction ?
-        H2OtRxns = False
-        if rxn.thermo['isTrans'] and len(rxn.reactants) == 1:
-            if rxn.reactants[0].annotation['seed_id'] == 'cpd00001':
-                H2OtRxns = True
-
         # Is it a drain reaction ?
         NotDrain = len(rxn.metabolites) > 1
 
-        # if the reaction is flagged with rxnThermo, and it's not a H2O
-        # transport, we will add thermodynamic constraints
-        if rxn.thermo['computed'] and not H2OtRxns:
+        if self._has_thermo_constraints(rxn):
             if verbose:
                 self.logger.debug('generating thermo constraint for {}'.format(rxn.id))
 
@@ -392,10 +423,13 @@ class ThermoModel(LCSBModel, Model):
 
             # add the delta G naught as a variable
             RxnDGerror = rxn.thermo['deltaGRerr']
-            DGoR= self.add_variable(DeltaGstd,
-                                    rxn,
-                                    lb = rxn.thermo['deltaGR'] - RxnDGerror,
-                                    ub = rxn.thermo['deltaGR'] + RxnDGerror)
+            DGoR_lb = rxn.thermo['deltaGR'] - RxnDGerror
+            DGoR_ub = rxn.thermo['deltaGR'] + RxnDGerror
+            if not compact:
+                DGoR= self.add_variable(DeltaGstd,
+                                        rxn,
+                                        lb = DGoR_lb,
+                                        ub = DGoR_ub)
 
 
             # Initialization of indices and coefficients for all possible
@@ -419,7 +453,9 @@ class ThermoModel(LCSBModel, Model):
                 # Adding the terms for the transport part
                 for seed_id, trans in transportedMets.items():
                     for type_ in ['reactant', 'product']:
-                        if trans[type_].formula != 'H':
+                        # In compact mode, the fixed H2O LC is not a variable
+                        if trans[type_].formula != 'H' \
+                                and trans[type_] in self.LC_vars:
                             LC_TransMet += (self.LC_vars[trans[type_]]
                                             * RT
                                             * trans['coeff']
@@ -441,7 +477,8 @@ class ThermoModel(LCSBModel, Model):
 
             else:
                 # if it is just a regular chemical reaction
-                if add_potentials:
+                # In compact mode, the potentials are expressed with the LCs
+                if add_potentials and not compact:
                     RHS_DG = 0
 
                     for met in rxn.metabolites:
@@ -476,8 +513,19 @@ class ThermoModel(LCSBModel, Model):
             #   = 0
 
             # Formulate the constraint
-            CLHS = DGoR - DGR + LC_TransMet + LC_ChemMet
-            self.add_constraint( NegativeDeltaG, rxn, CLHS, lb=0, ub=0)
+            if compact:
+                # G: DGoR_lb <= DGR_rxn - RT * StoichCoefProd1 * LC_prod1
+                #   - ... <= DGoR_ub
+                # The value of DGoR is the value of this expression
+                CLHS = DGR - LC_TransMet - LC_ChemMet
+                self.add_constraint( NegativeDeltaG, rxn, CLHS,
+                                     lb=DGoR_lb, ub=DGoR_ub)
+                coeffs = {k.name:float(v)
+                          for k,v in CLHS.as_coefficients_dict().items()}
+                self._folded_vars[DeltaGstd.prefix + rxn.id] = (0, coeffs)
+            else:
+                CLHS = DGoR - DGR + LC_TransMet + LC_ChemMet
+                self.add_constraint( NegativeDeltaG, rxn, CLHS, lb=0, ub=0)
 
             if add_displacement:
                 lngamma = self.add_variable(ThermoDisplacement,
@@ -545,10 +593,37 @@ class ThermoModel(LCSBModel, Model):
     def convert(self,
                 add_potentials=False,
                 add_displacement=False,
-                verbose=True):
+                verbose=True,
+                presolve=False,
+                compact=False,
+                lazy=False):
         """ Converts a cobra_model into a tFBA ready cobra_model by adding the
         thermodynamic constraints required
 
+        :param bool compact: if True, uses a compact formulation with fewer
+            variables and constraints:
+
+            * the fixed LCs of H2O and protons are used as constants,
+            * the range of each DeltaGstd goes on the bounds of its
+              NegativeDeltaG constraint, which then reads
+              DGoR_lb <= DGR - RT*sum(stoich*LC) <= DGoR_ub,
+            * if add_potentials is True, the potentials are expressed with
+              the LCs directly, without variables nor constraints.
+
+            These variables are still reported in the solutions and by
+            :func:`~.pytfa.optim.utils.get_primal`, but they are not in the
+            variable accessors (e.g. self.delta_gstd, self.P_vars). Since
+            there is no DeltaGstd variable, the relaxations of the DeltaGstd
+            (e.g. :func:`~.pytfa.optim.relaxation.relax_dgo`) raise a
+            ValueError.
+        :param bool presolve: if True, calls
+            :func:`~.pytfa.ThermoModel.presolve` once the conversion is done,
+            to remove the use variables that the flux bounds already determine
+        :param bool lazy: if True, only the metabolites are converted. The
+            reactions get their thermodynamic constraints and use variables
+            when they carry flux, in :func:`~.pytfa.ThermoModel.lazy_optimize`.
+            Reactions without thermodynamic data get no use variables.
+
         .. warning::
             This function requires you to have already called
             :func:`~.pytfa.ThermoModel.prepare`, otherwise it will raise an Exception !
@@ -599,12 +674,28 @@ class ThermoModel(LCSBModel, Model):
         self.P_vars = {}
 
         for met in self.metabolites:
-            self._convert_metabolite(met, add_potentials, verbose)
+            self._convert_metabolite(met, add_potentials, verbose, compact)
+
+        if lazy:
+            # The reactions will be converted on demand by lazy_optimize().
+            # Use variables alone do not constrain the fluxes, so the
+            # reactions without thermodynamics are left as they are
+            self._lazy_conversion = {'add_potentials': add_potentials,
+                                     'add_displacement': add_displacement,
+                                     'compact': compact,
+                                     'pending': [x.id for x in self.reactions
+                                        if self._has_thermo_constraints(x)]}
+        else:
+            self._lazy_conversion = None
+            ## For each reaction...
+            for rxn in self.reactions:
+                self._convert_reaction(rxn, add_potentials,
+                                            add_displacement, verbose, compact)
 
-        ## For each reaction...
-        for rxn in self.reactions:
-            self._convert_reaction(rxn, add_potentials,
-                                        add_displacement, verbose)
+        if compact:
+            self.logger.info('# Compact formulation: {} variables folded'
+                             .format(len(self._fixed_vars)
+                                     + len(self._folded_vars)))
 
         # CONSISTENCY CHECKS
 
@@ -617,6 +708,260 @@ class ThermoModel(LCSBModel, Model):
         self.repair()
         self.logger.info('# cobra_model variables are up-to-date')
 
+        if presolve:
+            self.presolve()
+
+    def lazy_optimize(self, max_iter=None, **kwargs):
+        """
+        Solves a cobra_model converted with convert(lazy=True). The problem
+        starts as the flux model. At each iteration, the reactions that carry
+        flux without being converted yet get their thermodynamic constraints
+        and use variables, and the problem is solved again. Reactions in a
+        thermodynamically infeasible loop carry flux, so they get converted
+        too.
+
+        The iterations stop when no unconverted reaction carries flux. The
+        solution is then feasible for the fully converted cobra_model, since
+        reactions without flux fit any DeltaG, and the optimum is the same.
+        The converted reactions stay converted, so later calls start from
+        there.
+
+        :param int max_iter: maximum number of iterations, None for no limit
+        :param kwargs: passed to :func:`~.pytfa.core.LCSBModel.optimize`
+        :return: the solution of the last iteration
+        """
+
+        if self._lazy_conversion is None:
+            return self.optimize(**kwargs)
+
+        options = self._lazy_conversion
+        flux_tol = self.solver.configuration.tolerances.feasibility
+
+        if not hasattr(self, 'LC_vars'):
+            # Models rebuilt from a dict (e.g. copies) only have the DictList
+            self.LC_vars = {x.metabolite: x for x in self.log_concentration}
+
+        t0 = time.time()
+        n_iter = 0
+
+        while True:
+            solution = self.optimize(**kwargs)
+            n_iter += 1
+
+            pending = set(options['pending'])
+            active = [x for x in self.reactions if x.id in pending
+                      and (solution.raw[x.forward_variable.name] > flux_tol
+                           or solution.raw[x.reverse_variable.name] > flux_tol)]
+
+            if not active:
+                break
+
+            if max_iter is not None and n_iter >= max_iter:
+                self.logger.warning('Maximum number of iterations reached, '
+                                    '{} active reactions are not converted'
+                                    .format(len(active)))
+                break
+
+            for rxn in active:
+                self._convert_reaction(rxn,
+                                       options['add_potentials'],
+                                       options['add_displacement'],
+                                       verbose=False,
+                                       compact=options['compact'])
+            converted = set(x.id for x in active)
+            options['pending'] = [x for x in options['pending']
+                                  if x not in converted]
+            self.repair()
+
+            self.logger.info('# Lazy conversion, iteration {}: {} reactions '
+                             'converted, {} left'
+                             .format(n_iter, len(active),
+                                     len(options['pending'])))
+
+        self.logger.info('# Lazy conversion done in {} iterations ({:.2f} s), '
+                         '{} reactions left unconverted'
+                         .format(n_iter, time.time() - t0,
+                                 len(options['pending'])))
+
+        return solution
+
+    def presolve(self):
+        """
+        Finds the use variables whose value is already determined by the flux
+        bounds of their reaction, and eliminates them from the problem along
+        with their coupling constraints (see
+        :func:`~.pytfa.ThermoModel.eliminate_use_variables`). This covers:
+
+            * irreversible reactions, which never need a backward (resp.
+              forward) use variable
+            * blocked reactions, which need none
+            * reactions whose bounds force a net flux in one direction
+            * reactions without thermodynamics that can only go one way,
+              for which the use variable does not constrain anything
+
+        Call it again if the flux bounds are tightened afterwards. The flux
+        bounds must not be loosened afterwards, see
+        :func:`~.pytfa.ThermoModel.eliminate_use_variables`.
+
+        :return: the number of binary variables removed
+        """
+
+        values = dict()
+
+        for rxn in self.reactions:
+            fu_name = ForwardUseVariable.prefix + rxn.id
+            bu_name = BackwardUseVariable.prefix + rxn.id
+            has_thermo = DeltaG.prefix + rxn.id in self._var_dict
+
+            can_fwd = rxn.upper_bound > 0
+            can_bwd = rxn.lower_bound < 0
+
+            if fu_name in self._var_dict:
+                if not can_fwd:
+                    values[fu_name] = 0
+                elif rxn.lower_bound > 0 or not (has_thermo or can_bwd):
+                    values[fu_name] = 1
+
+            if bu_name in self._var_dict:
+                if not can_bwd:
+                    values[bu_name] = 0
+                elif rxn.upper_bound < 0 or not (has_thermo or can_fwd):
+                    values[bu_name] = 1
+
+        self.eliminate_use_variables(values)
+
+        self.logger.info('# Presolve removed {} binary variables'
+                         .format(len(values)))
+
+        return len(values)
+
+    def eliminate_use_variables(self, values):
+        """
+        Fixes use variables at the given values and removes them from the
+        problem, together with the constraints that only served to couple
+        them. Their effect is carried over as bounds:
+
+            * FU_rxn = 0 (resp. BU_rxn = 0) sets the forward (resp. backward)
+              flux of the reaction to 0
+            * the DeltaG coupling becomes a bound on the DeltaG of the reaction,
+              e.g. FU_rxn = 1 gives DGR_rxn <= -epsilon
+
+        If a use variable is fixed at 1, its counterpart is fixed at 0. The
+        fixed values are kept in self._fixed_vars, so that
+        :func:`~.pytfa.core.model.LCSBModel.get_solution` still reports them.
+
+        Once a direction is eliminated, only the flux bounds of the reaction
+        block it: loosening them afterwards allows flux in that direction
+        without any use variable or DeltaG coupling. Convert the cobra_model
+        again to change these bounds. Inside a `with model:` block, the
+        elimination is undone on exit.
+
+        :param dict values: {use variable name: 0 or 1}
+        :return:
+        """
+
+        values = {k:int(round(v)) for k,v in values.items()}
+
+        # Fixing one direction to 1 forbids the other
+        for name, value in list(values.items()):
+            if value != 1:
+                continue
+            use_var = self._var_dict[name]
+            if isinstance(use_var, ForwardUseVariable):
+                other = BackwardUseVariable.prefix + use_var.id
+            else:
+                other = ForwardUseVariable.prefix + use_var.id
+            if other in self._var_dict:
+                values.setdefault(other, 0)
+
+        variables = list()
+        constraints = dict()
+        deltag_bounds = list()
+
+        for name, value in values.items():
+            use_var = self._var_dict[name]
+            rxn = use_var.reaction
+
+            if isinstance(use_var, ForwardUseVariable):
+                direction_coupling = ForwardDirectionCoupling
+                deltag_coupling = ForwardDeltaGCoupling
+            else:
+                direction_coupling = BackwardDirectionCoupling
+                deltag_coupling = BackwardDeltaGCoupling
+
+            # UF_rxn: F_rxn - M FU_rxn < 0
+            if value == 0:
+                if isinstance(use_var, ForwardUseVariable):
+                    rxn.upper_bound = min(rxn.upper_bound, 0)
+                else:
+                    rxn.lower_bound = max(rxn.lower_bound, 0)
+
+            # FU_rxn: 1000 FU_rxn + DGR_rxn < 1000 - epsilon
+            # BU_rxn: 1000 BU_rxn - DGR_rxn < 1000 - epsilon
+            dg_coupling = self._cons_dict.get(deltag_coupling.prefix + rxn.id)
+            if dg_coupling is not None:
+                DGR = self._var_dict[DeltaG.prefix + rxn.id].variable
+                coupling = dg_coupling.constraint
+                coeff = coupling.get_linear_coefficients([use_var.variable])
+                bound = coupling.ub - coeff[use_var.variable] * value
+                deltag_bounds.append((DGR, DGR.lb, DGR.ub))
+                if isinstance(use_var, ForwardUseVariable):
+                    DGR.ub = min(DGR.ub, bound)
+                else:
+                    DGR.lb = max(DGR.lb, -bound)
+                constraints[dg_coupling.name] = dg_coupling
+
+            # SU_rxn: FU_rxn + BU_rxn <= 1 is satisfied by the fixed values
+            for kind in [direction_coupling, SimultaneousUse]:
+                cons = self._cons_dict.get(kind.prefix + rxn.id)
+                if cons is not None:
+                    constraints[cons.name] = cons
+
+            variables.append(use_var)
+
+        # Remove everything in two calls, it is much faster for the solver.
+        # The constraints go first, so that they keep the use variables in
+        # their expression if they are added back on leaving a context
+        cons_to_remove = [x.constraint for x in constraints.values()]
+        vars_to_remove = [x.variable for x in variables]
+
+        # In a `with model:` block, cobra puts the flux bounds and the solver
+        # variables back on exit. The rest is undone here, last, once the
+        # solver variables are back
+        context = get_context(self)
+        if context:
+            context(partial(self._undo_elimination,
+                            variables, list(constraints.values()),
+                            dict(self._fixed_vars), deltag_bounds))
+
+        for cons in constraints.values():
+            self._cons_dict.pop(cons.name)
+        for var in variables:
+            self._var_dict.pop(var.name)
+
+        self.remove_cons_vars(cons_to_remove)
+        self.solver.update()
+        self.remove_cons_vars(vars_to_remove)
+        self._fixed_vars.update(values)
+
+        self.repair()
+
+    def _undo_elimination(self, variables, constraints, fixed_vars,
+                          deltag_bounds):
+        """
+        Restores the use variables and constraints removed by
+        :func:`eliminate_use_variables`, when leaving a model context
+        """
+        for var in variables:
+            self._var_dict[var.name] = var
+        for cons in constraints:
+            self._cons_dict[cons.name] = cons
+        self._fixed_vars = fixed_vars
+        for var, lb, ub in reversed(deltag_bounds):
+            var.set_bounds(lb, ub)
+
+        self.repair()
+
     def print_info(self, specific = False):
         """
         Print information and counts for the cobra_model
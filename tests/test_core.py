@@ -156,3 +156,166 @@ def test_objective_value():
     tmodel.optimize()
     assert(relative_error(tmodel.objective.value, objective_value) < test_precision)
 
+
+def test_presolve():
+    from settings import cobra_model, thermo_data
+    from pytfa.optim.variables import ForwardUseVariable, BackwardUseVariable
+
+    presolved = pytfa.ThermoModel(thermo_data, cobra_model)
+    presolved.solver = 'optlang-glpk'
+    presolved.prepare()
+    presolved.convert(presolve=True)
+
+    n_binaries = 2*len(presolved.reactions)
+    assert(len(presolved._fixed_vars) > 0)
+    assert(len(presolved.forward_use_variable)
+           + len(presolved.backward_use_variable)
+           + len(presolved._fixed_vars) == n_binaries)
+
+    solution = presolved.optimize()
+    assert(relative_error(solution.objective_value, objective_value) < test_precision)
+
+    # The eliminated use variables are still reported
+    for rxn in presolved.reactions:
+        assert(ForwardUseVariable.prefix + rxn.id in solution.raw)
+        assert(BackwardUseVariable.prefix + rxn.id in solution.raw)
+    assert(solution.raw.index.is_unique)
+
+    # Copies do not share the eliminated variables
+    copied = presolved.copy()
+    assert(copied._fixed_vars == presolved._fixed_vars)
+    assert(copied._fixed_vars is not presolved._fixed_vars)
+
+def test_presolve_context():
+    from settings import cobra_model, thermo_data
+
+    model = pytfa.ThermoModel(thermo_data, cobra_model)
+    model.solver = 'optlang-glpk'
+    model.prepare()
+    model.convert()
+
+    n_variables = len(model.variables)
+    n_constraints = len(model.constraints)
+    n_var_dict = len(model._var_dict)
+    n_cons_dict = len(model._cons_dict)
+    dg_bounds = {x.name: (x.variable.lb, x.variable.ub)
+                 for x in model.delta_g}
+
+    with model:
+        assert(model.presolve() > 0)
+        assert(len(model.variables) < n_variables)
+
+    # Everything is back: solver, bookkeeping and bounds
+    assert(len(model.variables) == n_variables)
+    assert(len(model.constraints) == n_constraints)
+    assert(len(model._var_dict) == n_var_dict)
+    assert(len(model._cons_dict) == n_cons_dict)
+    assert(len(model._fixed_vars) == 0)
+    assert(dg_bounds == {x.name: (x.variable.lb, x.variable.ub)
+                         for x in model.delta_g})
+
+    solution = model.optimize()
+    assert(relative_error(solution.objective_value, objective_value) < test_precision)
+
+def test_compact():
+    from settings import cobra_model, thermo_data
+    from pytfa.optim.variables import DeltaGstd
+
+    compact = pytfa.ThermoModel(thermo_data, cobra_model)
+    compact.solver = 'optlang-glpk'
+    compact.prepare()
+    compact.convert(compact=True)
+
+    assert(len(compact.variables) < len(tmodel.variables))
+    assert(DeltaGstd.__name__ not in compact._var_kinds)
+
+    solution = compact.optimize()
+    assert(relative_error(solution.objective_value, objective_value) < test_precision)
+
+    # The folded variables are still reported, and within their bounds
+    for this_dgo in tmodel.delta_gstd:
+        value = solution.raw[this_dgo.name]
+        assert(this_dgo.variable.lb - test_precision
+               <= value
+               <= this_dgo.variable.ub + test_precision)
+
+    # get_primal reports them too
+    from pytfa.optim.utils import get_primal
+    dgo_values = get_primal(compact, DeltaGstd)
+    assert(len(dgo_values) == len(tmodel.delta_gstd))
+    assert(DeltaGstd.__name__ not in compact._var_kinds)
+    for this_dgo in tmodel.delta_gstd:
+        assert(abs(dgo_values[this_dgo.name]
+                   - solution.raw[this_dgo.name]) < test_precision)
+
+    # There is no DeltaGstd variable to relax
+    from pytfa.optim.relaxation import relax_dgo, relax_model
+    with pytest.raises(ValueError):
+        relax_dgo(compact)
+    with pytest.raises(ValueError):
+        relax_model(compact, dgo=True)
+
+    # Scaling does not change the folded values
+    from pytfa.optim.utils import compute_scaling_factors, \
+        apply_scaling_factors
+    factors = compute_scaling_factors(compact)
+    assert((factors != 1).any())
+    apply_scaling_factors(compact, factors)
+
+    # The same point, in the scaled variables
+    primals = {name: value / factors.get(name, 1)
+               for name, value in solution.raw.items()
+               if name in compact.variables}
+    folded = compact.get_eliminated_values(primals)
+    for this_dgo in tmodel.delta_gstd:
+        assert(abs(folded[this_dgo.name] - solution.raw[this_dgo.name])
+               < test_precision)
+
+    scaled = compact.optimize()
+    for this_dgo in tmodel.delta_gstd:
+        value = scaled.raw[this_dgo.name]
+        assert(this_dgo.variable.lb - test_precision
+               <= value
+               <= this_dgo.variable.ub + test_precision)
+
+def test_directionality_lp():
+    # pytfa.analysis needs the sampling module of cobra
+    pytest.importorskip('cobra.flux_analysis.sampling')
+    from pytfa.analysis.manipulation import apply_directionality_lp
+
+    solution = tmodel.optimize()
+    lp = apply_directionality_lp(tmodel, solution)
+
+    assert(not lp.solver.is_integer)
+    assert(tmodel.solver.is_integer)
+
+    lp_solution = lp.optimize()
+    assert(relative_error(lp_solution.objective_value, objective_value) < test_precision)
+
+    # The fixed use variables are still reported
+    for this_use in tmodel.forward_use_variable:
+        assert(this_use.name in lp_solution.raw)
+
+def test_lazy():
+    from settings import cobra_model, thermo_data
+
+    lazy = pytfa.ThermoModel(thermo_data, cobra_model)
+    lazy.solver = 'optlang-glpk'
+    lazy.prepare()
+    lazy.convert(lazy=True)
+
+    assert(not lazy.solver.is_integer)
+
+    # Converting a copy leaves the original untouched
+    pending = list(lazy._lazy_conversion['pending'])
+    copied = lazy.copy()
+    copied.lazy_optimize()
+    assert(len(copied._lazy_conversion['pending']) < len(pending))
+    assert(lazy._lazy_conversion['pending'] == pending)
+
+    solution = lazy.lazy_optimize()
+    assert(relative_error(solution.objective_value, objective_value) < test_precision)
+
+    # Only the reactions with flux got converted
+    assert(len(lazy._lazy_conversion['pending']) > 0)
+    assert(len(lazy.variables) < len(tmodel.variables))
@@ -12,13 +12,72 @@ Tests of the optimization routines of pytfa
 
 from cobra.test import create_test_model
 import os
+import pytest
 import pytfa
 import pytfa.io
 
-from settings import tmodel
+from settings import tmodel, objective_value
 
 
 
+@pytest.fixture
+def forced_dgo():
+    """
+    Forces a reaction to run against its DeltaGstd, fixed at 500, which makes
+    tmodel infeasible. Yields the DeltaGstd; tmodel is restored afterwards.
+    """
+    from pytfa.optim.variables import DeltaGstd
+
+    dgo_vars = tmodel.get_variables_of_type(DeltaGstd)
+
+    with tmodel:
+        tmodel.reactions.Ec_biomass_iJO1366_WT_53p95M.lower_bound = 0
+        solution = tmodel.optimize()
+
+        rxn = next(x for x in tmodel.reactions
+                   if x.id in dgo_vars and solution.fluxes[x.id] > 1)
+        rxn.lower_bound = 1
+        the_dgo = dgo_vars.get_by_id(rxn.id)
+        dgo_bounds = (the_dgo.variable.lb, the_dgo.variable.ub)
+        the_dgo.variable.set_bounds(500, 500)
+
+        try:
+            yield the_dgo
+        finally:
+            the_dgo.variable.set_bounds(*dgo_bounds)
+
+@pytest.fixture
+def adp_conflict():
+    """
+    Forces ADK1 and PFK_3 to run against their DeltaGstd, fixed at 14. ADP is
+    a product of both reactions: the conflict is explained by the two
+    DeltaGstd, or by the log concentration of ADP. Yields the arguments
+    restricting a relaxation to these three variables; tmodel is restored
+    afterwards.
+    """
+    from pytfa.optim.variables import DeltaGstd
+
+    dgo_vars = tmodel.get_variables_of_type(DeltaGstd)
+    rxn_ids = ['ADK1', 'PFK_3']
+
+    with tmodel:
+        tmodel.reactions.Ec_biomass_iJO1366_WT_53p95M.lower_bound = 0
+        dgo_bounds = dict()
+        for rxn_id in rxn_ids:
+            tmodel.reactions.get_by_id(rxn_id).lower_bound = 1
+            the_dgo = dgo_vars.get_by_id(rxn_id).variable
+            dgo_bounds[the_dgo] = (the_dgo.lb, the_dgo.ub)
+            the_dgo.set_bounds(14, 14)
+
+        try:
+            yield dict(reactions_to_ignore=[x.id for x in tmodel.reactions
+                                            if x.id not in rxn_ids],
+                       metabolites_to_ignore=[x.id for x in tmodel.metabolites
+                                              if x.id != 'adp_c'])
+        finally:
+            for the_dgo, bounds in dgo_bounds.items():
+                the_dgo.set_bounds(*bounds)
+
 def test_variable_addition():
     global tmodel
     from pytfa.optim.variables import DeltaGstd
@@ -62,6 +121,22 @@ def test_constraint_addition():
     assert the_name not in tmodel.constraints
     assert cons1 not in getattr(tmodel, cons1.__attrname__)
 
+def test_heuristic():
+    global tmodel
+    from pytfa.optim.heuristics import warm_start, heuristic_optimize
+
+    solution, bound = warm_start(tmodel)
+
+    # The point is feasible for the MILP, and the cobra_model is restored
+    assert solution is not None
+    assert solution.objective_value <= bound + 1e-6
+    assert tmodel.solver.is_integer
+    for var in tmodel.variables:
+        assert var.lb - 1e-6 <= solution.raw[var.name] <= var.ub + 1e-6
+
+    solution = heuristic_optimize(tmodel)
+    assert abs(solution.objective_value - objective_value) < 1e-5
+
 def test_relax_dgo():
     global tmodel
     from pytfa.optim.relaxation import relax_dgo
@@ -70,6 +145,275 @@ def test_relax_dgo():
     tmodel.optimize()
     relax_dgo(tmodel)
 
+def test_relax_dgo_inplace(forced_dgo):
+    global tmodel
+    from pytfa.optim.relaxation import relax_dgo_inplace
+    from pytfa.optim.variables import DeltaGstd
+
+    dgo_vars = tmodel.get_variables_of_type(DeltaGstd)
+    n_variables = len(tmodel.variables)
+    direction = tmodel.objective.direction
+
+    relax_table = relax_dgo_inplace(tmodel)
+
+    # The slacks and the objective are removed
+    assert relax_table is not None
+    assert len(tmodel.variables) == n_variables
+    assert tmodel.objective.direction == direction
+
+    # The relaxed bounds make the cobra_model feasible
+    bounds = {x: (x.variable.lb, x.variable.ub)
+              for x in dgo_vars if x.id in relax_table.index}
+    for var in bounds:
+        var.variable.set_bounds(relax_table.loc[var.id, 'lb_out'],
+                                relax_table.loc[var.id, 'ub_out'])
+    tmodel.slim_optimize()
+    assert tmodel.solver.status == 'optimal'
+
+    for var, (lb, ub) in bounds.items():
+        var.variable.set_bounds(lb, ub)
+
+def test_relax_lc(adp_conflict):
+    global tmodel
+    from pytfa.optim.relaxation import relax_lc
+
+    the_lc = tmodel.log_concentration.adp_c.variable
+    lc_bounds = (the_lc.lb, the_lc.ub)
+    metabolites_to_ignore = adp_conflict['metabolites_to_ignore']
+
+    # A lower concentration of ADP makes the reactions feasible
+    relaxed_model, slack_model, relax_table = relax_lc(
+        tmodel, metabolites_to_ignore=metabolites_to_ignore)
+
+    assert slack_model is None
+    assert list(relax_table.index) == ['adp_c']
+    assert relax_table.loc['adp_c', 'lb_change'] > 0
+    assert relaxed_model.solver.status == 'optimal'
+    # The model is not changed
+    assert (the_lc.lb, the_lc.ub) == lc_bounds
+
+    relaxed_model, _, relax_table = relax_lc(
+        tmodel, metabolites_to_ignore=metabolites_to_ignore, in_place=True)
+
+    assert relaxed_model is tmodel
+    assert list(relax_table.index) == ['adp_c']
+    assert the_lc.lb == relax_table.loc['adp_c', 'lb_out']
+    assert tmodel.solver.status == 'optimal'
+
+    the_lc.set_bounds(*lc_bounds)
+
+def test_relax_model(forced_dgo):
+    global tmodel
+    from pytfa.optim.relaxation import relax_model
+
+    the_dgo = forced_dgo.variable
+    n_variables = len(tmodel.variables)
+    n_constraints = len(tmodel.constraints)
+
+    # Joint relaxation, with the number of relaxed variables as
+    # objective. Relaxing the DeltaGstd is made cheaper.
+    relax_table = relax_model(tmodel, dgo=True, lc=True,
+                              objective='count',
+                              weights={the_dgo.name: 0.1})
+
+    assert relax_table is not None
+    assert list(relax_table.index) == [the_dgo.name]
+    assert len(tmodel.variables) == n_variables
+    assert len(tmodel.constraints) == n_constraints
+
+def test_relax_iis(forced_dgo):
+    global tmodel
+    from pytfa.optim.relaxation import relax_iis
+
+    the_dgo = forced_dgo.variable
+
+    # The forced DeltaGstd is the only bound in conflict
+    relax_table = relax_iis(tmodel)
+
+    assert relax_table is not None
+    assert list(relax_table.index) == [the_dgo.name]
+    assert (the_dgo.lb, the_dgo.ub) == (500, 500)
+
+def test_enumerate_relaxations(forced_dgo):
+    global tmodel
+    from pytfa.optim.relaxation import enumerate_relaxations, \
+        _relaxation_candidates, _add_relaxation, _enumerate_partition
+
+    the_dgo = forced_dgo.variable
+    n_constraints = len(tmodel.constraints)
+
+    # Only the forced DeltaGstd can explain the infeasibility
+    for processes in [1, 2]:
+        tables = list(enumerate_relaxations(tmodel, max_relaxations=3,
+                                            processes=processes))
+        assert [list(x.index) for x in tables] == [[the_dgo.name]]
+        assert len(tmodel.constraints) == n_constraints
+
+    # A partition where another variable is forced to be relaxed only
+    # returns the minimal relaxation
+    candidates = _relaxation_candidates(tmodel, True, False, (), ())
+    with tmodel:
+        slacks, indicators = _add_relaxation(tmodel, candidates, 'count',
+                                             dict())
+        epsilon = tmodel.solver.configuration.tolerances.feasibility
+        data = (tmodel, candidates, slacks, indicators, epsilon, None)
+        other = next(x for x in candidates if x != the_dgo.name)
+        tables = list(_enumerate_partition(data, 1, [other], [], 2))
+        assert [list(x.index) for x in tables] == [[the_dgo.name]]
+
+def test_enumerate_relaxations_parallel(adp_conflict):
+    global tmodel
+    from pytfa.optim.relaxation import enumerate_relaxations
+
+    # The concentration of ADP is more expensive to relax: the second
+    # relaxation is found in a partition where DGo_ADK1 is forced, and the
+    # workers only return minimal ones
+    tables = [frozenset(x.index) for x in enumerate_relaxations(
+        tmodel, lc=True, weights={'LC_adp_c': 3}, max_relaxations=2,
+        processes=2, **adp_conflict)]
+
+    assert set(tables) == {frozenset(['DGo_ADK1', 'DGo_PFK_3']),
+                           frozenset(['LC_adp_c'])}
+    assert len(set(tables)) == len(tables)
+    assert not any(x < y for x in tables for y in tables)
+
+def test_relax_tiered(forced_dgo):
+    global tmodel
+    from pytfa.optim.relaxation import relax_tiered
+
+    # The LP relaxation is feasible, the LP of a profile explains the
+    # infeasibility
+    relax_table, tier, times = relax_tiered(tmodel, apply=True)
+
+    assert tier == 'profile'
+    assert list(times.index) == ['lp', 'profile']
+    assert forced_dgo.name in relax_table.index
+
+    tmodel.slim_optimize()
+    assert tmodel.solver.status == 'optimal'
+
+    for name, row in relax_table.iterrows():
+        tmodel.variables.get(name).set_bounds(row['lb_in'], row['ub_in'])
+
+def test_find_iis(forced_dgo):
+    global tmodel
+    from pytfa.optim.debugging import find_iis
+    from pytfa.optim.variables import DeltaGstd
+
+    dgo_vars = tmodel.get_variables_of_type(DeltaGstd)
+    n_variables = len(tmodel.variables)
+    n_constraints = len(tmodel.constraints)
+
+    out_c, out_v = find_iis(tmodel, constraints=[], variables=dgo_vars)
+
+    assert out_c == []
+    assert out_v == [forced_dgo]
+    assert (forced_dgo.variable.lb, forced_dgo.variable.ub) == (500, 500)
+    assert len(tmodel.variables) == n_variables
+    assert len(tmodel.constraints) == n_constraints
+
+def test_scaling():
+    global tmodel
+    from pytfa.optim.debugging import conditioning_report
+    from pytfa.optim.utils import compute_scaling_factors, \
+        apply_scaling_factors
+
+    rows, columns, types = conditioning_report(tmodel)
+    assert len(rows) == len(tmodel.constraints)
+    assert len(columns) == len(tmodel.variables)
+    assert types['n'].sum() == len(tmodel.constraints)
+
+    with tmodel:
+        tmodel.reactions.Ec_biomass_iJO1366_WT_53p95M.lower_bound = 0
+        value = tmodel.slim_optimize()
+
+        factors = compute_scaling_factors(tmodel)
+        apply_scaling_factors(tmodel, factors)
+
+        scaled_rows, _, _ = conditioning_report(tmodel)
+        assert scaled_rows['range'].mean() < rows['range'].mean()
+        assert abs(tmodel.slim_optimize() - value) < 1e-5
+
+        # Back to the original problem
+        apply_scaling_factors(tmodel, {name: 1 for name in factors.index})
+        unscaled_rows, _, _ = conditioning_report(tmodel)
+        assert (unscaled_rows['range'] - rows['range']).abs().max() < 1e-9
+
+def test_linearize_products():
+    global tmodel
+    from pytfa.optim.reformulation import linearize_products
+    from pytfa.optim.variables import ForwardUseVariable
+
+    fu_vars = tmodel.get_variables_of_type(ForwardUseVariable)[:20]
+    binaries = [x.variable for x in fu_vars]
+    fluxes = [tmodel.reactions.get_by_id(x.id).forward_variable
+              for x in fu_vars]
+
+    for method, n_cons in [('glover', 4), ('petersen', 3)]:
+        with tmodel:
+            tmodel.reactions.Ec_biomass_iJO1366_WT_53p95M.lower_bound = 0
+            n_constraints = len(tmodel.constraints)
+
+            products, constraints = linearize_products(tmodel, binaries,
+                                                       fluxes, U=1e5,
+                                                       method=method)
+
+            assert len(tmodel.constraints) == n_constraints + 20 * n_cons
+            # U is tightened by the bounds of the fluxes
+            assert all(z.ub == x.ub for z, x in zip(products, fluxes))
+
+            # The integrality tolerance is multiplied by U
+            tmodel.optimize()
+            for z, b, x in zip(products, binaries, fluxes):
+                assert abs(z.primal - round(b.primal) * x.primal) < 1e-3
+
+    # Petersen needs x >= 0 from its bounds, a given L >= 0 is not enough
+    x = tmodel.problem.Variable('x', lb=-1, ub=10)
+    with pytest.raises(ValueError):
+        linearize_products(tmodel, binaries[:1], [x], L=0, method='petersen')
+    x.lb = None
+    with pytest.raises(ValueError):
+        linearize_products(tmodel, binaries[:1], [x], L=0, method='petersen')
+
+def test_get_continuous_model():
+    global tmodel
+    from pytfa.optim.utils import get_continuous_model, \
+        strip_from_integer_variables, get_directionality_profile
+    from pytfa.optim.constraints import NegativeDeltaG
+
+    with tmodel:
+        tmodel.reactions.Ec_biomass_iJO1366_WT_53p95M.lower_bound = 0
+        solution = tmodel.optimize()
+
+        relaxed = get_continuous_model(tmodel, method='relax')
+        assert not relaxed.solver.is_integer
+        assert len(relaxed.variables) == len(tmodel.variables)
+        assert relaxed.slim_optimize() >= solution.objective_value - 1e-6
+
+        # The LP of the directionality profile has the same optimum
+        fixed_vars = dict(tmodel._fixed_vars)
+        raw = solution.raw.copy()
+        profile = get_directionality_profile(tmodel, solution)
+        fixed = get_continuous_model(tmodel, method='fix', values=profile)
+        assert not fixed.solver.is_integer
+        assert abs(fixed.slim_optimize() - solution.objective_value) < 1e-5
+        assert all(fixed._fixed_vars[k] == v for k, v in profile.items())
+
+        # By default, the values of the last solution are used
+        default = get_continuous_model(tmodel, method='fix')
+        assert abs(default.slim_optimize() - solution.objective_value) < 1e-5
+
+        # The source model is left unchanged
+        assert tmodel._fixed_vars == fixed_vars
+        assert solution.raw.equals(raw)
+        assert tmodel.solver.is_integer
+
+        # Only the constraints with integer variables are removed
+        stripped = strip_from_integer_variables(tmodel)
+        assert not stripped.solver.is_integer
+        assert len(stripped.get_constraints_of_type(NegativeDeltaG)) \
+               == len(tmodel.get_constraints_of_type(NegativeDeltaG))
+
 def test_change_expression():
     global tmodel
     cons = list(tmodel._cons_dict.values())[0]
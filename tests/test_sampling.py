@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: pytfa
+   :platform: Unix, Windows
+   :synopsis: Thermodynamics-based Flux Analysis
+
+.. moduleauthor:: pyTFA team
+
+Tests for the samplers of pytfa.analysis
+
+
+"""
+
+import json
+import numpy as np
+import pytest
+import pytfa
+from cobra.test import create_test_model
+
+# pytfa.analysis needs the sampling module of cobra
+pytest.importorskip('cobra.flux_analysis.sampling')
+
+from pytfa.analysis.sampling import GeneralizedACHRSampler, \
+    GeneralizedOptGPSampler, GeneralizedBatchSampler, GeneralizedCHRSampler, \
+    ProfileSampler, ConcentrationSampler, save_sampler, load_sampler, \
+    stream_samples, sample_to_file, effective_sample_size, split_rhat, \
+    clear_warmup_cache
+from pytfa.optim.utils import get_directionality_profile
+from pytfa.optim.variables import ForwardUseVariable, BackwardUseVariable
+from settings import tmodel, thermo_data
+
+# Maximal violation of the bounds and of the equalities by a sample
+sampling_tol = 1e-6
+equality_tol = 1e-8
+
+# The other tests can leave the growth forced
+tmodel.reactions.Ec_biomass_iJO1366_WT_53p95M.lower_bound = 0
+solution = tmodel.optimize()
+profile = get_directionality_profile(tmodel, solution)
+
+# A small LP, quick to warm up
+textbook = pytfa.ThermoModel(thermo_data, create_test_model('textbook'))
+textbook.solver = 'optlang-glpk'
+
+methods = ['achr', 'optgp', 'batch', 'chr']
+samplers = {'achr': GeneralizedACHRSampler,
+            'batch': GeneralizedBatchSampler,
+            'chr': GeneralizedCHRSampler}
+
+
+def get_sampler(method, model=textbook, **kwargs):
+    if method == 'optgp':
+        return GeneralizedOptGPSampler(model, 1, **kwargs)
+    return samplers[method](model, **kwargs)
+
+
+def check_samples(sampler, samples):
+    """
+    Checks that all the samples satisfy the equalities, the bounds and the
+    inequalities of the problem of the sampler
+    """
+    problem = sampler.problem
+    values = samples[[x.name for x in sampler.model.variables]].values
+
+    residual = values.dot(problem.equalities.T) - problem.b
+    assert(np.abs(residual).max() < equality_tol)
+
+    lb, ub = problem.variable_bounds
+    assert((values >= lb - sampling_tol).all())
+    assert((values <= ub + sampling_tol).all())
+
+    if problem.inequalities.shape[0] > 0:
+        activities = values.dot(problem.inequalities.T)
+        assert((activities >= problem.bounds[0, ] - sampling_tol).all())
+        assert((activities <= problem.bounds[1, ] + sampling_tol).all())
+
+
+@pytest.mark.parametrize('method', methods)
+def test_sampler_feasibility(method):
+    sampler = get_sampler(method, seed=1)
+    samples = sampler.sample(50, fluxes=False)
+
+    assert(len(samples) == 50)
+    check_samples(sampler, samples)
+    # The chains move
+    assert(samples.std().max() > 1)
+
+
+@pytest.mark.parametrize('method', methods)
+def test_seed(method):
+    first = get_sampler(method, seed=3).sample(20, fluxes=False)
+    second = get_sampler(method, seed=3).sample(20, fluxes=False)
+    other = get_sampler(method, seed=4).sample(20, fluxes=False)
+
+    assert(np.array_equal(first.values, second.values))
+    assert(not np.array_equal(first.values, other.values))
+
+
+@pytest.mark.parametrize('method', ['achr', 'batch'])
+def test_profile_sampler(method):
+    # Both directions of a reaction at once
+    rxn_id = tmodel.forward_use_variable[0].id
+    infeasible = dict(profile)
+    infeasible[ForwardUseVariable.prefix + rxn_id] = 1
+    infeasible[BackwardUseVariable.prefix + rxn_id] = 1
+
+    sampler = ProfileSampler(tmodel, {'optimum': solution,
+                                      'infeasible': infeasible},
+                             method=method, thinning=10, seed=1)
+    samples = sampler.sample(200)
+
+    assert(list(samples.index.levels[0]) == ['optimum'])
+    assert(list(sampler.profiles) == ['optimum'])
+    assert(sampler.infeasible == ['infeasible'])
+    # The model is restored
+    assert(tmodel.solver.is_integer)
+
+    check_samples(sampler.samplers['optimum'], samples.loc['optimum'])
+
+    # The samples follow the profile
+    for name, value in profile.items():
+        assert(np.allclose(samples[name], value))
+
+
+def test_parallel_warmup():
+    sampler = GeneralizedACHRSampler(textbook, seed=1, processes=2,
+                                     cache=False)
+    again = GeneralizedACHRSampler(textbook, seed=1, processes=2,
+                                   cache=False)
+
+    # The points do not depend on the timing of the processes
+    assert(np.array_equal(sampler.warmup, again.warmup))
+
+    # The warmup points are feasible
+    warmup = np.array(sampler.warmup[:sampler.n_warmup], dtype=float)
+    problem = sampler.problem
+    assert(np.abs(warmup.dot(problem.equalities.T)).max() < equality_tol)
+    assert((warmup >= problem.variable_bounds[0, ] - sampling_tol).all())
+    assert((warmup <= problem.variable_bounds[1, ] + sampling_tol).all())
+
+    check_samples(sampler, sampler.sample(20, fluxes=False))
+
+
+def test_stream_samples(tmpdir):
+    expected = GeneralizedACHRSampler(textbook, seed=1).sample(25,
+                                                               fluxes=False)
+
+    sampler = GeneralizedACHRSampler(textbook, seed=1)
+    chunks = list(stream_samples(sampler, 25, chunk_size=10))
+    assert([len(x) for x in chunks] == [10, 10, 5])
+    assert(list(chunks[-1].index) == list(range(20, 25)))
+
+    # The chunks continue the same chains
+    for chunk in chunks:
+        assert(np.allclose(chunk.values, expected.iloc[chunk.index].values,
+                           rtol=0, atol=1e-9))
+
+    filename = str(tmpdir.join('samples.npy'))
+    sampler = GeneralizedACHRSampler(textbook, seed=1)
+    names = sample_to_file(sampler, 25, filename, chunk_size=10)
+
+    array = np.load(filename, mmap_mode='r')
+    assert(array.shape == (25, len(names)))
+    assert(np.allclose(array, expected[names].values, rtol=0, atol=1e-9))
+    with open(str(tmpdir.join('samples.json'))) as fid:
+        assert(json.load(fid)['columns'] == names)
+
+
+def test_diagnostics():
+    random_state = np.random.RandomState(0)
+
+    # Independent draws: no autocorrelation, the chains agree
+    chains = random_state.normal(size=(4, 500, 2))
+    assert(np.allclose(split_rhat(chains), 1, atol=0.02))
+    ess = effective_sample_size(chains)
+    assert((ess > 1000).all())
+
+    # Chains stuck around different values
+    shifted = chains + np.arange(4)[:, None, None]
+    assert((split_rhat(shifted) > 1.5).all())
+
+    # Strongly autocorrelated chains
+    walks = np.cumsum(chains, axis=1)
+    assert((effective_sample_size(walks) < 100).all())
+
+    # Constant variables do not fail
+    assert(split_rhat(np.ones((2, 10, 1)))[0] == 1)
+
+
+def test_sample_until_converged():
+    sampler = GeneralizedOptGPSampler(textbook, 1, thinning=10, seed=1)
+    samples = sampler.sample_until_converged(
+        min_ess=10, max_rhat=2, batch_size=50, max_samples=400, n_chains=2)
+
+    assert(list(samples.index.levels[0]) == [0, 1])
+    check_samples(sampler, samples)
+    assert(set(sampler.diagnostics.columns) == {'ess', 'rhat'})
+    assert(len(sampler.diagnostics) == len(textbook.variables))
+
+
+def test_compact_warmup():
+    full = GeneralizedACHRSampler(textbook, seed=1, cache=False)
+    # Identical points are stored once
+    points = np.array(full.warmup[:full.n_warmup])
+    assert(len(np.unique(points, axis=0)) == full.n_warmup)
+
+    capped = GeneralizedACHRSampler(textbook, seed=1, max_warmup=10,
+                                    cache=False)
+    assert(capped.n_warmup == 10)
+    # The center is the mean of all the distinct points
+    assert(np.allclose(capped.warmup_center, full.warmup_center))
+
+    single = GeneralizedACHRSampler(textbook, seed=1,
+                                    warmup_dtype=np.float32, cache=False)
+    assert(single.warmup.dtype == np.float32)
+    samples = single.sample(20, fluxes=False)
+    lb, ub = single.problem.variable_bounds
+    assert((samples.values >= lb - sampling_tol).all())
+    assert((samples.values <= ub + sampling_tol).all())
+
+
+def test_warmup_cache(tmpdir):
+    cache_dir = str(tmpdir.join('cache'))
+    clear_warmup_cache()
+
+    first = GeneralizedACHRSampler(textbook, seed=1, cache_dir=cache_dir)
+    assert(len(tmpdir.join('cache').listdir()) == 1)
+
+    # From memory
+    second = GeneralizedACHRSampler(textbook, seed=2, cache_dir=cache_dir)
+    assert(np.array_equal(first.warmup, second.warmup))
+
+    # From the disk
+    clear_warmup_cache()
+    third = GeneralizedACHRSampler(textbook, seed=2, cache_dir=cache_dir)
+    assert(np.array_equal(first.warmup, third.warmup))
+    assert(np.allclose(first.warmup_center, third.warmup_center))
+
+    # The cached warmup is the one that would be generated
+    fourth = GeneralizedACHRSampler(textbook, seed=1, cache=False)
+    assert(np.array_equal(first.warmup, fourth.warmup))
+
+    # Another problem has another warmup
+    with textbook:
+        textbook.reactions.ATPM.upper_bound = 10
+        other = GeneralizedACHRSampler(textbook, seed=1, cache_dir=cache_dir)
+    assert(len(tmpdir.join('cache').listdir()) == 2)
+    assert(other.fingerprint() != first.fingerprint())
+
+
+def test_concentration_sampler():
+    sampler = ConcentrationSampler(tmodel, profile, thinning=10, seed=1)
+    check_samples(sampler.sampler, sampler.sampler.sample(20, fluxes=False))
+
+    # The log concentrations are returned by metabolite id
+    samples = sampler.sample(20)
+    for lc in tmodel.log_concentration:
+        assert((samples[lc.id] >= lc.variable.lb - sampling_tol).all())
+        assert((samples[lc.id] <= lc.variable.ub + sampling_tol).all())
+
+
+@pytest.mark.parametrize('method', methods)
+def test_save_load(method, tmpdir):
+    sampler = get_sampler(method, seed=1)
+    sampler.sample(20, fluxes=False)
+    filename = str(tmpdir.join('sampler.pkl'))
+    save_sampler(sampler, filename)
+
+    # The loaded sampler goes on with the same chains
+    expected = sampler.sample(20, fluxes=False)
+    loaded = load_sampler(filename)
+    resumed = loaded.sample(20, fluxes=False)
+
+    assert(np.array_equal(expected.values, resumed.values))
+    assert(loaded.n_samples == sampler.n_samples)
+
+
+@pytest.mark.parametrize('method', methods)
+def test_global_random_state(method, tmpdir):
+    sampler = get_sampler(method, seed=1)
+    filename = str(tmpdir.join('sampler.pkl'))
+    np.random.seed(0)
+    expected = np.random.random(3)
+
+    # Sampling and saving the sampler do not use the global generator
+    np.random.seed(0)
+    sampler.sample(5, fluxes=False)
+    save_sampler(sampler, filename)
+    loaded = load_sampler(filename)
+    assert(np.array_equal(np.random.random(3), expected))
+
+    # The loaded sampler goes on with the same chains
+    assert(np.array_equal(sampler.sample(5, fluxes=False).values,
+                          loaded.sample(5, fluxes=False).values))